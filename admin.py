@@ -0,0 +1,254 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import config
+from database import EXPORT_TABLES
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def is_admin(chat_id):
+    return bool(config.ADMIN_CHAT_ID) and str(chat_id) == str(config.ADMIN_CHAT_ID)
+
+
+class ExportFile:
+    """Файл выгрузки в gzip: строки дописываются пачками, при переполнении - новая часть"""
+
+    def __init__(self, table, fmt, directory=None, part_bytes=config.EXPORT_PART_BYTES):
+        self.table = table
+        self.fmt = fmt
+        self.columns = EXPORT_TABLES[table][2]
+        self.directory = directory
+        self.part_bytes = part_bytes
+        self.part = 0
+        self.rows = 0
+        self.raw = None
+
+    def _open(self):
+        self.part += 1
+        fd, self.path = tempfile.mkstemp(
+            prefix=f"{self.table}-{self.part}-", suffix=f".{self.fmt}.gz", dir=self.directory
+        )
+        self.raw = os.fdopen(fd, 'wb')
+        compressed = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=6)
+        self.text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+        if self.fmt == 'csv':
+            self.csv = csv.writer(self.text)
+            self.csv.writerow(self.columns)
+
+    def _close(self):
+        self.text.close()
+        self.raw.close()
+        self.raw = None
+        return self.path
+
+    def write(self, rows):
+        """Дописывает пачку (ключ пагинации первым столбцом); возвращает путь закрытой части или None"""
+        if self.raw is None:
+            self._open()
+        if self.fmt == 'csv':
+            self.csv.writerows(row[1:] for row in rows)
+        else:
+            self.text.writelines(
+                json.dumps(dict(zip(self.columns, row[1:])), ensure_ascii=False, default=str) + '\n'
+                for row in rows
+            )
+        self.rows += len(rows)
+        # Размер сжатого файла виден с задержкой буфера gzip - в пределе есть запас до 50 МБ
+        if self.raw.tell() >= self.part_bytes:
+            return self._close()
+        return None
+
+    def finish(self):
+        """Закрывает последнюю часть; пустая выгрузка - один файл с заголовком"""
+        if self.raw is None and self.part == 0:
+            self._open()
+        return self._close() if self.raw is not None else None
+
+
+class StreamingExporter:
+    """Выгрузка таблиц для администратора без загрузки таблицы в память.
+
+    Из БД строки читаются пачками по первичному ключу (короткий запрос на
+    пачку, без долгого курсора поперек write-behind записи), форматирование
+    и сжатие - в пуле потоков. В памяти одновременно одна пачка, готовые
+    части отдаются по одной, как только закрыты.
+    """
+
+    def __init__(self, db, batch_size=config.EXPORT_BATCH_SIZE, part_bytes=config.EXPORT_PART_BYTES, directory=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.part_bytes = part_bytes
+        self.directory = directory
+
+    async def export(self, table, fmt='csv'):
+        """Пути к частям выгрузки (gzip); удалять файлы - забота вызывающего"""
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Неизвестная таблица: {table}")
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат: {fmt}")
+
+        loop = asyncio.get_running_loop()
+        output = ExportFile(table, fmt, self.directory, self.part_bytes)
+        started = time.perf_counter()
+        try:
+            async for rows in self.db.iter_export(table, self.batch_size):
+                path = await loop.run_in_executor(None, output.write, rows)
+                if path is not None:
+                    yield path
+            path = await loop.run_in_executor(None, output.finish)
+        except BaseException:
+            if output.raw is not None:
+                output._close()
+                os.remove(output.path)
+            raise
+        if path is not None:
+            yield path
+        logger.info(f"📤 Выгрузка {table}.{fmt}: {output.rows} строк, частей {output.part}, "
+                    f"{time.perf_counter() - started:.1f} с")
+
+
+class Dashboard:
+    """Сводка /admin из счетчиков stats_counters, которые ведут триггеры БД.
+
+    Стоимость не зависит от числа пользователей: одно чтение по первичному
+    ключу счетчиков за окно дат вместо COUNT(*) по таблицам.
+    """
+
+    def __init__(self, db, days=config.ADMIN_DASHBOARD_DAYS):
+        self.db = db
+        self.days = days
+
+    async def text(self, today=None):
+        # Дни счетчиков - по UTC, как метки в таблицах
+        today = today or datetime.utcnow().date()
+        counters = await self.db.get_stats_counters(
+            (today - timedelta(days=self.days - 1)).isoformat(),
+            (today + timedelta(days=7)).isoformat()
+        )
+        return self.render(counters, today)
+
+    def render(self, counters, today):
+        def total(name):
+            return counters.get(('', name), 0)
+
+        def daily(name, day):
+            return counters.get((day.isoformat(), name), 0)
+
+        new, engaged = total('stage:new'), total('stage:engaged')
+        leads = sum(value for (day, name), value in counters.items() if not day and name.startswith('stage:'))
+        premium = total('subscription:premium')
+        conversion = f" ({premium / leads:.1%})" if leads else ''
+
+        lines = [
+            "🛠 <b>АДМИН-ПАНЕЛЬ</b>", "",
+            "<b>Воронка:</b>",
+            f"• новые: {new}",
+            f"• вовлеченные: {engaged}",
+            f"• premium: {premium}{conversion}",
+            f"Всего лидов: {leads}, на пробном периоде: {total('subscription:trial')}",
+            "", "<b>Пробный период заканчивается:</b>"
+        ]
+        ending = [daily('trial_end', today + timedelta(days=i)) for i in range(8)]
+        lines.append(f"• сегодня {ending[0]}, за 3 дня {sum(ending[:4])}, за неделю {sum(ending)}")
+
+        lines += ["", "<b>Активность</b> (активных / реплик AI / регистраций):"]
+        for i in range(self.days):
+            day = today - timedelta(days=i)
+            lines.append(
+                f"• {day.strftime('%d.%m')}: {daily('active_users', day)} / "
+                f"{daily('messages', day)} / {daily('registrations', day)}"
+            )
+        return '\n'.join(lines)
+
+
+def benchmark(users=20000, messages=200000):
+    """Выгрузка большой таблицы (время, пик памяти) и дашборд против COUNT(*) по таблицам"""
+    import sqlite3
+    import tracemalloc
+    from database import Database
+
+    with tempfile.TemporaryDirectory(prefix='fitfriends-admin-') as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        conn = sqlite3.connect(db.db_path)
+        start = datetime.utcnow() - timedelta(days=30)
+        conn.executemany(
+            "INSERT INTO users (user_id, first_name, subscription_type, subscription_end, registration_date) "
+            "VALUES (?, ?, ?, ?, ?)",
+            ((u, f"user{u}", 'premium' if u % 20 == 0 else 'trial',
+              (start + timedelta(days=u % 37)).date().isoformat(),
+              (start + timedelta(days=u % 30)).isoformat(' ')) for u in range(users))
+        )
+        conn.executemany("INSERT INTO leads (user_id, stage) VALUES (?, ?)",
+                         ((u, 'engaged' if u % 3 == 0 else 'new') for u in range(users)))
+        conn.executemany(
+            "INSERT INTO conversation_messages (user_id, ts, user_message, bot_response) VALUES (?, ?, ?, ?)",
+            ((i % users, (start + timedelta(seconds=i * 10)).isoformat(), "Как мне похудеть к лету?",
+              "Начните с разминки 10 минут и следите за калориями. " * 4) for i in range(messages))
+        )
+        conn.commit()
+
+        async def scenario():
+            async def run(fmt):
+                size = 0
+                async for path in StreamingExporter(db, directory=tmp).export('conversations', fmt):
+                    size += os.path.getsize(path)
+                    os.remove(path)
+                return size
+
+            for fmt in EXPORT_FORMATS:
+                started = time.perf_counter()
+                size = await run(fmt)
+                elapsed = time.perf_counter() - started
+                tracemalloc.start()
+                await run(fmt)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"Выгрузка {messages} реплик в {fmt}: {elapsed:.2f} с, {size / 1e6:.1f} МБ gzip, "
+                      f"пик памяти {peak / 1e6:.1f} МБ")
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            rows = conn.execute('SELECT * FROM conversation_messages').fetchall()
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"Для сравнения fetchall всей таблицы: {elapsed:.2f} с без записи в файл, "
+                  f"пик памяти {peak / 1e6:.1f} МБ")
+            del rows
+
+            dashboard = Dashboard(db)
+            runs = 100
+            started = time.perf_counter()
+            for _ in range(runs):
+                await dashboard.text()
+            print(f"Дашборд по счетчикам: {(time.perf_counter() - started) / runs * 1000:.2f} мс")
+
+            started = time.perf_counter()
+            for _ in range(runs // 10):
+                conn.execute("SELECT stage, COUNT(*) FROM leads GROUP BY stage").fetchall()
+                conn.execute("SELECT subscription_type, COUNT(*) FROM users GROUP BY 1").fetchall()
+                conn.execute("SELECT subscription_end, COUNT(*) FROM users WHERE subscription_type = 'trial' "
+                             "AND subscription_end BETWEEN date('now') AND date('now', '+7 day') GROUP BY 1").fetchall()
+                conn.execute("SELECT date(ts), COUNT(*), COUNT(DISTINCT user_id) FROM conversation_messages "
+                             "WHERE ts >= date('now', '-7 day') GROUP BY 1").fetchall()
+            print(f"Те же цифры COUNT(*) по таблицам: {(time.perf_counter() - started) / (runs // 10) * 1000:.2f} мс")
+
+
+        asyncio.run(scenario())
+        conn.close()
+        db.close()
+
+
+if __name__ == '__main__':
+    benchmark()
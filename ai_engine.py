@@ -1,137 +1,529 @@
+import asyncio
 import aiohttp
+import hashlib
 import json
-import random
+import logging
+import time
+from collections import deque
 from datetime import datetime
 
+import config
+import metrics
+from catalog import workout_generator
+from database import db
+from intents import intent_matcher
+from nutrition import nutrition_optimizer
+from prompt_builder import prompt_builder
+from response_cache import ResponseCache
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """Провайдер не дал ответа; outcome - метка причины для метрик"""
+
+    def __init__(self, outcome):
+        super().__init__(outcome)
+        self.outcome = outcome
+
+
+class CircuitBreaker:
+    """Предохранитель провайдера по окну последних запросов.
+
+    closed - запросы идут. Когда доля ошибок в окне достигает порога,
+    предохранитель размыкается (open) и запросы не отправляются cooldown
+    секунд. Затем half_open: проходит один пробный запрос, успех замыкает
+    предохранитель, ошибка снова размыкает.
+    """
+
+    def __init__(self, window=config.AI_BREAKER_WINDOW, error_rate=config.AI_BREAKER_ERROR_RATE,
+                 min_requests=config.AI_BREAKER_MIN_REQUESTS, cooldown=config.AI_BREAKER_COOLDOWN):
+        self.results = deque(maxlen=window)  # (успех, задержка в сек)
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.opened_at = 0
+        self.probing = False
+
+    def allow(self):
+        """Можно ли отправить запрос; в half_open занимает единственный пробный слот"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = 'half_open'
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def record(self, ok, latency):
+        self.results.append((ok, latency))
+        if self.state == 'half_open':
+            self.probing = False
+            if ok:
+                self.state = 'closed'
+                self.results.clear()
+                self.results.append((ok, latency))
+            else:
+                self.trip()
+        elif self.state == 'closed' and not ok and len(self.results) >= self.min_requests:
+            if self.errors() >= self.error_rate * len(self.results):
+                self.trip()
+
+    def release(self):
+        """Запрос отменен до результата (проиграл хедж или истек общий предел)"""
+        self.probing = False
+
+    def trip(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.probing = False
+
+    def errors(self):
+        return sum(1 for ok, _ in self.results if not ok)
+
+    def latency(self, q):
+        """Перцентиль задержки успешных запросов в окне или None"""
+        latencies = sorted(latency for ok, latency in self.results if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class Provider:
+    """Модель у конкретного API со своим предохранителем"""
+
+    def __init__(self, name, url, model, api_key, breaker=None):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.breaker = breaker or CircuitBreaker()
+
+
+class ModelRouter:
+    """Выбор провайдера модели: предохранители, переключение и хеджирование.
+
+    Запрос уходит первому провайдеру с замкнутым предохранителем. Если тот
+    не ответил за перцентиль своей задержки, тот же запрос параллельно
+    уходит следующему (хедж); побеждает первый успешный ответ, остальные
+    отменяются. Ошибка провайдера сразу переводит запрос на следующего, а
+    если все предохранители разомкнуты - ошибка без ожидания сети.
+    """
+
+    def __init__(self, providers, hedge_quantile=config.AI_HEDGE_QUANTILE,
+                 hedge_delay=config.AI_HEDGE_DELAY, hedge_min_delay=config.AI_HEDGE_MIN_DELAY):
+        self.providers = providers
+        self.hedge_quantile = hedge_quantile
+        self.default_hedge_delay = hedge_delay
+        self.hedge_min_delay = hedge_min_delay
+
+    def hedge_delay(self, provider):
+        latency = provider.breaker.latency(self.hedge_quantile)
+        if latency is None:
+            return self.default_hedge_delay
+        return max(self.hedge_min_delay, latency)
+
+    async def race(self, attempt, discard=None, timeout=None, settle=True):
+        """(provider, результат attempt(provider)) первого успешного провайдера.
+
+        discard(результат) вызывается для ответов, оказавшихся лишними.
+        ProviderError - если ни один провайдер не ответил, в том числе за
+        timeout секунд: попытки, не успевшие к сроку, считаются ошибкой
+        провайдера (зависший провайдер размыкает предохранитель).
+        settle=False - успех победителя не записывается в предохранитель:
+        результат - (результат attempt, задержка), исход записывает вызывающий
+        через record() или release() (поток может оборваться после заголовков).
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        candidates = list(self.providers)
+        pending = {}
+        last_error = ProviderError('circuit_open')
+        hedged = False
+        expired = False
+
+        def launch():
+            while candidates:
+                provider = candidates.pop(0)
+                if provider.breaker.allow():
+                    pending[asyncio.ensure_future(self.attempt(provider, attempt, settle))] = provider
+                    return provider
+            return None
+
+        current = launch()
+        try:
+            while pending:
+                # Пока есть кому отдать хедж, ждем не дольше задержки текущего провайдера
+                wait = self.hedge_delay(current) if candidates else None
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+                    wait = remaining if wait is None else min(wait, remaining)
+                done, _ = await asyncio.wait(pending, timeout=max(0, wait) if wait is not None else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if deadline is not None and loop.time() >= deadline:
+                        expired = True
+                        raise ProviderError('timeout')
+                    current = launch() or current
+                    hedged = True
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except ProviderError as e:
+                        last_error = e
+                        continue
+                    if hedged:
+                        metrics.ai_hedges.inc(provider.name)
+                    return provider, result
+
+                # Все завершившиеся - с ошибкой: переключаемся, не дожидаясь хеджа
+                if not pending:
+                    current = launch()
+            raise last_error
+        finally:
+            for task in pending:
+                if not task.done():
+                    # Отмена по сроку - ошибка провайдера, проигрыш хеджа или уход вызывающего - нет
+                    task.cancel('timeout' if expired else None)
+                elif not task.cancelled() and task.exception() is None:
+                    result = task.result()
+                    if not settle:
+                        # Лишний, но исправный ответ - успех провайдера
+                        result, latency = result
+                        self.record(pending[task], True, latency)
+                    if discard is not None:
+                        discard(result)
+
+    async def attempt(self, provider, attempt, settle=True):
+        started = time.perf_counter()
+        outcome = 'cancelled'
+        try:
+            result = await attempt(provider)
+            outcome = 'ok'
+            if not settle:
+                return result, time.perf_counter() - started
+            return result
+        except ProviderError as e:
+            outcome = e.outcome
+            raise
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            raise ProviderError(outcome)
+        except asyncio.CancelledError as e:
+            if e.args[:1] == ('timeout',):
+                outcome = 'timeout'
+            raise
+        except Exception:
+            outcome = 'error'
+            raise ProviderError(outcome)
+        finally:
+            elapsed = time.perf_counter() - started
+            if outcome == 'cancelled':
+                provider.breaker.release()
+            elif outcome == 'ok' and not settle:
+                pass
+            else:
+                self.record(provider, outcome == 'ok', elapsed)
+            metrics.ai_provider_seconds.observe(elapsed, provider.name, outcome)
+
+    def record(self, provider, ok, latency):
+        state = provider.breaker.state
+        provider.breaker.record(ok, latency)
+        if provider.breaker.state != state:
+            if provider.breaker.state == 'open':
+                metrics.ai_breaker_trips.inc(provider.name)
+                logger.warning(f"🔌 Предохранитель {provider.name} разомкнут")
+            elif provider.breaker.state == 'closed':
+                logger.info(f"🔌 Предохранитель {provider.name} замкнут")
+
+    def status_text(self):
+        """Состояние провайдеров для /stats (HTML)"""
+        lines = ["<b>Провайдеры AI</b> (ошибок в окне, p95 мс):"]
+        for provider in self.providers:
+            breaker = provider.breaker
+            latency = breaker.latency(0.95)
+            lines.append(
+                f"• {provider.name}: {breaker.state}, {breaker.errors()}/{len(breaker.results)}, "
+                f"{'-' if latency is None else f'{latency * 1000:.0f}'}"
+            )
+        return '\n'.join(lines)
+
+
 class AIFitnessEngine:
     def __init__(self):
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
-        self.api_key = "free"  # Бесплатный доступ
+        self.router = ModelRouter([Provider(**provider) for provider in config.AI_PROVIDERS])
+
+        # Общая keep-alive сессия создается в start() внутри event loop
+        self.session = None
+        self.semaphore = asyncio.Semaphore(config.AI_MAX_CONCURRENCY)
+
+        self.cache = ResponseCache(db)
+        # Одинаковые запросы в полете (рассылка, популярная кнопка) идут к модели один раз
+        self.flights = SingleFlight('ai')
+
+    async def start(self):
+        """Создает долгоживущую HTTP-сессию с пулом соединений и DNS-кэшем"""
+        if self.session is not None and not self.session.closed:
+            return
 
-    async def generate_ai_response(self, user_message, conversation_history):
+        # Хеджированный запрос держит по соединению на каждого провайдера
+        connector = aiohttp.TCPConnector(
+            limit=config.AI_MAX_CONCURRENCY * len(self.router.providers),
+            ttl_dns_cache=config.AI_DNS_CACHE_TTL,
+            keepalive_timeout=60
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=config.AI_CONNECT_TIMEOUT,
+            sock_read=config.AI_READ_TIMEOUT
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        """Закрывает HTTP-сессию"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def generate_ai_response(self, user_message, conversation_history, goal=None, level=None, intents=None,
+                                   summary=None):
         """Генерирует AI-ответ на вопрос пользователя"""
 
-        system_prompt = """
-        Ты - профессиональный AI-фитнес тренер и нутрициолог. Ты помогаешь с:
-        - Персональными тренировками
-        - Планами питания
-        - Мотивацией и поддержкой
-        - Ответами на спортивные вопросы
+        # Общий кэш - только для промптов без личного контекста, остальное - всегда моделью
+        conversation_history, summary = self.dialog_context(conversation_history, summary)
+        cache_key = None
+        if prompt_builder.is_shareable(conversation_history, summary):
+            cache_key = self.cache.make_key(user_message, goal, level)
+            cached = await self.cache.get(cache_key)
+            if cached:
+                metrics.ai_responses.inc('cache')
+                return cached
 
-        Будь дружелюбным, профессиональным и мотивирующим. Давай конкретные советы.
-        """
+        messages = prompt_builder.build_messages(user_message, conversation_history, summary, goal, level)
+        return await self.flights.do(
+            self.flight_key(messages),
+            lambda: self.complete_response(messages, cache_key, user_message, intents)
+        )
+
+    async def complete_response(self, messages, cache_key, user_message, intents):
+        """Ответ модели или резервный; один на все склеенные запросы"""
+        response = await self.request_ai(messages)
+        if response is None:
+            metrics.ai_responses.inc('fallback')
+            return self.get_fallback_response(user_message, intents)
 
+        metrics.ai_responses.inc('model')
+        if cache_key:
+            await self.cache.put(cache_key, response)
+        return response
+
+    def flight_key(self, messages):
+        """Ключ склейки - весь промпт с нормализованной последней репликой: склеиваются
+        только запросы с одинаковым контекстом, чужие реплики и сводка в ответ не попадут"""
+        context = json.dumps(messages[:-1], ensure_ascii=False, sort_keys=True)
+        raw = f"{context}|{self.cache.normalize(messages[-1]['content'])}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def dialog_context(self, conversation_history, summary):
+        """Реплики и сводка для промпта. Вопрос вне текущего диалога отвечается без
+        них: такой промпт не содержит личных данных, и ответ идет в общий кэш"""
+        if self.is_dialog_continuation(conversation_history):
+            return conversation_history, summary
+        return [], None
+
+    def is_dialog_continuation(self, conversation_history):
+        """Ответ зависит от истории, если прошлая реплика была совсем недавно"""
+        if not conversation_history:
+            return False
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    "model": "mistralai/mistral-7b-instruct:free",
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        *conversation_history[-10:],  # Последние 10 сообщений
-                        {"role": "user", "content": user_message}
-                    ],
-                    "max_tokens": 500
-                }
-
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-
-                async with session.post(self.api_url, json=payload, headers=headers) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return result['choices'][0]['message']['content']
-                    else:
-                        return self.get_fallback_response(user_message)
-
-        except Exception as e:
-            return self.get_fallback_response(user_message)
-
-    def get_fallback_response(self, user_message):
-        """Резервные ответы если AI не работает"""
-        fallback_responses = {
-            'привет': 'Привет! Я твой AI-фитнес тренер! 🏋️\nЧем могу помочь? Тренировка, питание или совет?',
-            'треня': 'Отлично! Сгенерирую для тебя персональную тренировку! 💪',
-            'питание': 'Создам идеальный план питания под твои цели! 🥗',
-            'мотивация': 'Ты можешь всё! Каждая тренировка приближает к цели! 🔥',
-            'как похудеть': 'Советую: 1) Дефицит калорий 2) Силовые тренировки 3) Кардио 4) Белок',
-            'как накачаться': 'Фокус на: 1) Прогрессия нагрузок 2) Протеин 3) Восстановление 4) Дисциплина'
-        }
+            last = datetime.fromisoformat(conversation_history[-1]['timestamp'])
+        except (KeyError, TypeError, ValueError):
+            return True
+        return (datetime.utcnow() - last).total_seconds() < config.AI_CACHE_DIALOG_WINDOW
 
-        user_message_lower = user_message.lower()
-        for key, response in fallback_responses.items():
-            if key in user_message_lower:
-                return response
+    async def stream_ai_response(self, user_message, conversation_history, goal=None, level=None, intents=None,
+                                 summary=None):
+        """Отдает ответ по мере генерации: каждый yield - весь накопленный текст"""
+        if not config.AI_STREAMING:
+            yield await self.generate_ai_response(user_message, conversation_history, goal, level, intents, summary)
+            return
 
-        return "Отличный вопрос! Рекомендую тебе индивидуальную программу тренировок и питания. Хочешь, создам её для тебя? 🚀"
+        conversation_history, summary = self.dialog_context(conversation_history, summary)
+        cache_key = None
+        if prompt_builder.is_shareable(conversation_history, summary):
+            cache_key = self.cache.make_key(user_message, goal, level)
+            cached = await self.cache.get(cache_key)
+            if cached:
+                metrics.ai_responses.inc('cache')
+                yield cached
+                return
 
-    def generate_workout_plan(self, user_data):
-        """Генерирует персонализированную тренировку"""
-        level = user_data.get('fitness_level', 'beginner')
-        goals = user_data.get('goals', 'weight_loss')
-
-        workouts = {
-            'weight_loss': {
-                'type': 'Жиросжигающая',
-                'focus': 'Кардио + Силовая',
-                'exercises': [
-                    'Приседания 4x15',
-                    'Берпи 3x10',
-                    'Планка 3x60сек',
-                    'Выпады 3x12',
-                    'Скакалка 5x1мин'
-                ]
-            },
-            'muscle_gain': {
-                'type': 'Мышечная масса',
-                'focus': 'Силовая',
-                'exercises': [
-                    'Приседания 4x8-10',
-                    'Отжимания 4x10-12',
-                    'Подтягивания 3x6-8',
-                    'Ягодичный мостик 4x12',
-                    'Планка 3x45сек'
-                ]
-            }
-        }
+        messages = prompt_builder.build_messages(user_message, conversation_history, summary, goal, level)
+        async for text in self.flights.stream(
+            self.flight_key(messages),
+            lambda: self.stream_response(messages, cache_key, user_message, intents)
+        ):
+            yield text
+
+    async def stream_response(self, messages, cache_key, user_message, intents):
+        """Потоковый ответ модели или резервный; один поток на все склеенные запросы"""
+        text = ''
+        completed = False
+        outcome = 'interrupted'
+        provider = None
+        latency = None
+        started = time.perf_counter()
+        try:
+            await self.start()
+            async with self.semaphore:
+                # Хедж и переключение - до заголовков ответа, дальше читаем поток победителя;
+                # исход попытки записывается один раз, когда поток закончился
+                provider, (response, latency) = await self.router.race(
+                    lambda provider: self.connect(provider, messages),
+                    discard=lambda r: r.close(),
+                    timeout=config.AI_REQUEST_TIMEOUT,
+                    settle=False
+                )
+                async with response:
+                    # Server-Sent Events: строки "data: {...}", конец - "data: [DONE]"
+                    async for raw_line in response.content:
+                        line = raw_line.decode('utf-8').strip()
+                        if not line.startswith('data:'):
+                            continue
+                        data = line[5:].strip()
+                        if data == '[DONE]':
+                            completed = True
+                            break
+                        delta = json.loads(data)['choices'][0].get('delta', {}).get('content')
+                        if delta:
+                            text += delta
+                            yield text
+                # Поток закрылся без [DONE] - ответ оборван
+                outcome = 'ok' if completed else 'error'
+        except ProviderError as e:
+            outcome = e.outcome
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+        except Exception:
+            outcome = 'error'
+        finally:
+            metrics.ai_seconds.observe(time.perf_counter() - started, 'stream', outcome)
+            if provider is not None:
+                if outcome == 'ok':
+                    self.router.record(provider, True, latency)
+                elif outcome in ('timeout', 'error'):
+                    # Обрыв уже начатого потока - ошибка провайдера
+                    self.router.record(provider, False, time.perf_counter() - started)
+                else:
+                    # Читатель ушел сам - провайдер ни при чем
+                    provider.breaker.release()
 
-        workout = workouts.get(goals, workouts['weight_loss'])
+        if not completed or not text:
+            # Оборванный ответ не сохраняется и не кэшируется: вместо него резервный
+            metrics.ai_responses.inc('fallback')
+            metrics.ai_fallbacks.inc(outcome if outcome != 'ok' else 'empty')
+            yield self.get_fallback_response(user_message, intents)
+            return
 
-        return {
-            'date': datetime.now().strftime('%d.%m.%Y'),
-            'type': workout['type'],
-            'focus': workout['focus'],
-            'duration': '35-45 минут',
-            'calories': '250-400 ккал',
-            'exercises': workout['exercises']
+        metrics.ai_responses.inc('model')
+        if cache_key:
+            await self.cache.put(cache_key, text)
+
+    def build_payload(self, provider, messages, stream=False):
+        payload = {
+            "model": provider.model,
+            "messages": messages,
+            "max_tokens": 500
         }
+        if stream:
+            payload["stream"] = True
+        return payload
 
-    def generate_nutrition_plan(self, user_data):
-        """Генерирует план питания"""
-        goals = user_data.get('goals', 'weight_loss')
-
-        plans = {
-            'weight_loss': {
-                'calories': '1800-2000 ккал',
-                'meals': {
-                    'breakfast': 'Овсянка с ягодами и протеином',
-                    'lunch': 'Куриная грудка с гречкой и овощами',
-                    'dinner': 'Рыба на пару с салатом',
-                    'snacks': 'Творог, яблоко, орехи'
-                }
-            },
-            'muscle_gain': {
-                'calories': '2800-3200 ккал',
-                'meals': {
-                    'breakfast': 'Омлет из 4 яиц + овсянка',
-                    'lunch': 'Говядина с рисом и овощами',
-                    'dinner': 'Творог с бананом и орехами',
-                    'snacks': 'Протеин, фрукты, йогурт'
-                }
-            }
+    def headers(self, provider):
+        return {
+            "Authorization": f"Bearer {provider.api_key}",
+            "Content-Type": "application/json"
         }
 
-        return plans.get(goals, plans['weight_loss'])
+    async def complete(self, provider, messages):
+        """Полный ответ одного провайдера"""
+        payload = self.build_payload(provider, messages)
+        async with self.session.post(provider.url, json=payload, headers=self.headers(provider)) as response:
+            if response.status != 200:
+                raise ProviderError(f'http_{response.status}')
+            result = await response.json()
+            return result['choices'][0]['message']['content']
+
+    async def connect(self, provider, messages):
+        """Потоковый запрос к провайдеру: ответ с принятыми заголовками, тело не прочитано"""
+        payload = self.build_payload(provider, messages, stream=True)
+        response = await self.session.post(provider.url, json=payload, headers=self.headers(provider))
+        if response.status != 200:
+            response.release()
+            raise ProviderError(f'http_{response.status}')
+        return response
+
+    async def request_ai(self, messages):
+        """Запрос к модели через роутер провайдеров; None если AI недоступен"""
+        outcome = 'ok'
+        started = time.perf_counter()
+        try:
+            await self.start()
+            async with self.semaphore:
+                _, text = await self.router.race(
+                    lambda provider: self.complete(provider, messages),
+                    timeout=config.AI_REQUEST_TIMEOUT
+                )
+                return text
+
+        except ProviderError as e:
+            outcome = e.outcome
+            return None
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            return None
+        except Exception:
+            outcome = 'error'
+            return None
+        finally:
+            metrics.ai_seconds.observe(time.perf_counter() - started, 'complete', outcome)
+            if outcome != 'ok':
+                metrics.ai_fallbacks.inc(outcome)
+
+    def get_fallback_response(self, user_message, intents=None):
+        """Резервные ответы если AI не работает"""
+        if intents is None:
+            intents = intent_matcher.match(user_message)
+
+        phrases = intents.get('fallback')
+        if phrases:
+            return config.FALLBACK_RESPONSES[phrases[0]]
+
+        return config.DEFAULT_FALLBACK_RESPONSE
+
+    def generate_workout_plan(self, user_data):
+        """Генерирует персонализированную тренировку дня из каталога упражнений"""
+        return workout_generator.plan(
+            user_data.get('user_id'),
+            goals=user_data.get('goals'),
+            level=user_data.get('fitness_level'),
+            location=user_data.get('location')
+        )
+
+    def generate_nutrition_plan(self, user_data):
+        """Генерирует план питания под дневную цель по калориям и белку"""
+        return nutrition_optimizer.plan(
+            user_data.get('user_id'),
+            goals=user_data.get('goals'),
+            level=user_data.get('fitness_level')
+        )
 
 ai_engine = AIFitnessEngine()
\ No newline at end of file
@@ -1,136 +1,186 @@
 import logging
 import asyncio
-import random
-from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import os
+import signal
+from datetime import date, datetime, timedelta
+from telegram import Update
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
 
 import config
-from database import db
+import metrics
+from campaigns import CampaignEngine
+from admin import EXPORT_FORMATS, Dashboard, StreamingExporter, is_admin
+from database import EXPORT_TABLES, db
 from ai_engine import ai_engine
+from intents import intent_matcher
+from prompt_builder import prompt_builder
+import render
+from outbox import RateLimitedSender
+from reminders import ReminderDispatcher
+from scheduler import DelayedMessageQueue, GracefulJobQueue
+from webhook import WebhookServer
+from update_processor import PerUserUpdateProcessor, UpdateQueue
+from log_pipeline import setup_logging
+from sharding import run_ingress
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('pro_bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+_NOT_LOADED = object()
+# Сообщения AI-чату: ответ модели идет секунды
+AI_CHAT = filters.TEXT & ~filters.COMMAND
+
 class FitFriends_bot:
-    def __init__(self, token):
-        self.application = Application.builder().token(token).build()
-        self.setup_handlers()
+    def __init__(self, token, bot=None):
+        builder = Application.builder()
+        # bot передается в тестах и нагрузочных прогонах (например, fakes.FakeBot)
+        if bot is not None:
+            builder = builder.bot(bot)
+        else:
+            builder = builder.token(token)
+            if metrics.registry.enabled:
+                builder = builder.request(metrics.InstrumentedRequest(connection_pool_size=256))
+        builder = (
+            builder
+            .update_queue(UpdateQueue(config.UPDATE_QUEUE_SIZE))
+            .concurrent_updates(PerUserUpdateProcessor(config.UPDATE_WORKERS, max_slow_updates=config.UPDATE_AI_WORKERS,
+                                                       is_slow=self.is_ai_chat))
+            .job_queue(GracefulJobQueue())
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+        )
+        if config.BOT_MODE == 'webhook' or config.WORKER_PROCESSES > 1:
+            # Апдейты приходят в WebhookServer или от ingress-процесса, getUpdates не нужен
+            builder = builder.updater(None)
+        self.application = builder.build()
+        self.outbox = RateLimitedSender()
+        self.reminders = ReminderDispatcher(db, self.outbox)
+        self.delayed = DelayedMessageQueue(db)
+        self.dashboard = Dashboard(db)
+        self.exporter = StreamingExporter(db)
+        self.delayed.register('followup', self.send_followup_message)
+        self.metrics_server = None
+        if metrics.registry.enabled and config.METRICS_PORT:
+            self.metrics_server = metrics.MetricsServer(config.METRICS_HOST, config.METRICS_PORT)
         self.sales_automation = SalesAutomation()
+        self.campaigns = CampaignEngine(
+            db, self.outbox, self.sales_automation.auto_messages,
+            busy=lambda: self.application.update_processor.load() >= config.DRIP_YIELD_LOAD
+        )
+        # Остановка бота прерывает рассылки, а не ждет, пока все адресаты встанут в очередь
+        self.application.job_queue.on_stop += [self.campaigns.stop, self.reminders.stop]
+        self.setup_handlers()
 
     def setup_handlers(self):
+        timed = metrics.instrument_handler
+
         # Команды
-        self.application.add_handler(CommandHandler("start", self.start))
-        self.application.add_handler(CommandHandler("workout", self.quick_workout))
-        self.application.add_handler(CommandHandler("nutrition", self.quick_nutrition))
-        self.application.add_handler(CommandHandler("progress", self.show_progress))
+        self.application.add_handler(CommandHandler("start", timed(self.start)))
+        self.application.add_handler(CommandHandler("workout", timed(self.quick_workout)))
+        self.application.add_handler(CommandHandler("nutrition", timed(self.quick_nutrition)))
+        self.application.add_handler(CommandHandler("progress", timed(self.show_progress)))
+        self.application.add_handler(CommandHandler("stats", self.show_stats))
+        self.application.add_handler(CommandHandler("admin", self.show_admin))
+        self.application.add_handler(CommandHandler("export", self.export))
 
         # Кнопки
-        self.application.add_handler(CallbackQueryHandler(self.button_handler))
+        self.application.add_handler(CallbackQueryHandler(timed(self.button_handler)))
 
         # Все сообщения (AI чат)
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_ai_chat))
+        self.application.add_handler(MessageHandler(AI_CHAT, timed(self.handle_ai_chat)))
+
+        # Напоминания: каждый час, в начале часа
+        now = datetime.now()
+        next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        self.application.job_queue.run_repeating(
+            self.send_reminders,
+            interval=3600,
+            first=(next_hour - now).total_seconds()
+        )
 
-        # Напоминания
-        self.application.job_queue.run_repeating(self.send_reminders, interval=3600, first=10)
+        # Drip-кампании пробного периода; повторный проход досылает только новое
+        self.application.job_queue.run_repeating(self.send_campaigns, interval=config.DRIP_INTERVAL, first=60)
+
+        # Очистка старой истории диалогов
+        self.application.job_queue.run_repeating(self.prune_conversations, interval=600, first=600)
+
+    async def post_init(self, application: Application):
+        """Открывает HTTP-сессию AI и очередь рассылок при запуске бота"""
+        await ai_engine.start()
+        await self.outbox.start(application.bot)
+        await self.delayed.start()
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+
+    async def post_shutdown(self, application: Application):
+        """Досылает очередь рассылок, закрывает HTTP-сессию AI и пул соединений БД"""
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await self.delayed.stop()
+        await self.outbox.stop()
+        await ai_engine.close()
+        await db.flush()
+        db.close()
+
+    @staticmethod
+    def is_ai_chat(update):
+        """Апдейт уйдет в handle_ai_chat: такие занимают не больше UPDATE_AI_WORKERS слотов"""
+        return bool(AI_CHAT.check_update(update))
+
+    async def get_profile(self, context, user_id):
+        """Профиль пользователя: не больше одного чтения за апдейт"""
+        # CallbackContext создается заново для каждого апдейта
+        profile = getattr(context, 'profile', _NOT_LOADED)
+        if profile is _NOT_LOADED:
+            profile = await db.get_user(user_id)
+            context.profile = profile
+        return profile
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
 
         # Регистрация пользователя
-        db.add_user(user.id, user.username, user.first_name, user.last_name)
+        await db.add_user(user.id, user.username, user.first_name, user.last_name)
 
         # Авто-воронка: новый лид
-        db.update_lead_stage(user.id, 'new')
-
-        welcome_text = f"""
-🤖 <b>Добро пожаловать в AI-FITNESS PRO, {user.first_name}!</b>
-
-Я твой персональный <b>AI-тренер, нутрициолог и мотивационный друг</b>!
-
-🎯 <b>Что я умею:</b>
-• 🏋️ Создавать персональные тренировки
-• 🥗 Составлять планы питания
-• 📊 Анализировать прогресс
-• 💬 Отвечать на любые вопросы
-• 🔔 Напоминать о тренировках
-• 🎯 Мотивировать 24/7
-
-🚀 <b>Начни с бесплатного 7-дневного trial!</b>
-
-Выбери действие:
-        """
+        await db.update_lead_stage(user.id, 'new')
 
-        keyboard = [
-            [InlineKeyboardButton("🎯 Пройти опрос (2 мин)", callback_data='start_survey')],
-            [InlineKeyboardButton("💪 Быстрая тренировка", callback_data='quick_workout')],
-            [InlineKeyboardButton("🥗 План питания", callback_data='nutrition_plan')],
-            [InlineKeyboardButton("💬 Задать вопрос AI", callback_data='ai_chat')],
-            [InlineKeyboardButton("🔗 Подключить Яндекс Алису", callback_data='connect_alice')],
-            [InlineKeyboardButton("💎 Premium доступ", callback_data='premium_offer')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='HTML')
+        screen = render.welcome_screen(user.first_name)
+        await update.message.reply_text(screen.text, reply_markup=screen.reply_markup, parse_mode='HTML')
 
         # Авто-сообщение через 1 минуту
-        context.job_queue.run_once(
-            self.send_followup_message,
-            60,
-            data=user.id,
-            name=f"followup_{user.id}"
-        )
+        await self.delayed.schedule(user.id, 'followup', 60)
 
-    async def send_followup_message(self, context: ContextTypes.DEFAULT_TYPE):
+    async def send_followup_message(self, user_id, payload):
         """Авто-сообщение через 1 минуту"""
-        user_id = context.job.data
-
-        followup_text = """
-💡 <b>Не знаешь с чего начать?</b>
-
-Рекомендую:
-1. Пройти быстрый опрос (2 минуты)
-2. Получить персональную программу
-3. Начать первую тренировку!
-
-Или просто спроси меня о чем угодно! 💬
-        """
-
-        keyboard = [
-            [InlineKeyboardButton("🎯 Начать опрос", callback_data='start_survey')],
-            [InlineKeyboardButton("💬 Спросить AI", callback_data='ai_chat')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        try:
-            await context.bot.send_message(
-                user_id,
-                followup_text,
-                reply_markup=reply_markup,
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            logger.warning(f"Не удалось отправить followup: {e}")
+        screen = render.FOLLOWUP_SCREEN
+        await self.outbox.send(
+            user_id,
+            screen.text,
+            reply_markup=screen.reply_markup,
+            parse_mode='HTML'
+        )
 
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         user_id = query.from_user.id
 
+        # Нажатие известной кнопки - событие воронки для скоринга лида; callback_data
+        # приходит от клиента, и чужие значения в lead_events не пишутся
+        if query.data == 'workout_done':
+            await db.complete_workout(user_id)
+        elif query.data in config.LEAD_EVENT_WEIGHTS:
+            await db.record_lead_event(user_id, query.data)
+
         if query.data == 'start_survey':
             await self.start_survey(query)
         elif query.data == 'quick_workout':
-            await self.send_workout(query)
+            await self.send_workout(query, context)
         elif query.data == 'nutrition_plan':
-            await self.send_nutrition(query)
+            await self.send_nutrition(query, context)
+        elif query.data == 'shopping_list':
+            await self.send_shopping_list(query, context)
         elif query.data == 'ai_chat':
             await self.start_ai_chat(query)
         elif query.data == 'connect_alice':
@@ -139,117 +189,64 @@ class FitFriends_bot:
             await self.show_premium_offer(query)
         elif query.data == 'complete_survey':
             await self.complete_survey(query)
+        elif query.data == 'workout_done':
+            await self.confirm_workout(query)
 
     async def start_survey(self, query):
         """Начало опроса для персонализации"""
-        survey_text = """
-🎯 <b>ДАВАЙ ПОЗНАКОМИМСЯ!</b>
-
-Ответь на 3 быстрых вопроса для персонализации:
-
-1. <b>Какая твоя основная цель?</b>
-   • Похудение
-   • Набор мышечной массы
-   • Поддержание формы
-   • Улучшение здоровья
-
-Напиши свой ответ:
-        """
-
-        await query.edit_message_text(survey_text, parse_mode='HTML')
+        await query.edit_message_text(render.SURVEY_SCREEN.text, parse_mode='HTML')
 
         # Сохраняем состояние опроса
-        db.update_conversation(query.from_user.id, "start_survey", "goal_question")
+        await db.update_conversation(query.from_user.id, "start_survey", "goal_question")
 
-    async def send_workout(self, query):
+    async def send_workout(self, query, context):
         """Отправляет AI-тренировку"""
         user_id = query.from_user.id
-        user_data = db.get_user(user_id)
-
-        # Генерируем тренировку
-        workout = ai_engine.generate_workout_plan({
-            'fitness_level': user_data[6] if user_data else 'beginner',
-            'goals': user_data[5] if user_data else 'weight_loss'
-        })
-
-        workout_text = f"""
-🏋️ <b>ТВОЯ AI-ТРЕНИРОВКА</b>
-
-📅 <b>Дата:</b> {workout['date']}
-🎯 <b>Тип:</b> {workout['type']}
-⏱ <b>Время:</b> {workout['duration']}
-🔥 <b>Калории:</b> {workout['calories']}
+        profile = await self.get_profile(context, user_id)
 
-<b>Упражнения:</b>
-"""
-        for i, exercise in enumerate(workout['exercises'], 1):
-            workout_text += f"\n{i}. {exercise}"
-
-        workout_text += "\n\n💡 <b>Совет:</b> Начинай с разминки 5-10 минут!"
-
-        keyboard = [
-            [InlineKeyboardButton("✅ Выполнил тренировку", callback_data='workout_done')],
-            [InlineKeyboardButton("🔄 Новая тренировка", callback_data='quick_workout')],
-            [InlineKeyboardButton("🥗 План питания", callback_data='nutrition_plan')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await query.edit_message_text(workout_text, reply_markup=reply_markup, parse_mode='HTML')
+        # План на день стабилен для пользователя - экран берется из кэша
+        screen = render.workout_screen(
+            user_id,
+            profile.goals if profile else 'weight_loss',
+            profile.fitness_level if profile else 'beginner'
+        )
+        await query.edit_message_text(screen.text, reply_markup=screen.reply_markup, parse_mode='HTML')
 
         # Обновляем лида
-        db.update_lead_stage(user_id, 'engaged')
+        await db.update_lead_stage(user_id, 'engaged')
 
-    async def send_nutrition(self, query):
+    async def confirm_workout(self, query):
+        """Подтверждает выполненную тренировку"""
+        screen = render.WORKOUT_DONE_SCREEN
+        await query.edit_message_text(screen.text, reply_markup=screen.reply_markup, parse_mode='HTML')
+
+    async def send_nutrition(self, query, context):
         """Отправляет AI-план питания"""
         user_id = query.from_user.id
-        user_data = db.get_user(user_id)
-
-        nutrition = ai_engine.generate_nutrition_plan({
-            'goals': user_data[5] if user_data else 'weight_loss'
-        })
-
-        nutrition_text = f"""
-🥗 <b>ТВОЙ AI-ПЛАН ПИТАНИЯ</b>
+        profile = await self.get_profile(context, user_id)
 
-🔥 <b>Калории:</b> {nutrition['calories']}
-
-<b>План на день:</b>
-• 🍳 <b>Завтрак:</b> {nutrition['meals']['breakfast']}
-• 🍲 <b>Обед:</b> {nutrition['meals']['lunch']}
-• 🍽️ <b>Ужин:</b> {nutrition['meals']['dinner']}
-• 🍎 <b>Перекусы:</b> {nutrition['meals']['snacks']}
-
-💡 <b>Совет:</b> Пей 2-3 литра воды в день!
-        """
+        screen = render.nutrition_screen(
+            user_id,
+            profile.goals if profile else 'weight_loss',
+            profile.fitness_level if profile else 'beginner'
+        )
+        await query.edit_message_text(screen.text, reply_markup=screen.reply_markup, parse_mode='HTML')
 
-        keyboard = [
-            [InlineKeyboardButton("💪 Тренировка", callback_data='quick_workout')],
-            [InlineKeyboardButton("🛒 Список покупок", callback_data='shopping_list')],
-            [InlineKeyboardButton("💬 Задать вопрос", callback_data='ai_chat')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    async def send_shopping_list(self, query, context):
+        """Отправляет список покупок по планам питания на неделю"""
+        user_id = query.from_user.id
+        profile = await self.get_profile(context, user_id)
 
-        await query.edit_message_text(nutrition_text, reply_markup=reply_markup, parse_mode='HTML')
+        screen = render.shopping_list_screen(
+            user_id,
+            profile.goals if profile else 'weight_loss',
+            profile.fitness_level if profile else 'beginner'
+        )
+        await query.edit_message_text(screen.text, reply_markup=screen.reply_markup, parse_mode='HTML')
 
     async def start_ai_chat(self, query):
         """Запускает AI-чат"""
-        chat_text = """
-💬 <b>AI-ЧАТ АКТИВИРОВАН</b>
-
-Задай мне любой вопрос о:
-• 💪 Тренировках и упражнениях
-• 🥗 Питании и диетах
-• 🏃 Беге и кардио
-• 🧘 Йоге и растяжке
-• 🎯 Поставке целей
-• 🔥 Мотивации
-
-Я профессиональный AI-тренер и помогу с любым вопросом!
-
-<b>Пиши свой вопрос:</b>
-        """
-
-        await query.edit_message_text(chat_text, parse_mode='HTML')
+        await query.edit_message_text(render.AI_CHAT_SCREEN.text, parse_mode='HTML')
 
     async def handle_ai_chat(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обрабатывает AI-чат"""
@@ -259,157 +256,280 @@ class FitFriends_bot:
         # Показываем что думаем
         thinking_msg = await update.message.reply_text("🤔 Думаю над ответом...")
 
-        # Получаем историю диалога
-        user_data = db.get_user(user_id)
-        history = []
-        if user_data and user_data[14]:  # conversation_history
-            history = json.loads(user_data[14])
-
-        # Генерируем AI-ответ
-        ai_response = await ai_engine.generate_ai_response(user_message, history)
+        # Получаем историю диалога и профиль (цель и уровень - часть ключа кэша)
+        history = await db.get_conversation(user_id)
+        profile = await self.get_profile(context, user_id)
+
+        # Реплики, ушедшие из окна последних, сворачиваются в краткое содержание
+        summary = await prompt_builder.update_summary(user_id, history, profile)
+
+        # Интенты сообщения: один проход для резервных ответов и триггеров продаж
+        intents = intent_matcher.match(user_message)
+
+        # Генерируем AI-ответ и показываем его по мере генерации
+        ai_response = await self.stream_reply(
+            thinking_msg,
+            ai_engine.stream_ai_response(
+                user_message,
+                history,
+                goal=profile.goals if profile else None,
+                level=profile.fitness_level if profile else None,
+                intents=intents,
+                summary=summary
+            )
+        )
 
         # Сохраняем в историю
-        db.update_conversation(user_id, user_message, ai_response)
-
-        # Удаляем "думаю" и отправляем ответ
-        await thinking_msg.delete()
-        await update.message.reply_text(ai_response, parse_mode='HTML')
+        await db.update_conversation(user_id, user_message, ai_response)
 
         # Авто-продажа если уместно
-        await self.check_auto_sale(update, user_id, user_message)
+        await self.check_auto_sale(update, context, user_id, intents)
+
+    async def stream_reply(self, message, stream):
+        """Правит сообщение-заглушку по мере поступления текста, не чаще STREAM_EDIT_INTERVAL"""
+        loop = asyncio.get_running_loop()
+        next_edit_at = 0
+        shown = None
+        text = ''
+
+        async for text in stream:
+            if loop.time() < next_edit_at or text == shown:
+                continue
+            try:
+                await message.edit_text(text)
+                shown = text
+                next_edit_at = loop.time() + config.STREAM_EDIT_INTERVAL
+            except RetryAfter as e:
+                next_edit_at = loop.time() + e.retry_after
+            except BadRequest:
+                next_edit_at = loop.time() + config.STREAM_EDIT_INTERVAL
+
+        # Финальная правка с полным текстом и HTML-разметкой
+        if text == shown and '<' not in text:
+            return text
+        # Текст уже показан потоком: неудачная правка только логируется
+        try:
+            await self.edit_final(message, text, 'HTML')
+        except BadRequest as e:
+            if 'not modified' not in str(e) and text != shown:
+                try:
+                    await self.edit_final(message, text, None)
+                except TelegramError as e:
+                    logger.warning(f"⚠️ Не удалось показать финальный ответ: {e}")
+        except TelegramError as e:
+            logger.warning(f"⚠️ Не удалось показать финальный ответ: {e}")
+
+        return text
+
+    @staticmethod
+    async def edit_final(message, text, parse_mode):
+        """edit_text с одним повтором после RetryAfter"""
+        try:
+            await message.edit_text(text, parse_mode=parse_mode)
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            await message.edit_text(text, parse_mode=parse_mode)
 
-    async def check_auto_sale(self, update, user_id, user_message):
+    async def check_auto_sale(self, update, context, user_id, intents):
         """Проверяет возможность авто-продажи"""
-        user_data = db.get_user(user_id)
-        if not user_data:
+        triggers = intents.get('sale')
+        if not triggers:
             return
 
-        workout_count = user_data[11] or 0
-        subscription_type = user_data[8]
-
-        # Триггеры для продаж
-        sale_triggers = [
-            ('хочу результат', 'Вижу твою мотивацию! Для максимальных результатов рекомендую Premium с персональным коучингом!'),
-            ('не получается', 'Понимаю! С Premium доступом я буду корректировать твою программу ежедневно!'),
-            ('плато', 'Это нормально! С моим AI-анализом мы преодолеем плато быстрее!'),
-            ('скучно', 'Добавлю разнообразия! В Premium версии +200 упражнений и челленджей!')
-        ]
-
-        user_msg_lower = user_message.lower()
-        for trigger, response in sale_triggers:
-            if trigger in user_msg_lower and subscription_type == 'trial' and workout_count >= 2:
-                keyboard = [
-                    [InlineKeyboardButton("💎 Узнать о Premium", callback_data='premium_offer')],
-                    [InlineKeyboardButton("💪 Продолжить тренировки", callback_data='quick_workout')]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-
-                await update.message.reply_text(response, reply_markup=reply_markup)
-                break
-
-    async def show_alice_connection(self, query):
-        """Показывает подключение к Яндекс Алисе"""
-        alice_text = """
-🎧 <b>ПОДКЛЮЧИ ЯНДЕКС АЛИСУ!</b>
-
-Теперь я доступен в твоей Яндекс Станции! 🏠
-
-<b>Что умею через Алису:</b>
-• 🎯 Голосовые тренировки
-• 🥗 Советы по питанию
-• 📊 Прогресс голосом
-• 💪 Мотивация в реальном времени
+        profile = await self.get_profile(context, user_id)
+        if not profile:
+            return
 
-<b>Как подключить:</b>
-1. Скажи: <i>"Алиса, запусти навык Фитнес Тренер"</i>
-2. Или найди в каталоге: <i>"AI Fitness Coach"</i>
+        workout_count = profile.workout_count or 0
+        subscription_type = profile.subscription_type
 
-<b>Буду твоим голосовым тренером дома! 🏋️</b>
-        """
+        if subscription_type == 'trial' and workout_count >= 2:
+            await update.message.reply_text(config.SALE_TRIGGERS[triggers[0]], reply_markup=render.SALE_KEYBOARD)
+            await db.record_lead_event(user_id, 'sale_trigger')
 
-        keyboard = [
-            [InlineKeyboardButton("💪 Получить тренировку", callback_data='quick_workout')],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data='main_menu')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await query.edit_message_text(alice_text, reply_markup=reply_markup, parse_mode='HTML')
+    async def show_alice_connection(self, query):
+        """Показывает подключение к Яндекс Алисе"""
+        screen = render.ALICE_SCREEN
+        await query.edit_message_text(screen.text, reply_markup=screen.reply_markup, parse_mode='HTML')
 
     async def show_premium_offer(self, query):
         """Показывает оффер Premium"""
-        premium_text = """
-💎 <b>PREMIUM ДОСТУП</b>
-
-<b>Что получишь:</b>
-• 🏋️ <b>Ежедневные AI-тренировки</b> - уникальные каждый день
-• 🥗 <b>Персональное питание</b> - с учетом твоих предпочтений
-• 📊 <b>AI-анализ прогресса</b> - фото, замеры, метрики
-• 💬 <b>Приоритетная поддержка</b> - ответы за 5 минут
-• 🎯 <b>Корректировка программ</b> - на основе твоих результатов
-• 🔔 <b>Умные напоминания</b> - в лучшее для тебя время
-
-<b>Всего 290/мес</b> - меньше 10р в день!
-
-🚀 <b>Гарантия результата или верну деньги!</b>
-        """
-
-        keyboard = [
-            [InlineKeyboardButton("💳 Оформить Premium", callback_data='buy_premium')],
-            [InlineKeyboardButton("💪 Продолжить trial", callback_data='quick_workout')],
-            [InlineKeyboardButton("💬 Консультация", callback_data='ai_chat')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await query.edit_message_text(premium_text, reply_markup=reply_markup, parse_mode='HTML')
+        screen = render.PREMIUM_SCREEN
+        await query.edit_message_text(screen.text, reply_markup=screen.reply_markup, parse_mode='HTML')
 
     async def send_reminders(self, context: ContextTypes.DEFAULT_TYPE):
         """Отправляет умные напоминания"""
         try:
-            # Здесь будет логика отправки напоминаний
-            # Пока просто логируем
-            logger.info("🔔 Проверка напоминаний...")
+            await self.reminders.dispatch()
         except Exception as e:
             logger.error(f"Ошибка в напоминаниях: {e}")
 
+    async def send_campaigns(self, context: ContextTypes.DEFAULT_TYPE):
+        """Ставит в очередь авто-сообщения когортам пробного периода"""
+        try:
+            await self.campaigns.run()
+        except Exception as e:
+            logger.error(f"Ошибка drip-кампаний: {e}")
+
+    async def prune_conversations(self, context: ContextTypes.DEFAULT_TYPE):
+        """Фоновая очистка истории диалогов"""
+        try:
+            pruned = await db.prune_conversations()
+            if pruned:
+                logger.info(f"🧹 Очищена история диалогов: {pruned} польз.")
+            await db.prune_daily_active((datetime.utcnow().date() - timedelta(days=config.DAILY_ACTIVE_KEEP_DAYS)).isoformat())
+            await db.prune_lead_events((datetime.utcnow() - timedelta(days=config.LEAD_EVENTS_KEEP_DAYS)).strftime('%Y-%m-%d %H:%M:%S'))
+            await db.prune_campaign_log((datetime.utcnow() - timedelta(days=config.DRIP_LOG_KEEP_DAYS)).strftime('%Y-%m-%d'))
+        except Exception as e:
+            logger.error(f"Ошибка очистки истории: {e}")
+
     async def quick_workout(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Быстрая тренировка по команде"""
-        keyboard = [[InlineKeyboardButton("💪 Получить тренировку", callback_data='quick_workout')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("Нажми для персональной AI-тренировки!", reply_markup=reply_markup)
+        screen = render.QUICK_WORKOUT_SCREEN
+        await update.message.reply_text(screen.text, reply_markup=screen.reply_markup)
 
     async def quick_nutrition(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Быстрый план питания по команде"""
-        keyboard = [[InlineKeyboardButton("🥗 Получить питание", callback_data='nutrition_plan')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("Нажми для AI-плана питания!", reply_markup=reply_markup)
+        screen = render.QUICK_NUTRITION_SCREEN
+        await update.message.reply_text(screen.text, reply_markup=screen.reply_markup)
 
     async def show_progress(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показывает прогресс"""
         user_id = update.effective_user.id
-        user_data = db.get_user(user_id)
-
-        if user_data:
-            progress_text = f"""
-📊 <b>ТВОЙ ПРОГРЕСС</b>
-
-💪 <b>Тренировок выполнено:</b> {user_data[11] or 0}
-🎯 <b>Цель:</b> {user_data[5] or 'Не указана'}
-⚡ <b>Уровень:</b> {user_data[6] or 'Начинающий'}
+        profile = await self.get_profile(context, user_id)
 
-🚀 <b>Совет:</b> Продолжай в том же духе!
-            """
+        if profile:
+            progress_text = render.progress_text(profile)
         else:
-            progress_text = "Сначала запусти /start для регистрации"
+            progress_text = render.NOT_REGISTERED_TEXT
 
         await update.message.reply_text(progress_text, parse_mode='HTML')
 
+    async def show_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сводка метрик для администратора"""
+        if not is_admin(update.effective_chat.id):
+            return
+
+        text = f"{metrics.stats_text()}\n\n{ai_engine.router.status_text()}\n\n{ai_engine.cache.status_text()}"
+        await update.message.reply_text(text, parse_mode='HTML')
+
+    async def show_admin(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Дашборд воронки и активности для администратора"""
+        if not is_admin(update.effective_chat.id):
+            return
+
+        await update.message.reply_text(await self.dashboard.text(), parse_mode='HTML')
+
+    async def export(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/export <таблица> [csv|jsonl] - выгрузка файлом в админ-чат"""
+        if not is_admin(update.effective_chat.id):
+            return
+
+        args = context.args or []
+        table = args[0] if args else None
+        fmt = args[1] if len(args) > 1 else 'csv'
+        if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS:
+            await update.message.reply_text(
+                f"Использование: /export <{'|'.join(EXPORT_TABLES)}> [{'|'.join(EXPORT_FORMATS)}]"
+            )
+            return
+
+        await update.message.reply_text(f"📤 Готовлю выгрузку {table}.{fmt}...")
+        # Выгрузка большой таблицы идет минуты - обработчик не держит очередь апдейтов админа
+        context.application.create_task(self.send_export(context.bot, update.effective_chat.id, table, fmt))
+
+    async def send_export(self, bot, chat_id, table, fmt):
+        """Отправляет части выгрузки документами по мере готовности и удаляет файлы"""
+        try:
+            part = 0
+            async for path in self.exporter.export(table, fmt):
+                part += 1
+                try:
+                    with open(path, 'rb') as document:
+                        filename = f"{table}-{date.today():%Y%m%d}-{part}.{fmt}.gz"
+                        await bot.send_document(chat_id, document, filename=filename)
+                finally:
+                    os.remove(path)
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки {table}: {e}")
+            await bot.send_message(chat_id, f"❌ Выгрузка {table} не удалась: {e}")
+
     def run(self):
         """Запускает бота"""
         logger.info("🚀 PRO Fitness Bot запускается...")
-        self.application.run_polling()
+        if config.BOT_MODE == 'webhook':
+            asyncio.run(self.run_webhook())
+        else:
+            self.application.run_polling()
+
+    async def run_webhook(self, stop_event=None):
+        """Webhook-режим: локальный aiohttp-сервер, graceful drain при остановке"""
+        application = self.application
+        server = WebhookServer(
+            application,
+            config.WEBHOOK_HOST,
+            config.WEBHOOK_PORT,
+            config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET,
+            enqueue_timeout=config.WEBHOOK_ENQUEUE_TIMEOUT
+        )
+
+        if stop_event is None:
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop_event.set)
+
+        await application.initialize()
+        await self.post_init(application)
+        if config.WEBHOOK_URL:
+            await application.bot.set_webhook(
+                config.WEBHOOK_URL,
+                secret_token=config.WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+        await application.start()
+        await server.start()
+
+        try:
+            await stop_event.wait()
+        finally:
+            logger.info("🛑 Остановка: дорабатываем принятые апдейты...")
+            # Сначала закрываем вход, затем Application.stop() обрабатывает очередь до конца
+            await server.stop()
+            await application.stop()
+            await application.shutdown()
+            await self.post_shutdown(application)
+
+    async def run_worker(self, receive, on_ready=None):
+        """Воркер шардированного режима: пачки апдейтов (dict) от ingress-процесса.
+
+        receive() возвращает следующую пачку или None для остановки.
+        """
+        application = self.application
+        await application.initialize()
+        await self.post_init(application)
+        await application.start()
+        if on_ready is not None:
+            on_ready()
+
+        processed = 0
+        try:
+            while True:
+                batch = await receive()
+                if batch is None:
+                    break
+                for data in batch:
+                    await application.update_queue.put(Update.de_json(data, application.bot))
+                processed += len(batch)
+        finally:
+            await application.stop()
+            await application.shutdown()
+            await self.post_shutdown(application)
+        return processed
 
 class SalesAutomation:
-    """Автоматизация продаж"""
+    """Автоматизация продаж: тексты drip-кампаний, их рассылает CampaignEngine"""
 
     def __init__(self):
         self.auto_messages = {
@@ -418,17 +538,15 @@ class SalesAutomation:
             'day7': "Trial заканчивается! Успей оформить Premium со скидкой 20%! 💎"
         }
 
-    async def send_auto_message(self, bot, user_id, message_type):
-        """Отправляет авто-сообщение"""
-        try:
-            message = self.auto_messages.get(message_type)
-            if message:
-                await bot.send_message(user_id, message)
-        except Exception as e:
-            logger.warning(f"Не удалось отправить авто-сообщение: {e}")
-
 def main():
+    # Логи пишутся из отдельного потока, event loop только кладет записи в очередь
+    setup_logging()
     try:
+        if config.WORKER_PROCESSES > 1:
+            # Этот процесс только принимает апдейты, обработка - в воркерах
+            logger.info(f"🚀 PRO Fitness Bot запускается: {config.WORKER_PROCESSES} воркеров")
+            asyncio.run(run_ingress())
+            return
         bot = FitFriends_bot(config.BOT_TOKEN)
         bot.run()
     except Exception as e:
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CampaignEngine:
+    """Drip-кампании по когортам пробного периода (config.DRIP_CAMPAIGNS).
+
+    Когорта кампании - диапазон registration_date или subscription_end, он
+    выбирается по индексу пачками с keyset-пагинацией. Пачка сначала
+    отмечается в campaign_log, потом ставится в очередь RateLimitedSender:
+    повторный проход (по таймеру или после рестарта) ее пропускает. Перед
+    каждой пачкой рассылка ждет, пока обработка апдейтов не разгрузится.
+    stop() прерывает проход между отправками: забранные, но не поставленные
+    в очередь пользователи возвращаются в когорту до следующего прохода.
+    """
+
+    def __init__(self, db, sender, messages, campaigns=None, batch_size=config.DRIP_BATCH_SIZE,
+                 hours=(config.DRIP_HOUR_FROM, config.DRIP_HOUR_TO), busy=None, yield_delay=1.0):
+        self.db = db
+        self.sender = sender
+        self.messages = messages
+        self.campaigns = campaigns or config.DRIP_CAMPAIGNS
+        self.batch_size = batch_size
+        self.hours = hours
+        # busy() -> True, пока интерактивным ответам нужны все силы
+        self.busy = busy
+        self.yield_delay = yield_delay
+        self.running = False
+        self.stopping = False
+
+    @staticmethod
+    def window(field, days, now):
+        """Границы когорты [start, end) в формате поля; оба поля хранятся в UTC"""
+        now = now.astimezone(timezone.utc)
+        if field == 'registration_date':
+            # CURRENT_TIMESTAMP пишет UTC; окно - сутки, начиная через days суток после регистрации
+            end = now - timedelta(days=days)
+            start = end - timedelta(days=1)
+            return start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')
+        # Дата окончания сравнивается с date('now') SQLite - тоже UTC
+        day = now.date() + timedelta(days=days)
+        return day.isoformat(), (day + timedelta(days=1)).isoformat()
+
+    async def run(self, now=None):
+        """Один проход по всем кампаниям; возвращает {кампания: поставлено в очередь}"""
+        now = now or datetime.now()
+        if not self.hours[0] <= now.hour < self.hours[1] or self.running or self.stopping:
+            return {}
+
+        self.running = True
+        try:
+            return {name: await self.send_campaign(name, now) for name in self.campaigns}
+        finally:
+            self.running = False
+
+    def stop(self):
+        """Остановка бота: проход завершается после текущей отправки"""
+        self.stopping = True
+
+    async def send_campaign(self, name, now):
+        text = self.messages.get(name)
+        if not text:
+            logger.warning(f"Нет текста для кампании {name}")
+            return 0
+
+        field, days = self.campaigns[name]
+        start, end = self.window(field, days, now)
+        last = (start, -2 ** 63)
+        queued = 0
+        started = time.perf_counter()
+        while last is not None:
+            await self.wait_for_idle()
+            if self.stopping:
+                break
+            claimed, last = await self.db.claim_campaign_batch(name, field, last, end, self.batch_size)
+            sent = 0
+            for user_id in claimed:
+                if self.stopping:
+                    break
+                # Ждет места в очереди: в журнале не больше пачки сверх очереди отправки
+                await self.sender.send(user_id, text)
+                sent += 1
+            queued += sent
+            metrics.campaign_messages.inc(name, amount=sent)
+            if sent < len(claimed):
+                await self.db.release_campaign_claims(name, claimed[sent:])
+                break
+
+        if queued:
+            logger.info(f"📣 Кампания {name} ({start} - {end}): в очереди {queued}, "
+                        f"{time.perf_counter() - started:.1f} с" + (", прервано остановкой" if self.stopping else ''))
+        return queued
+
+    async def wait_for_idle(self):
+        while self.busy is not None and self.busy() and not self.stopping:
+            await asyncio.sleep(self.yield_delay)
+
+
+def benchmark(users=300000, batch_size=config.DRIP_BATCH_SIZE):
+    """Когорта в сотни тысяч пользователей: время разметки журнала и повторного прохода"""
+    import os
+    import sqlite3
+    import tempfile
+    from database import Database
+
+    class CountingSender:
+        def __init__(self):
+            self.queued = 0
+
+        async def send(self, chat_id, text, **kwargs):
+            self.queued += 1
+
+    with tempfile.TemporaryDirectory(prefix='fitfriends-campaigns-') as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        now = datetime(2026, 1, 15, 12, 0)
+        registered = now.astimezone(timezone.utc) - timedelta(days=1, hours=12)
+        conn = sqlite3.connect(db.db_path)
+        # Вся таблица в одной когорте day1, плюс столько же premium-пользователей вне ее
+        conn.executemany(
+            "INSERT INTO users (user_id, subscription_type, subscription_end, registration_date) VALUES (?, ?, ?, ?)",
+            ((u, 'trial' if u % 2 else 'premium', '2026-01-20',
+              (registered + timedelta(milliseconds=u)).strftime('%Y-%m-%d %H:%M:%S')) for u in range(users * 2))
+        )
+        conn.commit()
+        conn.close()
+
+        async def scenario():
+            sender = CountingSender()
+            engine = CampaignEngine(db, sender, {'day1': 'текст'}, {'day1': ('registration_date', 1)}, batch_size)
+            started = time.perf_counter()
+            queued = await engine.run(now)
+            elapsed = time.perf_counter() - started
+            print(f"Когорта {queued['day1']} пользователей: {elapsed:.1f} с, "
+                  f"{queued['day1'] / elapsed:.0f} польз./с, пачек {db.writes}")
+
+            started = time.perf_counter()
+            queued = await engine.run(now)
+            print(f"Повторный проход (рестарт): в очереди {queued['day1']}, {time.perf_counter() - started:.1f} с")
+
+        asyncio.run(scenario())
+        db.close()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,182 @@
+import random
+import time
+from collections import OrderedDict
+from datetime import date
+
+import config
+
+LEVELS = ('beginner', 'intermediate', 'advanced')
+
+# Шаблоны тренировок по цели: группы мышц по порядку упражнений
+GOAL_TEMPLATES = {
+    'weight_loss': {
+        'type': 'Жиросжигающая',
+        'focus': 'Кардио + Силовая',
+        'muscles': ('legs', 'cardio', 'core', 'glutes', 'cardio')
+    },
+    'muscle_gain': {
+        'type': 'Мышечная масса',
+        'focus': 'Силовая',
+        'muscles': ('legs', 'chest', 'back', 'glutes', 'core')
+    }
+}
+
+# Длительность и расход калорий по уровню подготовки
+LEVEL_LOAD = {
+    'beginner': ('25-35 минут', '150-250 ккал'),
+    'intermediate': ('35-45 минут', '250-400 ккал'),
+    'advanced': ('45-60 минут', '400-600 ккал')
+}
+
+
+class ExerciseCatalog:
+    """Упражнения EXERCISE_LIBRARY с индексами по месту, уровню, группе мышц и инвентарю"""
+
+    FIELDS = ('location', 'level', 'muscle', 'equipment')
+
+    def __init__(self, library):
+        self.exercises = []
+        self.index = {field: {} for field in self.FIELDS}
+        for location, levels in library.items():
+            for level, items in levels.items():
+                for item in items:
+                    exercise = dict(item, location=location, level=level)
+                    exercise_id = len(self.exercises)
+                    self.exercises.append(exercise)
+                    for field in self.FIELDS:
+                        self.index[field].setdefault(exercise[field], set()).add(exercise_id)
+
+        # Результаты запросов: набор фильтров -> id упражнений
+        self.queries = {}
+
+    def find(self, **filters):
+        """id упражнений, подходящих под все фильтры (значение фильтра - строка или кортеж строк)"""
+        key = tuple(sorted(filters.items()))
+        ids = self.queries.get(key)
+        if ids is not None:
+            return ids
+
+        result = set(range(len(self.exercises)))
+        for field, values in filters.items():
+            if isinstance(values, str):
+                values = (values,)
+            result &= set().union(*(self.index[field].get(value, ()) for value in values))
+
+        ids = self.queries[key] = tuple(sorted(result))
+        return ids
+
+    def get(self, exercise_id):
+        return self.exercises[exercise_id]
+
+
+def levels_up_to(level):
+    """Уровень пользователя и все более простые"""
+    if level not in LEVELS:
+        level = LEVELS[0]
+    return LEVELS[:LEVELS.index(level) + 1]
+
+
+class WorkoutGenerator:
+    """Тренировки дня из каталога без обращения к модели.
+
+    Выбор упражнений детерминирован: генератор случайных чисел засевается
+    парой (пользователь, дата), поэтому в течение дня план не меняется и
+    его можно кэшировать, а на следующий день он другой.
+    """
+
+    def __init__(self, catalog, cache_size=config.WORKOUT_CACHE_SIZE):
+        self.catalog = catalog
+        self.cache_size = cache_size
+        self.plans = OrderedDict()
+        # Кандидаты для каждого слота шаблона: (goals, level, location) -> кортеж пулов
+        self.slots = {}
+
+    def plan(self, user_id, goals=None, level=None, location=None, day=None):
+        """План тренировки пользователя на день (по умолчанию - на сегодня)"""
+        key = self.normalize(user_id, goals, level, location, day)
+        plan = self.plans.get(key)
+        if plan is not None:
+            self.plans.move_to_end(key)
+            return plan
+
+        plan = self.plans[key] = self.build(*key)
+        if len(self.plans) > self.cache_size:
+            self.plans.popitem(last=False)
+        return plan
+
+    def batch(self, users, day=None, location=None):
+        """Планы для множества пользователей: users - тройки (user_id, goals, level)"""
+        return {
+            user_id: self.build(*self.normalize(user_id, goals, level, location, day))
+            for user_id, goals, level in users
+        }
+
+    def normalize(self, user_id, goals, level, location, day):
+        return (
+            user_id,
+            goals if goals in GOAL_TEMPLATES else 'weight_loss',
+            level if level in LEVELS else 'beginner',
+            location or config.WORKOUT_LOCATION,
+            day or date.today()
+        )
+
+    def build(self, user_id, goals, level, location, day):
+        template = GOAL_TEMPLATES[goals]
+        rng = random.Random(f"{user_id}:{day.isoformat()}")
+
+        chosen = []
+        for pool in self.slot_pools(goals, level, location):
+            candidates = [i for i in pool if i not in chosen]
+            if candidates:
+                chosen.append(rng.choice(candidates))
+
+        duration, calories = LEVEL_LOAD[level]
+        exercises = [self.catalog.get(i) for i in chosen]
+        return {
+            'date': day.strftime('%d.%m.%Y'),
+            'type': template['type'],
+            'focus': template['focus'],
+            'duration': duration,
+            'calories': calories,
+            'exercises': [f"{exercise['name']} {exercise['sets']}" for exercise in exercises],
+            'gifs': [exercise['gif'] for exercise in exercises if exercise.get('gif')]
+        }
+
+    def slot_pools(self, goals, level, location):
+        key = (goals, level, location)
+        pools = self.slots.get(key)
+        if pools is None:
+            levels = levels_up_to(level)
+            fallback = self.catalog.find(location=location, level=levels)
+            # Нет упражнений на группу мышц - слот берет любое подходящее по месту и уровню
+            pools = self.slots[key] = tuple(
+                self.catalog.find(location=location, level=levels, muscle=muscle) or fallback
+                for muscle in GOAL_TEMPLATES[goals]['muscles']
+            )
+        return pools
+
+
+exercise_catalog = ExerciseCatalog(config.EXERCISE_LIBRARY)
+workout_generator = WorkoutGenerator(exercise_catalog)
+
+
+def benchmark(users=100000):
+    """Пакетная генерация планов на день"""
+    rng = random.Random(0)
+    batch = [
+        (user_id, rng.choice(tuple(GOAL_TEMPLATES)), rng.choice(LEVELS))
+        for user_id in range(users)
+    ]
+    generator = WorkoutGenerator(exercise_catalog)
+
+    started = time.perf_counter()
+    plans = generator.batch(batch)
+    elapsed = time.perf_counter() - started
+
+    distinct = len({tuple(plan['exercises']) for plan in plans.values()})
+    print(f"{users:,} планов за {elapsed:.2f} с ({users / elapsed:,.0f} планов/сек), "
+          f"уникальных наборов упражнений: {distinct:,}")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -6,34 +6,326 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
 
+# Логирование: файл с ротацией по размеру (байт) или по времени (LOG_ROTATE_WHEN,
+# например midnight), формат text или json, размер очереди записей
+LOG_FILE = os.getenv('LOG_FILE', 'pro_bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Повторяющиеся строки ниже WARNING: не больше LOG_SAMPLE_BURST похожих за LOG_SAMPLE_WINDOW сек
+LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', '5'))
+LOG_SAMPLE_WINDOW = float(os.getenv('LOG_SAMPLE_WINDOW', '60'))
+
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Сколько апдейтов принято и еще не обработано (в очереди и в работе); сверх - обратное давление
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '1000'))
+# Сколько апдейтов разных пользователей обрабатывается параллельно
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '16'))
+# Сколько из них могут занять вопросы AI-чату: остальные слоты остаются кнопкам и командам
+UPDATE_AI_WORKERS = int(os.getenv('UPDATE_AI_WORKERS', '12'))
+# Шардирование по user_id: число процессов-воркеров (1 - все в одном процессе)
+# и сколько апдейтов ingress держит в очереди на воркер
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '1000'))
+
+# Webhook: локальный сервер (за reverse proxy), публичный URL для setWebhook
+# (если не задан, регистрация webhook пропускается) и секрет для заголовка
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', '5'))
+
 # Настройки AI
 OPENROUTER_API_KEY = "free"  # Бесплатный AI API
 
-# База знаний упражнений
+# HTTP-клиент AI: пул соединений, таймауты (сек) и лимит одновременных запросов
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '20'))
+AI_CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', '5'))
+AI_READ_TIMEOUT = float(os.getenv('AI_READ_TIMEOUT', '30'))
+AI_DNS_CACHE_TTL = 300
+# Общий предел ожидания ответа модели (сек), после него - резервный ответ
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', '20'))
+
+# Провайдеры модели по приоритету: следующий получает хеджированные запросы
+# и весь трафик, пока у предыдущего открыт предохранитель
+AI_API_URL = os.getenv('AI_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+AI_PROVIDERS = [
+    {'name': 'mistral', 'url': AI_API_URL, 'model': 'mistralai/mistral-7b-instruct:free', 'api_key': OPENROUTER_API_KEY},
+    {'name': 'llama', 'url': os.getenv('AI_FALLBACK_API_URL', AI_API_URL),
+     'model': 'meta-llama/llama-3-8b-instruct:free', 'api_key': OPENROUTER_API_KEY}
+]
+
+# Предохранитель: окно последних запросов провайдера, доля ошибок для размыкания
+# (не раньше AI_BREAKER_MIN_REQUESTS запросов в окне) и пауза до пробного запроса (сек)
+AI_BREAKER_WINDOW = int(os.getenv('AI_BREAKER_WINDOW', '20'))
+AI_BREAKER_ERROR_RATE = float(os.getenv('AI_BREAKER_ERROR_RATE', '0.5'))
+AI_BREAKER_MIN_REQUESTS = int(os.getenv('AI_BREAKER_MIN_REQUESTS', '5'))
+AI_BREAKER_COOLDOWN = float(os.getenv('AI_BREAKER_COOLDOWN', '30'))
+
+# Хеджирование: второй провайдер подключается, если первый отвечает дольше
+# перцентиля своей задержки (пока статистики нет - AI_HEDGE_DELAY сек)
+AI_HEDGE_QUANTILE = float(os.getenv('AI_HEDGE_QUANTILE', '0.95'))
+AI_HEDGE_DELAY = float(os.getenv('AI_HEDGE_DELAY', '3'))
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '0.5'))
+
+# Кэш AI-ответов: размер LRU в памяти, TTL (сек) в памяти и в SQLite
+AI_CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', '1000'))
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', str(6 * 3600)))
+AI_CACHE_DB_TTL = int(os.getenv('AI_CACHE_DB_TTL', str(7 * 24 * 3600)))
+AI_CACHE_DB_MAX_ROWS = int(os.getenv('AI_CACHE_DB_MAX_ROWS', '50000'))
+# Сообщение считается продолжением диалога, если прошлая реплика была недавно (сек):
+# только тогда в промпт идут реплики и сводка, иначе ответ общий и берется из кэша
+AI_CACHE_DIALOG_WINDOW = 600
+
+# Контекст запроса к модели: бюджет токенов на промпт (ответ - max_tokens сверх него),
+# сколько последних реплик идут дословно и потолок одной реплики; более старые
+# реплики сворачиваются в краткое содержание диалога не длиннее AI_SUMMARY_TOKENS
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv('AI_PROMPT_TOKEN_BUDGET', '1200'))
+AI_PROMPT_RECENT_TURNS = int(os.getenv('AI_PROMPT_RECENT_TURNS', '4'))
+AI_PROMPT_TURN_TOKENS = int(os.getenv('AI_PROMPT_TURN_TOKENS', '200'))
+AI_SUMMARY_TOKENS = int(os.getenv('AI_SUMMARY_TOKENS', '250'))
+
+# Потоковая выдача ответа: минимальный интервал между правками сообщения (сек)
+AI_STREAMING = os.getenv('AI_STREAMING', '1') == '1'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+
+# Очередь массовых рассылок: сообщений/сек (лимит Telegram - 30, оставляем запас
+# для интерактивных ответов), интервал для одного чата (сек), размер очереди
+OUTBOX_RATE = float(os.getenv('OUTBOX_RATE', '25'))
+OUTBOX_PER_CHAT_INTERVAL = float(os.getenv('OUTBOX_PER_CHAT_INTERVAL', '1.0'))
+OUTBOX_MAX_QUEUE = int(os.getenv('OUTBOX_MAX_QUEUE', '1000'))
+OUTBOX_MAX_IN_FLIGHT = int(os.getenv('OUTBOX_MAX_IN_FLIGHT', '20'))
+
+# Drip-кампании пробного периода: имя (ключ авто-сообщения) -> (поле users, сутки).
+# registration_date - через столько суток после регистрации, subscription_end -
+# за столько суток до конца пробного периода
+DRIP_CAMPAIGNS = {
+    'day1': ('registration_date', 1),
+    'day3': ('registration_date', 3),
+    'day7': ('subscription_end', 0)
+}
+# Проход по когортам раз в DRIP_INTERVAL сек в часы [DRIP_HOUR_FROM, DRIP_HOUR_TO),
+# пачка - сколько пользователей забирается из БД за раз, журнал хранится DRIP_LOG_KEEP_DAYS суток
+DRIP_INTERVAL = int(os.getenv('DRIP_INTERVAL', '900'))
+DRIP_HOUR_FROM = int(os.getenv('DRIP_HOUR_FROM', '10'))
+DRIP_HOUR_TO = int(os.getenv('DRIP_HOUR_TO', '21'))
+DRIP_BATCH_SIZE = int(os.getenv('DRIP_BATCH_SIZE', '500'))
+DRIP_LOG_KEEP_DAYS = int(os.getenv('DRIP_LOG_KEEP_DAYS', '30'))
+# Рассылка уступает интерактивным ответам: следующая пачка ждет, пока занято
+# больше этой доли слотов обработки апдейтов (UPDATE_WORKERS)
+DRIP_YIELD_LOAD = float(os.getenv('DRIP_YIELD_LOAD', '0.5'))
+
+# Write-behind буфер БД: интервал сброса (сек), порог числа несохраненных мутаций
+# и предел паузы (сек) между повторами сброса после ошибки
+WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', '0.5'))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '500'))
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv('WRITE_BEHIND_MAX_BACKOFF', '30'))
+
+# Метрики: сбор (при 0 инструментирование не ставится) и Prometheus-эндпоинт
+# /metrics (порт 0 - эндпоинт не поднимается, сводка доступна через /stats)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Админ-выгрузки (/export): строк на один запрос к БД и предел размера файла
+# (байт, сжатый gzip; Telegram принимает документы до 50 МБ - больше режется на части)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_PART_BYTES = int(os.getenv('EXPORT_PART_BYTES', str(45 * 1024 * 1024)))
+# Дашборд /admin: дней активности в сводке и сколько дней хранятся отметки активных пользователей
+ADMIN_DASHBOARD_DAYS = int(os.getenv('ADMIN_DASHBOARD_DAYS', '7'))
+DAILY_ACTIVE_KEEP_DAYS = int(os.getenv('DAILY_ACTIVE_KEEP_DAYS', '90'))
+
+# Размер LRU-кэша профилей пользователей в памяти процесса
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '10000'))
+
+# Скоринг лидов: вес события воронки (нажатие кнопки по callback_data или
+# триггер продаж) в interest_level и потолок интереса
+LEAD_EVENT_WEIGHTS = {
+    'quick_workout': 1,
+    'nutrition_plan': 1,
+    'ai_chat': 1,
+    'sale_trigger': 2,
+    'premium_offer': 2,
+    'shopping_list': 1,
+    'workout_done': 3,
+    # Кнопки без веса: события только для выгрузки и статистики воронки
+    'start_survey': 0,
+    'connect_alice': 0,
+    'buy_premium': 0,
+    'main_menu': 0
+}
+# Сколько суток хранятся события воронки (interest_level уже учел их вес)
+LEAD_EVENTS_KEEP_DAYS = int(os.getenv('LEAD_EVENTS_KEEP_DAYS', '180'))
+LEAD_MAX_INTEREST = 10
+
+# Резервные ответы AI: фраза-триггер -> ответ (порядок задает приоритет)
+FALLBACK_RESPONSES = {
+    'привет': 'Привет! Я твой AI-фитнес тренер! 🏋️\nЧем могу помочь? Тренировка, питание или совет?',
+    'треня': 'Отлично! Сгенерирую для тебя персональную тренировку! 💪',
+    'питание': 'Создам идеальный план питания под твои цели! 🥗',
+    'мотивация': 'Ты можешь всё! Каждая тренировка приближает к цели! 🔥',
+    'как похудеть': 'Советую: 1) Дефицит калорий 2) Силовые тренировки 3) Кардио 4) Белок',
+    'как накачаться': 'Фокус на: 1) Прогрессия нагрузок 2) Протеин 3) Восстановление 4) Дисциплина'
+}
+DEFAULT_FALLBACK_RESPONSE = "Отличный вопрос! Рекомендую тебе индивидуальную программу тренировок и питания. Хочешь, создам её для тебя? 🚀"
+
+# Триггеры авто-продаж: фраза -> ответ
+SALE_TRIGGERS = {
+    'хочу результат': 'Вижу твою мотивацию! Для максимальных результатов рекомендую Premium с персональным коучингом!',
+    'не получается': 'Понимаю! С Premium доступом я буду корректировать твою программу ежедневно!',
+    'плато': 'Это нормально! С моим AI-анализом мы преодолеем плато быстрее!',
+    'скучно': 'Добавлю разнообразия! В Premium версии +200 упражнений и челленджей!'
+}
+
+# База знаний упражнений: место -> уровень -> упражнения с группой мышц
+# (muscle) и инвентарем (equipment)
 EXERCISE_LIBRARY = {
     'home': {
         'beginner': [
-            {'name': 'Отжимания от пола', 'sets': '3x10', 'gif': 'https://media.giphy.com/media/l0HlNF9TtMfL9MsvW/giphy.gif'},
-            {'name': 'Приседания', 'sets': '3x15', 'gif': 'https://media.giphy.com/media/3o7TKSha51ATTx9KzC/giphy.gif'},
-            {'name': 'Планка', 'sets': '3x30сек', 'gif': 'https://media.giphy.com/media/xT5LMJm930guk5Nlfi/giphy.gif'},
-            {'name': 'Выпады', 'sets': '3x10', 'gif': 'https://media.giphy.com/media/l0HlKrLJSv9X22LbW/giphy.gif'},
-            {'name': 'Скручивания', 'sets': '3x15', 'gif': 'https://media.giphy.com/media/26uf759LlDftqZKYk/giphy.gif'}
+            {'name': 'Отжимания от пола', 'sets': '3x10', 'muscle': 'chest', 'equipment': 'none', 'gif': 'https://media.giphy.com/media/l0HlNF9TtMfL9MsvW/giphy.gif'},
+            {'name': 'Приседания', 'sets': '3x15', 'muscle': 'legs', 'equipment': 'none', 'gif': 'https://media.giphy.com/media/3o7TKSha51ATTx9KzC/giphy.gif'},
+            {'name': 'Планка', 'sets': '3x30сек', 'muscle': 'core', 'equipment': 'none', 'gif': 'https://media.giphy.com/media/xT5LMJm930guk5Nlfi/giphy.gif'},
+            {'name': 'Выпады', 'sets': '3x10', 'muscle': 'legs', 'equipment': 'none', 'gif': 'https://media.giphy.com/media/l0HlKrLJSv9X22LbW/giphy.gif'},
+            {'name': 'Скручивания', 'sets': '3x15', 'muscle': 'core', 'equipment': 'none', 'gif': 'https://media.giphy.com/media/26uf759LlDftqZKYk/giphy.gif'},
+            {'name': 'Ягодичный мостик', 'sets': '3x15', 'muscle': 'glutes', 'equipment': 'none'},
+            {'name': 'Отжимания от стены', 'sets': '3x15', 'muscle': 'chest', 'equipment': 'none'},
+            {'name': 'Супермен', 'sets': '3x12', 'muscle': 'back', 'equipment': 'none'},
+            {'name': 'Джампинг джек', 'sets': '3x30сек', 'muscle': 'cardio', 'equipment': 'none'},
+            {'name': 'Бег на месте', 'sets': '3x1мин', 'muscle': 'cardio', 'equipment': 'none'},
+            {'name': 'Тяга резинки к поясу', 'sets': '3x15', 'muscle': 'back', 'equipment': 'band'},
+            {'name': 'Махи ногой назад', 'sets': '3x15', 'muscle': 'glutes', 'equipment': 'none'}
+        ],
+        'intermediate': [
+            {'name': 'Берпи', 'sets': '3x10', 'muscle': 'cardio', 'equipment': 'none'},
+            {'name': 'Скакалка', 'sets': '5x1мин', 'muscle': 'cardio', 'equipment': 'jump_rope'},
+            {'name': 'Приседания с прыжком', 'sets': '4x12', 'muscle': 'legs', 'equipment': 'none'},
+            {'name': 'Болгарские выпады', 'sets': '3x10', 'muscle': 'legs', 'equipment': 'none'},
+            {'name': 'Отжимания узким хватом', 'sets': '4x10', 'muscle': 'chest', 'equipment': 'none'},
+            {'name': 'Подтягивания', 'sets': '3x6-8', 'muscle': 'back', 'equipment': 'pullup_bar'},
+            {'name': 'Тяга гантели в наклоне', 'sets': '4x10', 'muscle': 'back', 'equipment': 'dumbbells'},
+            {'name': 'Боковая планка', 'sets': '3x40сек', 'muscle': 'core', 'equipment': 'none'},
+            {'name': 'Ягодичный мостик на одной ноге', 'sets': '3x12', 'muscle': 'glutes', 'equipment': 'none'},
+            {'name': 'Жим гантелей стоя', 'sets': '3x12', 'muscle': 'shoulders', 'equipment': 'dumbbells'}
+        ],
+        'advanced': [
+            {'name': 'Пистолетик', 'sets': '4x6', 'muscle': 'legs', 'equipment': 'none'},
+            {'name': 'Отжимания с хлопком', 'sets': '4x8', 'muscle': 'chest', 'equipment': 'none'},
+            {'name': 'Подтягивания широким хватом', 'sets': '4x8-10', 'muscle': 'back', 'equipment': 'pullup_bar'},
+            {'name': 'Подъем ног в висе', 'sets': '4x12', 'muscle': 'core', 'equipment': 'pullup_bar'},
+            {'name': 'Берпи с подтягиванием', 'sets': '4x8', 'muscle': 'cardio', 'equipment': 'pullup_bar'},
+            {'name': 'Отжимания в стойке у стены', 'sets': '3x6', 'muscle': 'shoulders', 'equipment': 'none'}
+        ]
+    },
+    'gym': {
+        'beginner': [
+            {'name': 'Жим ногами', 'sets': '3x12', 'muscle': 'legs', 'equipment': 'machine'},
+            {'name': 'Тяга верхнего блока', 'sets': '3x12', 'muscle': 'back', 'equipment': 'machine'},
+            {'name': 'Жим в тренажере', 'sets': '3x12', 'muscle': 'chest', 'equipment': 'machine'},
+            {'name': 'Беговая дорожка', 'sets': '10мин', 'muscle': 'cardio', 'equipment': 'machine'},
+            {'name': 'Гиперэкстензия', 'sets': '3x15', 'muscle': 'back', 'equipment': 'machine'}
+        ],
+        'intermediate': [
+            {'name': 'Приседания со штангой', 'sets': '4x8-10', 'muscle': 'legs', 'equipment': 'barbell'},
+            {'name': 'Жим штанги лежа', 'sets': '4x8-10', 'muscle': 'chest', 'equipment': 'barbell'},
+            {'name': 'Тяга штанги в наклоне', 'sets': '4x10', 'muscle': 'back', 'equipment': 'barbell'},
+            {'name': 'Румынская тяга', 'sets': '4x10', 'muscle': 'glutes', 'equipment': 'barbell'},
+            {'name': 'Армейский жим', 'sets': '3x10', 'muscle': 'shoulders', 'equipment': 'barbell'},
+            {'name': 'Гребной тренажер', 'sets': '5x1мин', 'muscle': 'cardio', 'equipment': 'machine'}
+        ],
+        'advanced': [
+            {'name': 'Становая тяга', 'sets': '5x5', 'muscle': 'back', 'equipment': 'barbell'},
+            {'name': 'Фронтальные приседания', 'sets': '5x5', 'muscle': 'legs', 'equipment': 'barbell'},
+            {'name': 'Отжимания на брусьях с весом', 'sets': '4x8', 'muscle': 'chest', 'equipment': 'dip_bars'},
+            {'name': 'Хип-траст со штангой', 'sets': '4x10', 'muscle': 'glutes', 'equipment': 'barbell'},
+            {'name': 'Ролик для пресса', 'sets': '4x12', 'muscle': 'core', 'equipment': 'ab_wheel'}
         ]
     }
 }
 
-# База питания
-NUTRITION_PLANS = {
-    'weight_loss': {
-        'breakfast': 'Овсянка с ягодами (300 ккал)',
-        'lunch': 'Курица с гречкой и овощами (400 ккал)',
-        'dinner': 'Рыба на пару с салатом (350 ккал)',
-        'snacks': 'Яблоко, творог (200 ккал)'
-    },
-    'muscle_gain': {
-        'breakfast': 'Омлет из 3 яиц + тосты (500 ккал)',
-        'lunch': 'Говядина с рисом (600 ккал)',
-        'dinner': 'Творог с орехами (400 ккал)',
-        'snacks': 'Протеин, банан (300 ккал)'
-    }
-}
\ No newline at end of file
+# Генератор тренировок: место по умолчанию и размер кэша готовых планов
+WORKOUT_LOCATION = os.getenv('WORKOUT_LOCATION', 'home')
+WORKOUT_CACHE_SIZE = int(os.getenv('WORKOUT_CACHE_SIZE', '10000'))
+
+# База питания: блюда по приемам пищи (breakfast, lunch, dinner, snacks) с
+# калориями и БЖУ (г) на порцию и составом порции в граммах для списка покупок
+FOOD_TABLE = [
+    {'name': 'Овсянка с ягодами', 'meal': 'breakfast', 'kcal': 350, 'protein': 13, 'fat': 8, 'carbs': 57,
+     'ingredients': {'Овсяные хлопья': 60, 'Ягоды': 100, 'Молоко': 150}},
+    {'name': 'Омлет из 3 яиц с овощами', 'meal': 'breakfast', 'kcal': 330, 'protein': 22, 'fat': 23, 'carbs': 6,
+     'ingredients': {'Яйца': 165, 'Овощи': 100, 'Масло растительное': 5}},
+    {'name': 'Творог с бананом', 'meal': 'breakfast', 'kcal': 350, 'protein': 35, 'fat': 10, 'carbs': 33,
+     'ingredients': {'Творог 5%': 200, 'Бананы': 120}},
+    {'name': 'Гречка с молоком', 'meal': 'breakfast', 'kcal': 310, 'protein': 14, 'fat': 7, 'carbs': 47,
+     'ingredients': {'Гречка': 60, 'Молоко': 200}},
+    {'name': 'Сырники', 'meal': 'breakfast', 'kcal': 450, 'protein': 34, 'fat': 23, 'carbs': 26,
+     'ingredients': {'Творог 5%': 150, 'Яйца': 50, 'Мука': 30, 'Масло растительное': 10}},
+    {'name': 'Тост с авокадо и яйцом', 'meal': 'breakfast', 'kcal': 315, 'protein': 13, 'fat': 15, 'carbs': 32,
+     'ingredients': {'Хлеб цельнозерновой': 60, 'Авокадо': 50, 'Яйца': 55}},
+
+    {'name': 'Куриная грудка с гречкой', 'meal': 'lunch', 'kcal': 440, 'protein': 46, 'fat': 5, 'carbs': 51,
+     'ingredients': {'Куриная грудка': 150, 'Гречка': 70, 'Овощи': 150}},
+    {'name': 'Говядина с рисом', 'meal': 'lunch', 'kcal': 550, 'protein': 45, 'fat': 14, 'carbs': 59,
+     'ingredients': {'Говядина': 150, 'Рис': 70, 'Овощи': 100}},
+    {'name': 'Индейка с булгуром', 'meal': 'lunch', 'kcal': 435, 'protein': 43, 'fat': 4, 'carbs': 55,
+     'ingredients': {'Индейка': 150, 'Булгур': 70, 'Овощи': 100}},
+    {'name': 'Лосось с картофелем', 'meal': 'lunch', 'kcal': 525, 'protein': 36, 'fat': 20, 'carbs': 47,
+     'ingredients': {'Лосось': 150, 'Картофель': 250, 'Овощи': 100}},
+    {'name': 'Паста с тунцом', 'meal': 'lunch', 'kcal': 530, 'protein': 41, 'fat': 12, 'carbs': 61,
+     'ingredients': {'Макароны': 80, 'Тунец консервированный': 120, 'Помидоры': 100, 'Масло растительное': 10}},
+    {'name': 'Чечевичный суп с хлебом', 'meal': 'lunch', 'kcal': 440, 'protein': 25, 'fat': 2, 'carbs': 79,
+     'ingredients': {'Чечевица': 80, 'Овощи': 150, 'Хлеб цельнозерновой': 50}},
+
+    {'name': 'Рыба на пару с салатом', 'meal': 'dinner', 'kcal': 300, 'protein': 38, 'fat': 11, 'carbs': 10,
+     'ingredients': {'Треска': 200, 'Овощи': 200, 'Масло растительное': 10}},
+    {'name': 'Курица с овощами гриль', 'meal': 'dinner', 'kcal': 315, 'protein': 38, 'fat': 13, 'carbs': 12,
+     'ingredients': {'Куриная грудка': 150, 'Овощи': 250, 'Масло растительное': 10}},
+    {'name': 'Творог с орехами', 'meal': 'dinner', 'kcal': 372, 'protein': 37, 'fat': 23, 'carbs': 9,
+     'ingredients': {'Творог 5%': 200, 'Грецкие орехи': 20}},
+    {'name': 'Омлет с сыром', 'meal': 'dinner', 'kcal': 365, 'protein': 28, 'fat': 26, 'carbs': 1,
+     'ingredients': {'Яйца': 165, 'Сыр': 30}},
+    {'name': 'Креветки с киноа', 'meal': 'dinner', 'kcal': 395, 'protein': 39, 'fat': 6, 'carbs': 43,
+     'ingredients': {'Креветки': 150, 'Киноа': 60, 'Овощи': 100}},
+    {'name': 'Тофу с овощами и рисом', 'meal': 'dinner', 'kcal': 377, 'protein': 22, 'fat': 9, 'carbs': 53,
+     'ingredients': {'Тофу': 200, 'Овощи': 200, 'Рис': 50}},
+
+    {'name': 'Яблоко и миндаль', 'meal': 'snacks', 'kcal': 194, 'protein': 4, 'fat': 10, 'carbs': 23,
+     'ingredients': {'Яблоки': 150, 'Миндаль': 20}},
+    {'name': 'Греческий йогурт с медом', 'meal': 'snacks', 'kcal': 150, 'protein': 20, 'fat': 1, 'carbs': 15,
+     'ingredients': {'Греческий йогурт': 200, 'Мед': 10}},
+    {'name': 'Протеиновый коктейль', 'meal': 'snacks', 'kcal': 250, 'protein': 31, 'fat': 8, 'carbs': 15,
+     'ingredients': {'Сывороточный протеин': 30, 'Молоко': 250}},
+    {'name': 'Банан с арахисовой пастой', 'meal': 'snacks', 'kcal': 227, 'protein': 6, 'fat': 10, 'carbs': 31,
+     'ingredients': {'Бананы': 120, 'Арахисовая паста': 20}},
+    {'name': 'Кефир с отрубями', 'meal': 'snacks', 'kcal': 150, 'protein': 11, 'fat': 4, 'carbs': 18,
+     'ingredients': {'Кефир 1%': 250, 'Отруби': 20}},
+    {'name': 'Хлебцы с сыром', 'meal': 'snacks', 'kcal': 215, 'protein': 10, 'fat': 9, 'carbs': 21,
+     'ingredients': {'Хлебцы': 30, 'Сыр': 30}}
+]
+
+# Допустимые размеры порций по приемам пищи (множитель порции из FOOD_TABLE)
+MEAL_PORTIONS = {
+    'breakfast': (1, 1.5),
+    'lunch': (1, 1.5, 2),
+    'dinner': (1, 1.5, 2),
+    'snacks': (1, 2)
+}
+
+# Дневная цель по калориям и белку (г) для цели тренировок и прибавка за уровень
+NUTRITION_TARGETS = {
+    'weight_loss': {'kcal': 1900, 'protein': 130},
+    'muscle_gain': {'kcal': 2900, 'protein': 170},
+    'maintenance': {'kcal': 2300, 'protein': 120}
+}
+NUTRITION_LEVEL_BONUS = {
+    'beginner': {'kcal': 0, 'protein': 0},
+    'intermediate': {'kcal': 100, 'protein': 10},
+    'advanced': {'kcal': 200, 'protein': 20}
+}
+# Допустимое отклонение калорий от цели и недобор белка (доля)
+NUTRITION_TOLERANCE = float(os.getenv('NUTRITION_TOLERANCE', '0.05'))
@@ -1,17 +1,328 @@
 import sqlite3
 import json
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from collections import OrderedDict
 import logging
 
+import config
+import metrics
+
 logger = logging.getLogger(__name__)
 
+class UserProfile:
+    """Профиль пользователя с именованными полями вместо кортежа SELECT *"""
+
+    __slots__ = (
+        'user_id', 'username', 'first_name', 'last_name', 'phone', 'goals',
+        'fitness_level', 'preferred_time', 'subscription_type', 'subscription_end',
+        'registration_date', 'workout_count', 'last_workout', 'total_calories',
+        'conversation_summary', 'summary_until'
+    )
+
+    def __init__(self, row):
+        for name, value in zip(self.__slots__, row):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"UserProfile(user_id={self.user_id}, goals={self.goals!r}, fitness_level={self.fitness_level!r})"
+
+PROFILE_COLUMNS = ', '.join(UserProfile.__slots__)
+
+# Выгрузки для администратора: имя -> (таблица, ключ keyset-пагинации, колонки)
+EXPORT_TABLES = {
+    'users': ('users', 'user_id', UserProfile.__slots__),
+    'leads': ('leads', 'id', ('id', 'user_id', 'stage', 'interest_level', 'last_contact',
+                              'next_contact', 'notes', 'created_date')),
+    'conversations': ('conversation_messages', 'id', ('id', 'user_id', 'ts', 'user_message', 'bot_response')),
+    'events': ('lead_events', 'id', ('id', 'user_id', 'event', 'created_at'))
+}
+
+# Поля users, по которым выбираются когорты drip-кампаний (под них есть индексы)
+CAMPAIGN_FIELDS = ('registration_date', 'subscription_end')
+
+
+def _bump(name, day, delta, when='1'):
+    """Тело триггера: прибавляет delta к счетчику (day, name), создавая его при необходимости"""
+    return f'''
+        INSERT INTO stats_counters (day, name, value) SELECT {day}, {name}, {delta} WHERE {when}
+        ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;'''
+
+# Триггеры агрегатов для /admin: счетчики обновляются той же транзакцией,
+# что и данные, поэтому верны при любом числе процессов-воркеров
+STATS_TRIGGERS = (
+    ('stats_leads_insert', 'AFTER INSERT ON leads',
+     _bump("'stage:' || COALESCE(NEW.stage, '')", "''", 1)),
+    ('stats_leads_stage', 'AFTER UPDATE OF stage ON leads WHEN OLD.stage IS NOT NEW.stage',
+     _bump("'stage:' || COALESCE(OLD.stage, '')", "''", -1)
+     + _bump("'stage:' || COALESCE(NEW.stage, '')", "''", 1)),
+    ('stats_leads_delete', 'AFTER DELETE ON leads',
+     _bump("'stage:' || COALESCE(OLD.stage, '')", "''", -1)),
+    ('stats_users_insert', 'AFTER INSERT ON users',
+     _bump("'subscription:' || COALESCE(NEW.subscription_type, '')", "''", 1)
+     + _bump("'registrations'", "date(NEW.registration_date)", 1)
+     + _bump("'trial_end'", "NEW.subscription_end", 1,
+             "NEW.subscription_type = 'trial' AND NEW.subscription_end IS NOT NULL")),
+    ('stats_users_subscription', 'AFTER UPDATE OF subscription_type, subscription_end ON users',
+     _bump("'subscription:' || COALESCE(OLD.subscription_type, '')", "''", -1)
+     + _bump("'subscription:' || COALESCE(NEW.subscription_type, '')", "''", 1)
+     + _bump("'trial_end'", "OLD.subscription_end", -1,
+             "OLD.subscription_type = 'trial' AND OLD.subscription_end IS NOT NULL")
+     + _bump("'trial_end'", "NEW.subscription_end", 1,
+             "NEW.subscription_type = 'trial' AND NEW.subscription_end IS NOT NULL")),
+    ('stats_users_delete', 'AFTER DELETE ON users',
+     _bump("'subscription:' || COALESCE(OLD.subscription_type, '')", "''", -1)
+     + _bump("'trial_end'", "OLD.subscription_end", -1,
+             "OLD.subscription_type = 'trial' AND OLD.subscription_end IS NOT NULL")),
+    ('stats_messages_insert', 'AFTER INSERT ON conversation_messages',
+     _bump("'messages'", "date(NEW.ts)", 1)
+     + '\n        INSERT OR IGNORE INTO daily_active (day, user_id) VALUES (date(NEW.ts), NEW.user_id);'),
+    ('stats_events_insert', 'AFTER INSERT ON lead_events',
+     _bump("'event:' || NEW.event", "date(NEW.created_at)", 1)
+     + '\n        INSERT OR IGNORE INTO daily_active (day, user_id) VALUES (date(NEW.created_at), NEW.user_id);'),
+    # Строка в daily_active появляется один раз за день на пользователя
+    ('stats_daily_active_insert', 'AFTER INSERT ON daily_active',
+     _bump("'active_users'", "NEW.day", 1))
+)
+
+class WriteBehindBuffer:
+    """Отложенные частые мутации, схлопнутые по ключу до следующего сброса"""
+
+    def __init__(self):
+        self.lead_stages = {}    # user_id -> stage (побеждает последняя)
+        self.lead_interest = {}  # user_id -> суммарный прирост interest_level
+        self.lead_events = []    # (user_id, event, created_at)
+        self.conversations = []  # (user_id, ts, user_message, bot_response)
+
+    def __len__(self):
+        return len(self.lead_stages) + len(self.lead_interest) + len(self.lead_events) + len(self.conversations)
+
+    def merge_older(self, older):
+        """Возвращает в буфер несохраненную пачку (она старше текущих данных)"""
+        for user_id, stage in older.lead_stages.items():
+            self.lead_stages.setdefault(user_id, stage)
+        for user_id, weight in older.lead_interest.items():
+            self.lead_interest[user_id] = self.lead_interest.get(user_id, 0) + weight
+        self.lead_events[:0] = older.lead_events
+        self.conversations[:0] = older.conversations
+
 class Database:
-    def __init__(self, db_path='fitness_pro.db'):
+    def __init__(self, db_path='fitness_pro.db', readers=4):
         self.db_path = db_path
+
+        # Пул соединений: один писатель (SQLite допускает только одну пишущую
+        # транзакцию) и несколько читателей, которые в режиме WAL не блокируются записью.
+        # Каждый поток пула держит своё постоянное соединение.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        # LRU-кэш профилей. Любая запись в users сбрасывает профиль (write-through),
+        # а счетчик эпох не дает чтению, начатому до записи, положить в кэш старые данные
+        self._profiles = OrderedDict()
+        self._profiles_epoch = 0
+        self.profile_cache_size = config.PROFILE_CACHE_SIZE
+
+        # Write-behind: частые мутации копятся в памяти и пишутся одной транзакцией
+        # по таймеру или при переполнении; чтения учитывают несохраненное
+        self._pending = WriteBehindBuffer()
+        self._flushing = None
+        self.flush_interval = config.WRITE_BEHIND_INTERVAL
+        self.flush_threshold = config.WRITE_BEHIND_MAX_PENDING
+        # Ошибки сброса подряд
+        self._flush_failures = 0
+        # Лок, таймер и время повтора сброса принадлежат event loop: БД создается
+        # при импорте, а циклов за жизнь процесса бывает несколько (см. _flush_loop)
+        self._loop = None
+        self._flush_lock = None
+        self._flush_handle = None
+        self._flush_tasks = set()
+        self._flush_retry_at = 0
+
+        # Число обращений к пулу (каждое - одна или несколько SQL-команд),
+        # для нагрузочных прогонов
+        self.reads = 0
+        self.writes = 0
+
+        # Пользователи, писавшие в чат с последней очистки истории
+        self._conversations_to_prune = set()
+
+        # Шард процесса (число шардов, номер) для условия user_id % ? = ?: фоновые
+        # задачи (напоминания, отложенные сообщения) берут только своих пользователей
+        self.shard = (1, 0)
+
         self.init_db()
 
+    def _connect(self):
+        # cached_statements: sqlite3 кэширует подготовленные выражения по тексту SQL,
+        # поэтому на постоянном соединении запросы не компилируются повторно
+        conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    def _conn(self):
+        """Постоянное соединение текущего потока пула"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _run_read(self, func, args):
+        return func(self._conn().cursor(), *args)
+
+    def _run_write(self, func, args):
+        conn = self._conn()
+        with conn:  # commit или rollback при ошибке
+            return func(conn.cursor(), *args)
+
+    async def _read(self, func, *args):
+        """Выполняет func(cursor, *args) в пуле читателей, не блокируя event loop"""
+        self.reads += 1
+        return await self._submit(self._readers, self._run_read, 'read', func, args)
+
+    async def _write(self, func, *args):
+        """Выполняет func(cursor, *args) в одной транзакции в потоке писателя"""
+        self.writes += 1
+        return await self._submit(self._writer, self._run_write, 'write', func, args)
+
+    async def _submit(self, executor, run, kind, func, args):
+        loop = asyncio.get_running_loop()
+        if not metrics.registry.enabled:
+            return await loop.run_in_executor(executor, run, func, args)
+
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, run, func, args)
+        finally:
+            # Метка - имя синхронной реализации без подчеркивания (get_user, apply_batch...)
+            metrics.db_seconds.observe(time.perf_counter() - started, kind, func.__name__.lstrip('_'))
+
+    def _flush_loop(self):
+        """Текущий event loop; в новом цикле лок и таймер сброса создаются заново,
+        таймер закрытого цикла уже не сработает и не должен мешать планировать новый"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._flush_lock = asyncio.Lock()
+            self._flush_handle = None
+            self._flush_tasks = set()
+            self._flush_retry_at = 0
+        return loop
+
+    def _buffered(self):
+        """Планирует сброс буфера: по таймеру или сразу при переполнении"""
+        loop = self._flush_loop()
+        # После ошибки сброса повтор уже запланирован - переполнение его не торопит
+        backoff = self._flush_retry_at > loop.time()
+        if len(self._pending) >= self.flush_threshold and not backoff:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        loop = self._flush_loop()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        task = loop.create_task(self._flush_in_background())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush_in_background(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Ошибка сброса write-behind буфера: {e}")
+
+    async def flush(self):
+        """Записывает накопленные мутации одной транзакцией, возвращает их число"""
+        self._flush_loop()
+        async with self._flush_lock:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+
+            batch, self._pending = self._pending, WriteBehindBuffer()
+            if not len(batch):
+                return 0
+
+            self._flushing = batch
+            try:
+                try:
+                    await self._write(self._apply_batch, batch)
+                except sqlite3.IntegrityError:
+                    # Одна битая строка не должна навсегда блокировать остальные:
+                    # пачка откатилась, пишем построчно и отбрасываем то, что не проходит
+                    dropped = await self._write(self._apply_batch_rows, batch)
+                    for table, user_id, error in dropped:
+                        logger.error(f"❌ Write-behind: строка {table} пользователя {user_id} отброшена: {error}")
+            except Exception:
+                self._pending.merge_older(batch)
+                self._retry_flush_later()
+                raise
+            finally:
+                self._flushing = None
+            self._flush_failures = 0
+            return len(batch)
+
+    def _retry_flush_later(self):
+        """Повтор сброса после ошибки - с растущей паузой, а не на каждую новую мутацию"""
+        self._flush_failures += 1
+        delay = min(self.flush_interval * 2 ** self._flush_failures, config.WRITE_BEHIND_MAX_BACKOFF)
+        loop = self._flush_loop()
+        self._flush_retry_at = loop.time() + delay
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(delay, self._start_flush)
+
+    @staticmethod
+    def _batch_statements(batch):
+        """(таблица, SQL, строки) пачки в порядке применения; user_id - последний параметр
+        UPDATE и первый параметр INSERT"""
+        return [
+            ('leads', 'UPDATE leads SET stage = ? WHERE user_id = ?',
+             [(stage, user_id) for user_id, stage in batch.lead_stages.items()]),
+            ('lead_events', 'INSERT INTO lead_events (user_id, event, created_at) VALUES (?, ?, ?)',
+             batch.lead_events),
+            ('leads', '''
+                UPDATE leads
+                SET interest_level = MIN(interest_level + ?, ?), last_contact = DATE('now')
+                WHERE user_id = ?
+            ''', [(weight, config.LEAD_MAX_INTEREST, user_id) for user_id, weight in batch.lead_interest.items()]),
+            ('conversation_messages', '''
+                INSERT INTO conversation_messages (user_id, ts, user_message, bot_response)
+                VALUES (?, ?, ?, ?)
+            ''', batch.conversations)
+        ]
+
+    def _apply_batch(self, cur, batch):
+        for _, sql, rows in self._batch_statements(batch):
+            cur.executemany(sql, rows)
+
+    def _apply_batch_rows(self, cur, batch):
+        """Пачка построчно в одной транзакции; ошибка строки откатывает только ее"""
+        dropped = []
+        for table, sql, rows in self._batch_statements(batch):
+            for row in rows:
+                try:
+                    cur.execute(sql, row)
+                except sqlite3.IntegrityError as e:
+                    user_id = row[0] if sql.lstrip().startswith('INSERT') else row[-1]
+                    dropped.append((table, user_id, str(e)))
+        return dropped
+
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cur = conn.cursor()
 
         # Пользователи
@@ -49,14 +360,245 @@ class Database:
             )
         ''')
 
+        # Горячие лиды: фильтр по стадии и интересу, затем join по первичному ключу users
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_leads_stage_interest
+            ON leads (stage, interest_level)
+        ''')
+
+        # События воронки: из них инкрементально считается interest_level
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS lead_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                event TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Напоминания: выборка по времени с keyset-пагинацией по (preferred_time, user_id),
+        # статус подписки проверяется прямо по индексу
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_reminders
+            ON users (preferred_time, user_id, subscription_type, subscription_end)
+        ''')
+
+        # История диалогов: одна строка на реплику
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                ts TIMESTAMP NOT NULL,
+                user_message TEXT,
+                bot_response TEXT
+            )
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_conversation_user_ts
+            ON conversation_messages (user_id, ts)
+        ''')
+
+        # Кэш AI-ответов
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS ai_response_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ai_response_cache_expires
+            ON ai_response_cache (expires_at)
+        ''')
+
+        # Отложенные сообщения: одна запись на (пользователь, тип), очередь по due_at
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                due_at REAL NOT NULL,
+                payload TEXT,
+                UNIQUE (user_id, kind)
+            )
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_scheduled_messages_due
+            ON scheduled_messages (due_at)
+        ''')
+
+        version = cur.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            self._migrate_conversation_history(cur)
+            cur.execute('PRAGMA user_version = 1')
+        if version < 2:
+            self._deduplicate_leads(cur)
+            cur.execute('PRAGMA user_version = 2')
+        if version < 3:
+            # Краткое содержание старой части диалога и время последней свернутой реплики
+            cur.execute('ALTER TABLE users ADD COLUMN conversation_summary TEXT')
+            cur.execute('ALTER TABLE users ADD COLUMN summary_until TEXT')
+            cur.execute('PRAGMA user_version = 3')
+        if version < 4:
+            self._create_stats_counters(cur)
+            cur.execute('PRAGMA user_version = 4')
+        if version < 5:
+            self._create_campaign_log(cur)
+            cur.execute('PRAGMA user_version = 5')
+        if version < 6:
+            self._convert_conversation_times_to_utc(cur)
+            cur.execute('PRAGMA user_version = 6')
+        if version < 7:
+            # Горячие лиды идут по idx_leads_stage_interest и первичному ключу users - индекс не нужен
+            cur.execute('DROP INDEX IF EXISTS idx_users_subscription_workouts')
+            cur.execute('PRAGMA user_version = 7')
+
+        # Один лид на пользователя
+        cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_leads_user ON leads (user_id)')
+
         conn.commit()
         conn.close()
         logger.info("✅ Профессиональная БД создана")
 
-    def add_user(self, user_id, username, first_name, last_name):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
+    def _migrate_conversation_history(self, cur):
+        """Переносит JSON-историю из users.conversation_history в conversation_messages"""
+        rows = cur.execute('''
+            SELECT user_id, conversation_history FROM users
+            WHERE conversation_history IS NOT NULL AND conversation_history != '[]'
+        ''').fetchall()
+
+        migrated = 0
+        for user_id, blob in rows:
+            try:
+                history = json.loads(blob)
+            except ValueError:
+                logger.warning(f"Битая история диалога у {user_id}, пропускаем")
+                continue
+            cur.executemany('''
+                INSERT INTO conversation_messages (user_id, ts, user_message, bot_response)
+                VALUES (?, ?, ?, ?)
+            ''', [(user_id, item.get('timestamp') or datetime.now().isoformat(),
+                   item.get('user_message'), item.get('bot_response'))
+                  for item in history])
+            migrated += len(history)
+
+        cur.execute("UPDATE users SET conversation_history = '[]' WHERE conversation_history != '[]'")
+        if migrated:
+            logger.info(f"📦 Перенесено сообщений истории: {migrated}")
+
+    def _create_stats_counters(self, cur):
+        """Счетчики для /admin: один раз считаются по таблицам, дальше их ведут триггеры"""
+        # day = '' - итоговые счетчики, иначе дата YYYY-MM-DD
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                day TEXT NOT NULL,
+                name TEXT NOT NULL,
+                value INTEGER NOT NULL,
+                PRIMARY KEY (day, name)
+            ) WITHOUT ROWID
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS daily_active (
+                day TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (day, user_id)
+            ) WITHOUT ROWID
+        ''')
+        for name, event, body in STATS_TRIGGERS:
+            cur.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body}\n        END')
+
+        cur.execute('''
+            INSERT INTO stats_counters (day, name, value)
+            SELECT '', 'stage:' || COALESCE(stage, ''), COUNT(*) FROM leads GROUP BY 2
+            UNION ALL
+            SELECT '', 'subscription:' || COALESCE(subscription_type, ''), COUNT(*) FROM users GROUP BY 2
+            UNION ALL
+            SELECT date(registration_date), 'registrations', COUNT(*) FROM users
+            WHERE registration_date IS NOT NULL GROUP BY 1
+            UNION ALL
+            SELECT subscription_end, 'trial_end', COUNT(*) FROM users
+            WHERE subscription_type = 'trial' AND subscription_end IS NOT NULL GROUP BY 1
+            UNION ALL
+            SELECT date(ts), 'messages', COUNT(*) FROM conversation_messages GROUP BY 1
+            UNION ALL
+            SELECT date(created_at), 'event:' || event, COUNT(*) FROM lead_events GROUP BY 1, 2
+        ''')
+        # Счетчик active_users наполняет триггер daily_active
+        cur.execute('''
+            INSERT OR IGNORE INTO daily_active (day, user_id)
+            SELECT date(ts), user_id FROM conversation_messages
+            UNION
+            SELECT date(created_at), user_id FROM lead_events
+        ''')
+
+    def _convert_conversation_times_to_utc(self, cur):
+        """Метки реплик писались по местному времени: переводит их в UTC и пересчитывает дневные счетчики"""
+        # strftime('%f') дает миллисекунды, остаток микросекунд isoformat дописывается как был
+        utc = "strftime('%Y-%m-%dT%H:%M:%f', {0}, 'utc') || substr({0}, 24)"
+        cur.execute(f'UPDATE conversation_messages SET ts = {utc.format("ts")}')
+        cur.execute(f'UPDATE users SET summary_until = {utc.format("summary_until")} WHERE summary_until IS NOT NULL')
 
+        cur.execute("DELETE FROM stats_counters WHERE name IN ('messages', 'active_users')")
+        cur.execute('DELETE FROM daily_active')
+        cur.execute('''
+            INSERT INTO stats_counters (day, name, value)
+            SELECT date(ts), 'messages', COUNT(*) FROM conversation_messages GROUP BY 1
+        ''')
+        # active_users снова наполняет триггер daily_active
+        cur.execute('''
+            INSERT OR IGNORE INTO daily_active (day, user_id)
+            SELECT date(ts), user_id FROM conversation_messages
+            UNION
+            SELECT date(created_at), user_id FROM lead_events
+        ''')
+
+    def _create_campaign_log(self, cur):
+        """Журнал drip-кампаний и индексы выборки когорт пробного периода"""
+        # Запись делается до постановки в очередь: рестарт не отправит сообщение повторно
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS campaign_log (
+                campaign TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                sent_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (campaign, user_id)
+            ) WITHOUT ROWID
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_trial_registration
+            ON users (subscription_type, registration_date, user_id)
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_trial_end
+            ON users (subscription_type, subscription_end, user_id)
+        ''')
+
+    def _deduplicate_leads(self, cur):
+        """Оставляет по одному лиду на пользователя (INSERT OR IGNORE раньше плодил дубли)"""
+        cur.execute('''
+            DELETE FROM leads WHERE id NOT IN (
+                SELECT MIN(id) FROM leads GROUP BY user_id
+            )
+        ''')
+        if cur.rowcount:
+            logger.info(f"📦 Удалено дублей лидов: {cur.rowcount}")
+
+    def close(self):
+        """Дожидается завершения запросов и закрывает соединения пула"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    async def add_user(self, user_id, username, first_name, last_name):
+        await self._write(self._add_user, user_id, username, first_name, last_name)
+        self.invalidate_profile(user_id)
+
+    def _add_user(self, cur, user_id, username, first_name, last_name):
         trial_end = datetime.now() + timedelta(days=7)
 
         cur.execute('''
@@ -71,64 +613,357 @@ class Database:
             VALUES (?, 'new')
         ''', (user_id,))
 
-        conn.commit()
-        conn.close()
+    async def update_lead_stage(self, user_id, stage):
+        self._pending.lead_stages[user_id] = stage
+        self._buffered()
 
-    def update_lead_stage(self, user_id, stage):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute('UPDATE leads SET stage = ? WHERE user_id = ?', (stage, user_id))
-        conn.commit()
-        conn.close()
+    async def get_user(self, user_id):
+        """Профиль пользователя (UserProfile) или None"""
+        if user_id in self._profiles:
+            self._profiles.move_to_end(user_id)
+            return self._profiles[user_id]
 
-    def get_user(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = cur.fetchone()
-        conn.close()
-        return user
+        epoch = self._profiles_epoch
+        profile = await self._read(self._get_user, user_id)
+        if epoch == self._profiles_epoch:
+            self._profiles[user_id] = profile
+            if len(self._profiles) > self.profile_cache_size:
+                self._profiles.popitem(last=False)
+        return profile
 
-    def update_conversation(self, user_id, message, response):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
+    def _get_user(self, cur, user_id):
+        cur.execute(f'SELECT {PROFILE_COLUMNS} FROM users WHERE user_id = ?', (user_id,))
+        row = cur.fetchone()
+        return UserProfile(row) if row else None
 
-        # Получаем текущую историю
-        cur.execute('SELECT conversation_history FROM users WHERE user_id = ?', (user_id,))
-        result = cur.fetchone()
-        history = json.loads(result[0]) if result and result[0] else []
+    def set_shard(self, index, count):
+        self.shard = (count, index)
 
-        # Добавляем новое сообщение
-        history.append({
-            'timestamp': datetime.now().isoformat(),
-            'user_message': message,
-            'bot_response': response
-        })
+    def invalidate_profile(self, user_id):
+        """Сбрасывает кэш профиля после изменения users"""
+        self._profiles.pop(user_id, None)
+        self._profiles_epoch += 1
 
-        # Сохраняем обратно (ограничиваем размер)
-        if len(history) > 50:
-            history = history[-50:]
+    async def update_conversation(self, user_id, message, response):
+        self._conversations_to_prune.add(user_id)
+        # UTC, как registration_date и lead_events: по этим меткам триггеры считают дни stats_counters
+        self._pending.conversations.append((user_id, datetime.utcnow().isoformat(), message, response))
+        self._buffered()
 
-        cur.execute('UPDATE users SET conversation_history = ? WHERE user_id = ?',
-                   (json.dumps(history), user_id))
-        conn.commit()
-        conn.close()
+    async def update_conversation_summary(self, user_id, summary, until):
+        await self._write(self._update_conversation_summary, user_id, summary, until)
+        # Профиль в кэше правится на месте, эпоха не дает чтению до записи вернуть старое
+        self._profiles_epoch += 1
+        profile = self._profiles.get(user_id)
+        if profile is not None:
+            profile.conversation_summary = summary
+            profile.summary_until = until
+
+    def _update_conversation_summary(self, cur, user_id, summary, until):
+        cur.execute('''
+            UPDATE users SET conversation_summary = ?, summary_until = ?
+            WHERE user_id = ?
+        ''', (summary, until, user_id))
+
+    async def get_conversation(self, user_id, limit=10):
+        """Последние limit реплик диалога в хронологическом порядке"""
+        # Несохраненные реплики снимаем до чтения: если пачка успеет записаться,
+        # пока идет запрос, дубликаты отсеются по времени реплики
+        pending = [
+            {'timestamp': ts, 'user_message': message, 'bot_response': response}
+            for buffer in (self._flushing, self._pending) if buffer is not None
+            for pending_user_id, ts, message, response in buffer.conversations
+            if pending_user_id == user_id
+        ]
+        history = await self._read(self._get_conversation, user_id, limit)
+        if pending:
+            seen = {item['timestamp'] for item in history}
+            history += [item for item in pending if item['timestamp'] not in seen]
+            history.sort(key=lambda item: item['timestamp'])
+            history = history[-limit:]
+        return history
+
+    def _get_conversation(self, cur, user_id, limit):
+        cur.execute('''
+            SELECT ts, user_message, bot_response FROM conversation_messages
+            WHERE user_id = ?
+            ORDER BY ts DESC
+            LIMIT ?
+        ''', (user_id, limit))
+        return [
+            {'timestamp': ts, 'user_message': message, 'bot_response': response}
+            for ts, message, response in reversed(cur.fetchall())
+        ]
+
+    async def prune_conversations(self, keep=50, batch_size=500):
+        """Удаляет старые реплики сверх keep у пользователей, писавших с прошлой очистки"""
+        user_ids = list(self._conversations_to_prune)
+        self._conversations_to_prune.clear()
+
+        for i in range(0, len(user_ids), batch_size):
+            await self._write(self._prune_conversations, user_ids[i:i + batch_size], keep)
+        return len(user_ids)
+
+    def _prune_conversations(self, cur, user_ids, keep):
+        cur.executemany('''
+            DELETE FROM conversation_messages
+            WHERE user_id = ? AND ts < (
+                SELECT ts FROM conversation_messages
+                WHERE user_id = ?
+                ORDER BY ts DESC
+                LIMIT 1 OFFSET ?
+            )
+        ''', [(user_id, user_id, keep - 1) for user_id in user_ids])
+
+    async def get_cached_response(self, key, now):
+        """Возвращает (response, expires_at) из кэша AI-ответов или None"""
+        return await self._read(self._get_cached_response, key, now)
+
+    def _get_cached_response(self, cur, key, now):
+        cur.execute('''
+            SELECT response, expires_at FROM ai_response_cache
+            WHERE key = ? AND expires_at > ?
+        ''', (key, now))
+        return cur.fetchone()
+
+    async def put_cached_response(self, key, response, expires_at):
+        await self._write(self._put_cached_response, key, response, expires_at)
+
+    def _put_cached_response(self, cur, key, response, expires_at):
+        cur.execute('''
+            INSERT OR REPLACE INTO ai_response_cache (key, response, expires_at)
+            VALUES (?, ?, ?)
+        ''', (key, response, expires_at))
+
+    async def prune_response_cache(self, now, max_rows):
+        """Удаляет просроченные ответы и самые старые сверх max_rows"""
+        await self._write(self._prune_response_cache, now, max_rows)
 
-    def get_hot_leads(self):
+    def _prune_response_cache(self, cur, now, max_rows):
+        cur.execute('DELETE FROM ai_response_cache WHERE expires_at <= ?', (now,))
+        cur.execute('''
+            DELETE FROM ai_response_cache WHERE key IN (
+                SELECT key FROM ai_response_cache
+                ORDER BY expires_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (max_rows,))
+
+    async def iter_reminder_recipients(self, time_from, time_to, today, batch_size=1000):
+        """Пачками отдает (user_id, first_name) с preferred_time в [time_from, time_to)
+        и активной подпиской. Каждая пачка - отдельный короткий запрос по индексу,
+        поэтому память и время удержания соединения не зависят от числа пользователей."""
+        last = (time_from, -1)
+        while True:
+            rows = await self._read(self._get_reminder_batch, last, time_to, today, batch_size, self.shard)
+            if not rows:
+                return
+            yield [(user_id, first_name) for _, user_id, first_name in rows]
+            if len(rows) < batch_size:
+                return
+            last = rows[-1][:2]
+
+    def _get_reminder_batch(self, cur, last, time_to, today, batch_size, shard):
+        cur.execute('''
+            SELECT preferred_time, user_id, first_name FROM users
+            WHERE (preferred_time, user_id) > (?, ?)
+            AND preferred_time < ?
+            AND (subscription_type = 'premium' OR subscription_end >= ?)
+            AND user_id % ? = ?
+            ORDER BY preferred_time, user_id
+            LIMIT ?
+        ''', (last[0], last[1], time_to, today, *shard, batch_size))
+        return cur.fetchall()
+
+    async def schedule_message(self, user_id, kind, due_at, payload=None):
+        """Ставит отложенное сообщение; False если такое уже ждет отправки"""
+        return await self._write(self._schedule_message, user_id, kind, due_at, payload)
+
+    def _schedule_message(self, cur, user_id, kind, due_at, payload):
+        cur.execute('''
+            INSERT OR IGNORE INTO scheduled_messages (user_id, kind, due_at, payload)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, kind, due_at, json.dumps(payload) if payload is not None else None))
+        return cur.rowcount > 0
+
+    async def get_due_messages(self, now, limit):
+        return await self._read(self._get_due_messages, now, limit, self.shard)
+
+    def _get_due_messages(self, cur, now, limit, shard):
+        cur.execute('''
+            SELECT id, user_id, kind, payload FROM scheduled_messages
+            WHERE due_at <= ? AND user_id % ? = ?
+            ORDER BY due_at
+            LIMIT ?
+        ''', (now, *shard, limit))
+        return [
+            (message_id, user_id, kind, json.loads(payload) if payload else None)
+            for message_id, user_id, kind, payload in cur.fetchall()
+        ]
+
+    async def get_next_due_at(self):
+        return await self._read(self._get_next_due_at, self.shard)
+
+    def _get_next_due_at(self, cur, shard):
+        cur.execute('SELECT MIN(due_at) FROM scheduled_messages WHERE user_id % ? = ?', shard)
+        return cur.fetchone()[0]
+
+    async def delete_scheduled_messages(self, message_ids):
+        await self._write(self._delete_scheduled_messages, message_ids)
+
+    def _delete_scheduled_messages(self, cur, message_ids):
+        cur.executemany('DELETE FROM scheduled_messages WHERE id = ?', [(i,) for i in message_ids])
+
+    async def record_lead_event(self, user_id, event):
+        """Записывает событие воронки и увеличивает interest_level лида на вес события"""
+        created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        self._pending.lead_events.append((user_id, event, created_at))
+        weight = config.LEAD_EVENT_WEIGHTS.get(event, 0)
+        if weight:
+            self._pending.lead_interest[user_id] = self._pending.lead_interest.get(user_id, 0) + weight
+        self._buffered()
+
+    def _record_lead_event(self, cur, user_id, event, weight):
+        cur.execute('INSERT INTO lead_events (user_id, event) VALUES (?, ?)', (user_id, event))
+        if weight:
+            cur.execute('''
+                UPDATE leads
+                SET interest_level = MIN(interest_level + ?, ?), last_contact = DATE('now')
+                WHERE user_id = ?
+            ''', (weight, config.LEAD_MAX_INTEREST, user_id))
+
+    async def complete_workout(self, user_id):
+        """Отмечает выполненную тренировку"""
+        weight = config.LEAD_EVENT_WEIGHTS.get('workout_done', 0)
+        await self._write(self._complete_workout, user_id, weight)
+        self.invalidate_profile(user_id)
+
+    def _complete_workout(self, cur, user_id, weight):
+        cur.execute('''
+            UPDATE users
+            SET workout_count = workout_count + 1, last_workout = DATE('now')
+            WHERE user_id = ?
+        ''', (user_id,))
+        self._record_lead_event(cur, user_id, 'workout_done', weight)
+
+    async def get_stats_counters(self, day_from, day_to):
+        """Итоговые счетчики и дневные за [day_from, day_to]: {(day, name): value}"""
+        return await self._read(self._get_stats_counters, day_from, day_to)
+
+    def _get_stats_counters(self, cur, day_from, day_to):
+        cur.execute('''
+            SELECT day, name, value FROM stats_counters
+            WHERE day = '' OR day BETWEEN ? AND ?
+        ''', (day_from, day_to))
+        return {(day, name): value for day, name, value in cur.fetchall()}
+
+    async def prune_daily_active(self, before):
+        """Удаляет отметки активности до даты before (счетчики active_users остаются)"""
+        await self._write(self._prune_daily_active, before)
+
+    def _prune_daily_active(self, cur, before):
+        cur.execute('DELETE FROM daily_active WHERE day < ?', (before,))
+
+    async def prune_lead_events(self, before):
+        """Удаляет события воронки раньше before (interest_level и счетчики остаются)"""
+        await self._write(self._prune_lead_events, before)
+
+    def _prune_lead_events(self, cur, before):
+        # id растет вместе с created_at: граница ищется с начала таблицы, без полного прохода
+        cur.execute('SELECT id FROM lead_events WHERE created_at >= ? ORDER BY id LIMIT 1', (before,))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute('DELETE FROM lead_events WHERE created_at < ?', (before,))
+        else:
+            cur.execute('DELETE FROM lead_events WHERE id < ?', row)
+
+    async def iter_export(self, table, batch_size=1000):
+        """Пачками отдает строки выгрузки table (см. EXPORT_TABLES). Каждая пачка -
+        отдельный короткий запрос по первичному ключу, память не зависит от размера таблицы"""
+        last = -2 ** 63
+        while True:
+            rows = await self._read(self._get_export_batch, table, last, batch_size)
+            if not rows:
+                return
+            yield rows
+            if len(rows) < batch_size:
+                return
+            last = rows[-1][0]
+
+    def _get_export_batch(self, cur, table, last, batch_size):
+        name, key, columns = EXPORT_TABLES[table]
+        # Ключ первым столбцом - по нему продолжается следующая пачка
+        cur.execute(f'''
+            SELECT {key}, {', '.join(columns)} FROM {name}
+            WHERE {key} > ?
+            ORDER BY {key}
+            LIMIT ?
+        ''', (last, batch_size))
+        return cur.fetchall()
+
+    async def claim_campaign_batch(self, campaign, field, last, end, batch_size=500):
+        """Отмечает в журнале следующую пачку когорты кампании: пользователи на пробном
+        периоде с field в [last, end), по ключу (field, user_id). Возвращает (user_id,
+        которых эта пачка забрала, ключ продолжения или None, если когорта пройдена)."""
+        return await self._write(self._claim_campaign_batch, campaign, field, last, end, batch_size,
+                                 datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'), self.shard)
+
+    def _claim_campaign_batch(self, cur, campaign, field, last, end, batch_size, now, shard):
+        if field not in CAMPAIGN_FIELDS:
+            raise ValueError(f"Когорта выбирается только по {CAMPAIGN_FIELDS}")
+        cur.execute(f'''
+            SELECT {field}, user_id FROM users
+            WHERE subscription_type = 'trial'
+            AND ({field}, user_id) > (?, ?)
+            AND {field} < ?
+            AND user_id % ? = ?
+            AND NOT EXISTS (SELECT 1 FROM campaign_log l WHERE l.campaign = ? AND l.user_id = users.user_id)
+            ORDER BY {field}, user_id
+            LIMIT ?
+        ''', (last[0], last[1], end, *shard, campaign, batch_size))
+        rows = cur.fetchall()
+
+        # OR IGNORE и rowcount: пачку, уже забранную другим процессом, никто не отправит дважды
+        claimed = []
+        for _, user_id in rows:
+            cur.execute('INSERT OR IGNORE INTO campaign_log (campaign, user_id, sent_at) VALUES (?, ?, ?)',
+                        (campaign, user_id, now))
+            if cur.rowcount:
+                claimed.append(user_id)
+        return claimed, (rows[-1] if len(rows) == batch_size else None)
+
+    async def release_campaign_claims(self, campaign, user_ids):
+        """Возвращает в когорту забранных, но не отправленных (проход прерван остановкой)"""
+        await self._write(self._release_campaign_claims, campaign, user_ids)
+
+    def _release_campaign_claims(self, cur, campaign, user_ids):
+        cur.executemany('DELETE FROM campaign_log WHERE campaign = ? AND user_id = ?',
+                        [(campaign, user_id) for user_id in user_ids])
+
+    async def prune_campaign_log(self, before):
+        """Удаляет записи журнала кампаний старше before - их когорты давно пройдены"""
+        await self._write(self._prune_campaign_log, before)
+
+    def _prune_campaign_log(self, cur, before):
+        cur.execute('DELETE FROM campaign_log WHERE sent_at < ?', (before,))
+
+    async def get_hot_leads(self, limit=100):
         """Получает горячих лидов для авто-продаж"""
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
+        await self.flush()
+        return await self._read(self._get_hot_leads, limit)
+
+    def _get_hot_leads(self, cur, limit):
         cur.execute('''
             SELECT u.user_id, u.first_name, u.workout_count, l.interest_level
-            FROM users u
-            JOIN leads l ON u.user_id = l.user_id
-            WHERE u.subscription_type = 'trial'
-            AND u.workout_count >= 3
+            FROM leads l
+            JOIN users u ON u.user_id = l.user_id
+            WHERE l.stage = 'engaged'
             AND l.interest_level >= 3
-            AND l.stage = 'engaged'
-        ''')
-        leads = cur.fetchall()
-        conn.close()
-        return leads
+            AND u.subscription_type = 'trial'
+            AND u.workout_count >= 3
+            ORDER BY l.interest_level DESC
+            LIMIT ?
+        ''', (limit,))
+        return cur.fetchall()
 
-db = Database()
\ No newline at end of file
+db = Database()
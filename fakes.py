@@ -0,0 +1,111 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+from telegram import Bot
+from telegram.request import BaseRequest
+
+FAKE_TOKEN = '123456:FAKE-TOKEN'
+
+class FakeTelegramRequest(BaseRequest):
+    """Локальный транспорт Bot API для тестов и нагрузочных прогонов.
+
+    Ничего не отправляет в сеть: записывает вызовы в calls и отвечает так,
+    как ответил бы Telegram. Умеет эмулировать задержку, заблокировавших бота
+    пользователей и флуд-контроль (429 с retry_after) при превышении лимитов.
+    """
+
+    def __init__(self, latency=0.0, blocked_chats=(), global_rate=None, per_chat_interval=None):
+        self.latency = latency
+        self.blocked_chats = set(blocked_chats)
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+
+        self.calls = []  # (метод API, параметры)
+        self.flood_errors = 0
+        self._recent = deque()
+        self._chat_last = {}
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def sent(self, method='sendMessage'):
+        """Параметры всех успешных вызовов метода"""
+        return [params for name, params in self.calls if name == method]
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = params.get('chat_id')
+        if chat_id is not None:
+            chat_id = int(chat_id)
+            if chat_id in self.blocked_chats:
+                return self._error(403, 'Forbidden: bot was blocked by the user')
+            if self._is_flood(chat_id):
+                self.flood_errors += 1
+                return self._error(429, 'Too Many Requests: retry after 1', {'retry_after': 1})
+
+        self.calls.append((api_method, params))
+        return 200, json.dumps({'ok': True, 'result': self._result(api_method, params, chat_id)}).encode()
+
+    def _is_flood(self, chat_id):
+        now = time.monotonic()
+        if self.global_rate:
+            while self._recent and now - self._recent[0] > 1:
+                self._recent.popleft()
+            if len(self._recent) >= self.global_rate:
+                return True
+        if self.per_chat_interval and now - self._chat_last.get(chat_id, -1e9) < self.per_chat_interval:
+            return True
+        self._recent.append(now)
+        self._chat_last[chat_id] = now
+        return False
+
+    def _result(self, api_method, params, chat_id):
+        if api_method == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'FitFriends', 'username': 'fitfriends_test_bot',
+                    'can_join_groups': False, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': False}
+        if api_method == 'getUpdates':
+            return []
+        if api_method in ('sendMessage', 'sendDocument', 'editMessageText') and chat_id is not None:
+            self._message_id += 1
+            return {
+                'message_id': params.get('message_id', self._message_id),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', '')
+            }
+        return True
+
+    @staticmethod
+    def _error(code, description, parameters=None):
+        payload = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            payload['parameters'] = parameters
+        return code, json.dumps(payload).encode()
+
+
+class FakeBot(Bot):
+    """Bot, работающий поверх FakeTelegramRequest"""
+
+    def __init__(self, **request_kwargs):
+        super().__init__(
+            FAKE_TOKEN,
+            request=FakeTelegramRequest(**request_kwargs),
+            get_updates_request=FakeTelegramRequest()
+        )
+
+    @property
+    def transport(self):
+        return self.request
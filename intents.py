@@ -0,0 +1,157 @@
+import re
+import random
+import time
+
+import config
+
+_WORD = re.compile(r'\w+')
+
+# Окончания для упрощенного стемминга, от длинных к коротким
+_REFLEXIVE = ('ся', 'сь')
+_ENDINGS = frozenset((
+    'иями', 'ями', 'ами', 'ией', 'ием', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ешь', 'ишь', 'ете', 'ите', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее',
+    'ые', 'ие', 'ия', 'ии', 'ию', 'ье', 'ья', 'ую', 'юю', 'ом', 'ем', 'ам', 'ям',
+    'ах', 'ях', 'ов', 'ев', 'ть', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'
+))
+_ENDING_LENGTHS = sorted({len(ending) for ending in _ENDINGS}, reverse=True)
+_MIN_STEM = 3
+
+
+def stem(word):
+    """Упрощенный стеммер: отрезает возвратную частицу и одно окончание"""
+    for suffix in _REFLEXIVE:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            word = word[:-len(suffix)]
+            break
+    for length in _ENDING_LENGTHS:
+        if len(word) - length >= _MIN_STEM and word[-length:] in _ENDINGS:
+            return word[:-length]
+    return word
+
+
+def words(text):
+    """Слова текста в нижнем регистре, ё -> е"""
+    return _WORD.findall(text.lower().replace('ё', 'е'))
+
+
+class IntentMatcher:
+    """Aho-Corasick по основам слов: все совпавшие фразы всех групп за один проход.
+
+    Слово сообщения совпадает со словом фразы, если у них общая основа
+    (похудею - похудеть) или если оно начинается со слова фразы целиком
+    (приветик - привет, скучновато - скучно), как при прежнем поиске подстрокой.
+    """
+
+    def __init__(self, groups):
+        # groups: {группа: [фраза, ...]} - порядок фраз задает приоритет
+        self.phrases = []  # id -> (группа, фраза)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.stems = set()  # основы всех слов фраз
+        self.prefixes = {}  # слово фразы -> его основа
+        self.longest_prefix = 0
+
+        for group, phrases in groups.items():
+            for phrase in phrases:
+                phrase_words = words(phrase)
+                tokens = [stem(word) for word in phrase_words]
+                self._add(tokens, len(self.phrases))
+                self.phrases.append((group, phrase))
+                self.stems.update(tokens)
+                self.prefixes.update(zip(phrase_words, tokens))
+                self.longest_prefix = max([self.longest_prefix, *map(len, phrase_words)])
+        self._build_links()
+
+    def normalize(self, word):
+        """Основа слова сообщения; для производного от слова фразы - основа этого слова"""
+        token = stem(word)
+        if token in self.stems or len(word) <= _MIN_STEM:
+            return token
+        for length in range(min(len(word) - 1, self.longest_prefix), _MIN_STEM - 1, -1):
+            prefix = self.prefixes.get(word[:length])
+            if prefix is not None:
+                return prefix
+        return token
+
+    def _add(self, tokens, phrase_id):
+        node = 0
+        for token in tokens:
+            nxt = self.goto[node].get(token)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][token] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = nxt
+        self.output[node].append(phrase_id)
+
+    def _build_links(self):
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and token not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(token, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def match(self, text):
+        """Возвращает {группа: [фраза, ...]} в порядке приоритета фраз"""
+        found = set()
+        node = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for word in words(text):
+            token = self.normalize(word)
+            while node and token not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(token, 0)
+            if output[node]:
+                found.update(output[node])
+
+        result = {}
+        for phrase_id in sorted(found):
+            group, phrase = self.phrases[phrase_id]
+            result.setdefault(group, []).append(phrase)
+        return result
+
+
+intent_matcher = IntentMatcher({
+    'fallback': list(config.FALLBACK_RESPONSES),
+    'sale': list(config.SALE_TRIGGERS)
+})
+
+
+def benchmark(patterns=3000, messages=2000):
+    """Сравнение с прежними циклами `if key in message` на большом словаре"""
+    rnd = random.Random(42)
+    alphabet = 'абвгдежзиклмнопрстуфхцчшщыэюя'
+    words = [''.join(rnd.choice(alphabet) for _ in range(rnd.randint(4, 9))) for _ in range(2000)]
+    table = {' '.join(rnd.sample(words, rnd.randint(1, 3))): 'ответ' for _ in range(patterns)}
+    texts = [' '.join(rnd.choices(words, k=12)) for _ in range(messages)]
+
+    started = time.perf_counter()
+    for text in texts:
+        lower = text.lower()
+        [key for key in table if key in lower]
+    loops = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matcher = IntentMatcher({'bench': list(table)})
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for text in texts:
+        matcher.match(text)
+    compiled = time.perf_counter() - started
+
+    print(f"Шаблонов: {len(table)}, сообщений: {messages}")
+    print(f"Циклы с `in`:   {loops * 1e6 / messages:.1f} мкс/сообщение")
+    print(f"IntentMatcher:  {compiled * 1e6 / messages:.1f} мкс/сообщение (сборка {build * 1e3:.1f} мс)")
+
+
+if __name__ == '__main__':
+    benchmark()
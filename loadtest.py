@@ -0,0 +1,548 @@
+"""Нагрузочный прогон FitFriends_bot на локальных заглушках.
+
+Telegram заменяется FakeBot, OpenRouter - локальным aiohttp-сервером с
+настраиваемой задержкой и долей ошибок. Синтетические пользователи шлют
+/start, нажатия кнопок и вопросы AI-чату с заданной частотой; апдейты идут
+в update_queue приложения, как при polling или webhook.
+
+    python loadtest.py --users 200 --updates 5000 --rate 300 --output run.json
+
+С --workers N апдейты идут через ShardRouter в N процессов-воркеров, как
+в шардированном режиме бота; замеряется пропускная способность.
+
+С --db-burst N замеряется только слой БД: N одновременных апдейтов, каждый
+get_user + update_conversation + update_lead_stage; --db-legacy - то же на
+старом слое с соединением на каждый вызов. Так получены цифры до и после
+перевода Database на пул соединений:
+
+    python loadtest.py --db-burst 200 --db-legacy --output before.json
+    python loadtest.py --db-burst 200 --output after.json
+
+Результат - JSON: задержки обработчиков (p50/p95/p99), апдейтов в секунду,
+обращений к БД и вызовов Bot API на апдейт, рост памяти. Прогоны разных
+коммитов сравниваются по этим файлам.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from aiohttp import web
+
+# Кнопки и вопросы синтетических пользователей
+CALLBACKS = ('quick_workout', 'nutrition_plan', 'shopping_list', 'workout_done', 'premium_offer', 'ai_chat')
+QUESTIONS = (
+    'Привет! С чего начать?',
+    'Как похудеть к лету?',
+    'Какое питание нужно для набора массы?',
+    'Нужна мотивация, скучно тренироваться',
+    'У меня плато, вес стоит уже месяц',
+    'Сколько раз в неделю тренироваться новичку?',
+    'Хочу результат быстрее',
+    'Что съесть перед тренировкой?'
+)
+
+
+def percentiles(values):
+    """p50/p95/p99 и максимум в миллисекундах"""
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+    return {
+        'count': len(values),
+        'p50': pick(0.50),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'max': round(values[-1] * 1000, 2)
+    }
+
+
+def rss_mb():
+    """Текущий RSS процесса (Linux), None если недоступно"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class StubOpenRouter:
+    """Локальная замена OpenRouter: chat/completions с задержкой и ошибками.
+
+    Доля slow_rate ответов задерживается в slow_factor раз - хвост задержек
+    для проверки хеджирования.
+    """
+
+    def __init__(self, latency, error_rate, seed=0, slow_rate=0.0, slow_factor=10):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.runner = None
+        self.url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/api/v1/chat/completions', self.completions)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f'http://127.0.0.1:{port}/api/v1/chat/completions'
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def completions(self, request):
+        payload = await request.json()
+        self.requests += 1
+        if self.latency:
+            delay = self.latency * self.rng.uniform(0.5, 1.5)
+            if self.rng.random() < self.slow_rate:
+                delay *= self.slow_factor
+            await asyncio.sleep(delay)
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({'error': 'stub failure'}, status=503)
+
+        question = payload['messages'][-1]['content']
+        words = f"Отличный вопрос: {question} Начни с трех тренировок в неделю и следи за белком.".split()
+        if not payload.get('stream'):
+            return web.json_response({'choices': [{'message': {'content': ' '.join(words)}}]})
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for i, word in enumerate(words):
+            chunk = {'choices': [{'delta': {'content': word if i == 0 else ' ' + word}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+class SyntheticUsers:
+    """Генератор апдейтов: сначала /start, дальше кнопки, чат и команды по весам"""
+
+    def __init__(self, users, mix, seed=0):
+        self.users = users
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.rng = random.Random(seed)
+        self.started = set()
+        self.update_id = 0
+
+    def next(self):
+        """(вид апдейта, dict апдейта в формате Bot API)"""
+        user_id = 100000 + self.rng.randrange(self.users)
+        if user_id not in self.started:
+            self.started.add(user_id)
+            return 'start', self.message(user_id, '/start')
+
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == 'callback':
+            data = self.rng.choice(CALLBACKS)
+            return f'callback:{data}', self.callback(user_id, data)
+        if kind == 'chat':
+            return 'chat', self.message(user_id, self.rng.choice(QUESTIONS))
+        command = self.rng.choice(('/progress', '/workout', '/nutrition'))
+        return f'command:{command[1:]}', self.message(user_id, command)
+
+    def user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    def message(self, user_id, text):
+        self.update_id += 1
+        message = {
+            'message_id': self.update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self.user(user_id),
+            'text': text
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return {'update_id': self.update_id, 'message': message}
+
+    def callback(self, user_id, data):
+        self.update_id += 1
+        return {
+            'update_id': self.update_id,
+            'callback_query': {
+                'id': str(self.update_id),
+                'from': self.user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': self.update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': 'screen'
+                }
+            }
+        }
+
+
+class WorkerSetup:
+    """Подготовка процесса-воркера шардированного прогона: заглушки вместо сети"""
+
+    def __init__(self, ai_urls, tg_latency):
+        self.ai_urls = ai_urls
+        self.tg_latency = tg_latency
+
+    def __call__(self, index):
+        from ai_engine import ai_engine
+        from fakes import FakeBot
+
+        for provider, url in zip(ai_engine.router.providers, self.ai_urls):
+            provider.url = url
+        return FakeBot(latency=self.tg_latency)
+
+
+async def run_sharded(args):
+    """Прогон через ShardRouter: ingress в этом процессе, обработка в воркерах"""
+    from sharding import ShardRouter
+
+    stubs = (
+        StubOpenRouter(args.ai_latency, args.ai_error_rate, args.seed, args.ai_slow_rate),
+        StubOpenRouter(args.fallback_latency, args.fallback_error_rate, args.seed + 1)
+    )
+    for stub in stubs:
+        await stub.start()
+
+    router = ShardRouter(args.workers, setup=WorkerSetup([stub.url for stub in stubs], args.tg_latency))
+    await router.start()
+
+    users = SyntheticUsers(args.users, {'callback': args.callbacks, 'chat': args.chat, 'command': args.commands}, args.seed)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    next_at = started
+    for _ in range(args.updates):
+        if args.rate:
+            next_at += 1 / args.rate
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await router.dispatch(users.next()[1])
+
+    # Остановка дожидается, пока воркеры обработают все принятое
+    reports = await router.stop(timeout=args.timeout)
+    elapsed = loop.time() - started
+    for stub in stubs:
+        await stub.stop()
+
+    return {
+        'commit': git_commit(),
+        'config': vars(args),
+        'updates': args.updates,
+        'processed': sum(report['updates'] for report in reports),
+        'duration_s': round(elapsed, 3),
+        'updates_per_sec': round(args.updates / elapsed, 1),
+        'workers': reports,
+        'restarts': router.restarts,
+        'ai': {'requests': stubs[0].requests, 'errors': stubs[0].errors, 'fallback_requests': stubs[1].requests}
+    }
+
+
+async def run(args):
+    # Модули бота импортируются после перехода в рабочий каталог прогона:
+    # БД и лог создаются относительно текущего каталога
+    from telegram import Update
+
+    import config
+    from ai_engine import ai_engine
+    from bot import FitFriends_bot
+    from database import db
+    from fakes import FAKE_TOKEN, FakeBot
+
+    # Заглушка на каждого провайдера роутера: основной и резервный
+    stub = StubOpenRouter(args.ai_latency, args.ai_error_rate, args.seed, args.ai_slow_rate)
+    fallback_stub = StubOpenRouter(args.fallback_latency, args.fallback_error_rate, args.seed + 1)
+    stubs = (stub, fallback_stub)
+    for provider, provider_stub in zip(ai_engine.router.providers, stubs):
+        await provider_stub.start()
+        provider.url = provider_stub.url
+
+    fake_bot = FakeBot(latency=args.tg_latency)
+    fitbot = FitFriends_bot(config.BOT_TOKEN or FAKE_TOKEN, bot=fake_bot)
+    application = fitbot.application
+
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+
+    application.add_error_handler(on_error)
+
+    # Замер: время обработчика и полное время от постановки в очередь
+    handler_latency = {}
+    end_to_end = []
+    enqueued = {}
+    kinds = {}
+    done = asyncio.Event()
+    processor = application.update_processor
+    process = processor.do_process_update
+
+    async def timed_process(update, coroutine):
+        async def measured():
+            started = time.perf_counter()
+            try:
+                await coroutine
+            finally:
+                handler_latency.setdefault(kinds.pop(update.update_id), []).append(time.perf_counter() - started)
+
+        await process(update, measured())
+        end_to_end.append(time.perf_counter() - enqueued.pop(update.update_id))
+        if len(end_to_end) == args.updates:
+            done.set()
+
+    processor.do_process_update = timed_process
+
+    await application.initialize()
+    await fitbot.post_init(application)
+    await application.start()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_start = rss_mb()
+    reads, writes = db.reads, db.writes
+    api_calls = len(fake_bot.transport.calls)
+
+    users = SyntheticUsers(args.users, {'callback': args.callbacks, 'chat': args.chat, 'command': args.commands}, args.seed)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    next_at = started
+    for _ in range(args.updates):
+        if args.rate:
+            next_at += 1 / args.rate
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        kind, data = users.next()
+        update = Update.de_json(data, application.bot)
+        kinds[update.update_id] = kind
+        enqueued[update.update_id] = time.perf_counter()
+        await application.update_queue.put(update)
+
+    await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    elapsed = loop.time() - started
+    # Несохраненные мутации write-behind - тоже часть нагрузки на БД
+    await db.flush()
+
+    db_calls = {'reads': db.reads - reads, 'writes': db.writes - writes}
+    api_calls = len(fake_bot.transport.calls) - api_calls
+    memory = {'rss_start_mb': rss_start, 'rss_end_mb': rss_mb()}
+    if memory['rss_start_mb'] is not None and memory['rss_end_mb'] is not None:
+        memory['rss_growth_mb'] = round(memory['rss_end_mb'] - memory['rss_start_mb'], 1)
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')[:5]
+        tracemalloc.stop()
+        memory['traced_growth_mb'] = round(current / 2 ** 20, 2)
+        memory['traced_peak_mb'] = round(peak / 2 ** 20, 2)
+        memory['top_allocations'] = [f"{stat.traceback} {stat.size / 1024:.0f} KiB" for stat in top]
+
+    await application.stop()
+    await application.shutdown()
+    await fitbot.post_shutdown(application)
+    for provider_stub in stubs:
+        await provider_stub.stop()
+
+    all_latency = [value for values in handler_latency.values() for value in values]
+    return {
+        'commit': git_commit(),
+        'config': vars(args),
+        'updates': args.updates,
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'duration_s': round(elapsed, 3),
+        'updates_per_sec': round(args.updates / elapsed, 1),
+        'handler_latency_ms': percentiles(all_latency),
+        'end_to_end_latency_ms': percentiles(end_to_end),
+        'by_kind': {kind: percentiles(values) for kind, values in sorted(handler_latency.items())},
+        'db': dict(db_calls, per_update=round((db_calls['reads'] + db_calls['writes']) / args.updates, 2)),
+        'telegram': {'api_calls': api_calls, 'per_update': round(api_calls / args.updates, 2)},
+        'ai': {
+            'requests': stub.requests,
+            'errors': stub.errors,
+            'fallback_requests': fallback_stub.requests,
+            'fallback_errors': fallback_stub.errors,
+            'coalesced': ai_engine.flights.saved,
+            'breakers': {provider.name: provider.breaker.state for provider in ai_engine.router.providers}
+        },
+        'memory': memory
+    }
+
+
+class LegacyDatabase:
+    """Слой БД до пула соединений: новое sqlite3-соединение на каждый вызов,
+    запросы синхронно в event loop. Нужен только как база сравнения --db-burst."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        conn = sqlite3.connect(db_path)
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, last_name TEXT,
+                subscription_end DATE, conversation_history TEXT);
+            CREATE TABLE IF NOT EXISTS leads (user_id INTEGER PRIMARY KEY, stage TEXT);
+        ''')
+        conn.close()
+
+    async def add_user(self, user_id, username, first_name, last_name):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, subscription_end) '
+                     'VALUES (?, ?, ?, ?, ?)', (user_id, username, first_name, last_name, '2100-01-01'))
+        conn.execute("INSERT OR IGNORE INTO leads (user_id, stage) VALUES (?, 'new')", (user_id,))
+        conn.commit()
+        conn.close()
+
+    async def get_user(self, user_id):
+        conn = sqlite3.connect(self.db_path)
+        user = conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        conn.close()
+        return user
+
+    async def update_conversation(self, user_id, message, response):
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute('SELECT conversation_history FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        history = json.loads(row[0]) if row and row[0] else []
+        history.append({'timestamp': time.time(), 'user_message': message, 'bot_response': response})
+        conn.execute('UPDATE users SET conversation_history = ? WHERE user_id = ?', (json.dumps(history[-50:]), user_id))
+        conn.commit()
+        conn.close()
+
+    async def update_lead_stage(self, user_id, stage):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('UPDATE leads SET stage = ? WHERE user_id = ?', (stage, user_id))
+        conn.commit()
+        conn.close()
+
+    async def flush(self):
+        pass
+
+
+async def run_db_burst(args):
+    """Задержка слоя БД под одновременной нагрузкой: пачка из args.db_burst апдейтов,
+    каждый - get_user + update_conversation + update_lead_stage, время от прихода
+    пачки. С --db-legacy те же вызовы идут через LegacyDatabase."""
+    if args.db_legacy:
+        db = LegacyDatabase('legacy.db')
+    else:
+        from database import db
+
+    user_ids = range(800000, 800000 + args.db_burst)
+    for user_id in user_ids:
+        await db.add_user(user_id, f'user{user_id}', 'Тест', None)
+    await db.flush()
+
+    # Задержка event loop: насколько опаздывает sleep на 1 мс
+    lag = []
+    running = True
+
+    async def watch_loop():
+        loop = asyncio.get_running_loop()
+        while running:
+            started = loop.time()
+            await asyncio.sleep(0.001)
+            lag.append(max(0.0, loop.time() - started - 0.001))
+
+    async def update(user_id, arrived):
+        await db.get_user(user_id)
+        await db.update_conversation(user_id, 'Как тренироваться?', 'Начни с разминки')
+        await db.update_lead_stage(user_id, 'engaged')
+        return time.perf_counter() - arrived
+
+    watcher = asyncio.ensure_future(watch_loop())
+    await asyncio.sleep(0.01)
+    arrived = time.perf_counter()
+    latencies = await asyncio.gather(*(update(user_id, arrived) for user_id in user_ids))
+    flushed = time.perf_counter()
+    await db.flush()
+    flush_ms = round((time.perf_counter() - flushed) * 1000, 2)
+    running = False
+    await watcher
+
+    return {
+        'commit': git_commit(),
+        'mode': 'db_legacy' if args.db_legacy else 'db',
+        'updates': args.db_burst,
+        'latency_ms': percentiles(latencies),
+        'flush_ms': flush_ms,
+        'loop_lag_ms': percentiles(lag)
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон бота на локальных заглушках')
+    parser.add_argument('--users', type=int, default=200, help='число синтетических пользователей')
+    parser.add_argument('--updates', type=int, default=2000, help='всего апдейтов')
+    parser.add_argument('--rate', type=float, default=200, help='апдейтов в секунду (0 - без ограничения)')
+    parser.add_argument('--callbacks', type=float, default=6, help='вес нажатий кнопок')
+    parser.add_argument('--chat', type=float, default=3, help='вес вопросов AI-чату')
+    parser.add_argument('--commands', type=float, default=1, help='вес команд /progress, /workout, /nutrition')
+    parser.add_argument('--ai-latency', type=float, default=0.3, help='средняя задержка заглушки OpenRouter (с)')
+    parser.add_argument('--ai-error-rate', type=float, default=0.05, help='доля ответов 503 от заглушки OpenRouter')
+    parser.add_argument('--ai-slow-rate', type=float, default=0.0, help='доля ответов основного провайдера с задержкой x10')
+    parser.add_argument('--fallback-latency', type=float, default=0.3, help='задержка заглушки резервного провайдера (с)')
+    parser.add_argument('--fallback-error-rate', type=float, default=0.0, help='доля ответов 503 резервного провайдера')
+    parser.add_argument('--tg-latency', type=float, default=0.02, help='задержка вызова Bot API (с)')
+    parser.add_argument('--timeout', type=float, default=300, help='предел ожидания обработки (с)')
+    parser.add_argument('--workers', type=int, default=1, help='процессов-воркеров (больше 1 - шардированный режим)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db-burst', type=int, default=0,
+                        help='только слой БД: столько одновременных апдейтов (без бота и заглушек)')
+    parser.add_argument('--db-legacy', action='store_true',
+                        help='с --db-burst: старый слой БД, соединение на каждый вызов')
+    parser.add_argument('--tracemalloc', action='store_true', help='рост Python-кучи через tracemalloc (замедляет прогон)')
+    parser.add_argument('--workdir', help='каталог для БД и лога (по умолчанию временный)')
+    parser.add_argument('--output', help='файл для JSON-результата (по умолчанию stdout)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    with tempfile.TemporaryDirectory(prefix='fitfriends-loadtest-') as tmp:
+        os.chdir(args.workdir or tmp)
+        if args.db_burst:
+            result = asyncio.run(run_db_burst(args))
+        else:
+            result = asyncio.run(run_sharded(args) if args.workers > 1 else run(args))
+
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import atexit
+import json
+import logging
+import queue
+import re
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+import config
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Что вырезается из логов: токены ботов (в URL Bot API они идут целиком),
+# e-mail и телефоны в международном формате
+REDACTIONS = (
+    (re.compile(r'\d{6,12}:[A-Za-z0-9_-]{30,}'), '<token>'),
+    (re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+'), '<email>'),
+    (re.compile(r'\+\d[\d\s()-]{8,}\d'), '<phone>'),
+)
+_DIGITS = re.compile(r'\d+')
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который никогда не ждет: при полной очереди запись отбрасывается"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Аргументы подставляются сразу (объекты могут измениться до записи),
+        # трейсбек и остальное форматирование - в потоке слушателя
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class PipelineListener(QueueListener):
+    """Поток записи логов: сэмплирование повторов и редактирование секретов.
+
+    Все, что дороже форматирования строки, делается здесь, а не в event loop.
+    Похожие строки (совпадают логгер, уровень и текст с точностью до чисел)
+    ниже WARNING пропускаются не чаще burst раз за window секунд, число
+    подавленных дописывается к следующей пропущенной строке.
+    """
+
+    def __init__(self, log_queue, *handlers, burst=5, window=60, secrets=()):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.burst = burst
+        self.window = window
+        self.secrets = [secret for secret in secrets if secret]
+        self.seen = {}  # ключ строки -> [начало окна, пропущено, подавлено]
+        self.traceback_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        message = record.getMessage()
+        if record.levelno < logging.WARNING and self.burst:
+            key = (record.name, record.levelno, _DIGITS.sub('#', message))
+            now = time.monotonic()
+            state = self.seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                state = self.seen[key] = [now, 0, 0]
+                if suppressed:
+                    message += f" (+{suppressed} похожих подавлено)"
+            if state[1] >= self.burst:
+                state[2] += 1
+                return None
+            state[1] += 1
+            if len(self.seen) > 10000:
+                self.seen.clear()
+
+        record.msg = self.redact(message)
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.redact(self.traceback_formatter.formatException(record.exc_info))
+        return record
+
+    def handle(self, record):
+        record = self.prepare(record)
+        if record is None:
+            return
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def redact(self, message):
+        for secret in self.secrets:
+            message = message.replace(secret, '<secret>')
+        for pattern, replacement in REDACTIONS:
+            message = pattern.sub(replacement, message)
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def setup_logging():
+    """Корневой логгер пишет в очередь, файл и консоль обслуживает отдельный поток"""
+    if config.LOG_ROTATE_WHEN:
+        file_handler = TimedRotatingFileHandler(
+            config.LOG_FILE, when=config.LOG_ROTATE_WHEN,
+            backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    else:
+        file_handler = RotatingFileHandler(
+            config.LOG_FILE, maxBytes=config.LOG_MAX_BYTES,
+            backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+
+    formatter = JsonFormatter() if config.LOG_FORMAT == 'json' else logging.Formatter(LOG_FORMAT)
+    handlers = (file_handler, logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    listener = PipelineListener(
+        log_queue, *handlers,
+        burst=config.LOG_SAMPLE_BURST,
+        window=config.LOG_SAMPLE_WINDOW,
+        secrets=(config.BOT_TOKEN, config.WEBHOOK_SECRET)
+    )
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(config.LOG_LEVEL)
+
+    listener.start()
+    # Дописываем очередь при выходе из процесса
+    atexit.register(listener.stop)
+    return listener
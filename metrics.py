@@ -0,0 +1,278 @@
+import bisect
+import functools
+import html
+import logging
+import time
+
+from aiohttp import web
+from telegram.request import HTTPXRequest
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержек (сек)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Счетчик событий с метками"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}  # кортеж значений меток -> число
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def render(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels_text(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """Гистограмма задержек с метками: счетчики по корзинам, сумма и число наблюдений"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.values = {}  # кортеж значений меток -> [счетчики корзин (+Inf последней), сумма, число]
+
+    def observe(self, value, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels):
+        series = self.values.get(labels)
+        return series[2] if series else 0
+
+    def quantile(self, q, *labels):
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)"""
+        series = self.values.get(labels)
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, series[0]):
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+    def render(self):
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for upper, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield f"{self.name}_bucket{_labels_text(self.labelnames, labels, [('le', upper)])} {cumulative}"
+            yield f"{self.name}_bucket{_labels_text(self.labelnames, labels, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{_labels_text(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels_text(self.labelnames, labels)} {count}"
+
+
+class NullMetric:
+    """Заглушка метрики при выключенном сборе: вызовы ничего не делают"""
+
+    values = {}
+
+    def inc(self, *labels, amount=1):
+        pass
+
+    def observe(self, value, *labels):
+        pass
+
+    def count(self, *labels):
+        return 0
+
+    def total(self):
+        return 0
+
+    def quantile(self, q, *labels):
+        return None
+
+
+class MetricsRegistry:
+    """Метрики процесса. Все обновления идут из event loop, поэтому без блокировок"""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        if not self.enabled:
+            return NullMetric()
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(config.METRICS_ENABLED)
+
+handler_seconds = registry.histogram('bot_handler_seconds', 'Время работы обработчика апдейта', ('handler',))
+handler_errors = registry.counter('bot_handler_errors_total', 'Исключения в обработчиках', ('handler',))
+db_seconds = registry.histogram('bot_db_seconds', 'Обращение к БД с ожиданием пула', ('kind', 'statement'))
+ai_seconds = registry.histogram('bot_ai_request_seconds', 'Запросы к модели', ('mode', 'outcome'))
+ai_responses = registry.counter('bot_ai_responses_total', 'Ответы AI по источнику', ('source',))
+ai_fallbacks = registry.counter('bot_ai_fallbacks_total', 'Резервные ответы по причине', ('reason',))
+ai_provider_seconds = registry.histogram('bot_ai_provider_seconds', 'Попытки запроса к провайдеру', ('provider', 'outcome'))
+ai_hedges = registry.counter('bot_ai_hedged_total', 'Хеджированные запросы по провайдеру-победителю', ('winner',))
+singleflight_saved = registry.counter('bot_singleflight_saved_total', 'Вызовы, склеенные с уже идущими', ('flight',))
+ai_breaker_trips = registry.counter('bot_ai_breaker_trips_total', 'Размыкания предохранителя', ('provider',))
+campaign_messages = registry.counter('bot_campaign_messages_total', 'Сообщения drip-кампаний в очереди отправки', ('campaign',))
+telegram_seconds = registry.histogram('bot_telegram_api_seconds', 'Вызовы Bot API', ('method', 'status'))
+
+
+def instrument_handler(callback):
+    """Обертка обработчика с замером времени; при выключенных метриках - сам обработчик"""
+    if not registry.enabled:
+        return callback
+
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest с замером каждого вызова Bot API"""
+
+    __slots__ = ()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            code, payload = await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+            status = str(code)
+            return code, payload
+        finally:
+            telegram_seconds.observe(time.perf_counter() - started, api_method, status)
+
+
+class MetricsServer:
+    """Эндпоинт /metrics в формате Prometheus на локальном aiohttp-сервере"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"📈 Метрики: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def _top(histogram, limit):
+    """Серии гистограммы по убыванию суммарного времени"""
+    series = sorted(histogram.values.items(), key=lambda item: -item[1][1])
+    return series[:limit]
+
+
+def stats_text(limit=5):
+    """Короткая сводка метрик для команды /stats (HTML)"""
+    if not registry.enabled:
+        return "📊 Метрики выключены (METRICS_ENABLED=0)"
+
+    lines = ["📊 <b>МЕТРИКИ</b>", "", "<b>Обработчики</b> (вызовы, p50/p95 мс):"]
+    for labels, (_, _, count) in _top(handler_seconds, limit):
+        errors = handler_errors.values.get(labels, 0)
+        lines.append(
+            f"• {html.escape(labels[0])}: {count}, "
+            f"{_ms(handler_seconds.quantile(0.5, *labels))}/{_ms(handler_seconds.quantile(0.95, *labels))}"
+            + (f", ошибок {errors}" if errors else '')
+        )
+
+    sources = ', '.join(f"{source} {count}" for (source,), count in sorted(ai_responses.values.items()))
+    lines += ["", f"<b>AI:</b> {sources or 'нет запросов'}"]
+    if ai_fallbacks.values:
+        reasons = ', '.join(f"{html.escape(reason)} {count}" for (reason,), count in sorted(ai_fallbacks.values.items()))
+        lines.append(f"Резервные ответы: {reasons}")
+    saved = singleflight_saved.values.get(('ai',))
+    if saved:
+        lines.append(f"Склеено одинаковых запросов: {saved}")
+    for labels, (_, _, count) in _top(ai_seconds, limit):
+        lines.append(f"• {'/'.join(labels)}: {count}, p95 {_ms(ai_seconds.quantile(0.95, *labels))} мс")
+
+    lines += ["", "<b>БД</b> (по суммарному времени, p95 мс):"]
+    for labels, (_, total, count) in _top(db_seconds, limit):
+        lines.append(f"• {labels[0]} {labels[1]}: {count}, p95 {_ms(db_seconds.quantile(0.95, *labels))}")
+
+    lines += ["", "<b>Bot API</b>:"]
+    for labels, (_, _, count) in _top(telegram_seconds, limit):
+        lines.append(f"• {labels[0]} [{labels[1]}]: {count}, p95 {_ms(telegram_seconds.quantile(0.95, *labels))} мс")
+    if not telegram_seconds.values:
+        lines.append("• нет вызовов")
+
+    return '\n'.join(lines)
@@ -0,0 +1,168 @@
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import config
+
+MEALS = ('breakfast', 'lunch', 'dinner', 'snacks')
+WEEK = 7
+
+
+def nutrition_target(goals, level):
+    """Дневная цель (ккал, белок в г) для цели тренировок и уровня"""
+    base = config.NUTRITION_TARGETS.get(goals, config.NUTRITION_TARGETS['weight_loss'])
+    bonus = config.NUTRITION_LEVEL_BONUS.get(level, config.NUTRITION_LEVEL_BONUS['beginner'])
+    # Округление до 50 ккал и 5 г белка: близкие цели делят одну корзину кэша
+    kcal = round((base['kcal'] + bonus['kcal']) / 50) * 50
+    protein = round((base['protein'] + bonus['protein']) / 5) * 5
+    return kcal, protein
+
+
+class NutritionOptimizer:
+    """Подбор дневного рациона из FOOD_TABLE под цель по калориям и белку.
+
+    Все сочетания (блюдо и размер порции на каждый прием пищи) перебираются
+    один раз при создании: суммы калорий и БЖУ лежат в массиве NumPy, и
+    подбор под цель - это векторная оценка этого массива. Неделя различных
+    планов кэшируется по корзине цели.
+    """
+
+    def __init__(self, foods, portions, tolerance):
+        self.foods = foods
+        self.tolerance = tolerance
+
+        # Варианты каждого приема пищи: номер блюда и множитель порции
+        option_dishes = []
+        option_portions = []
+        for meal in MEALS:
+            options = [(i, portion) for i, food in enumerate(foods) if food['meal'] == meal for portion in portions[meal]]
+            option_dishes.append(np.array([dish for dish, _ in options]))
+            option_portions.append(np.array([portion for _, portion in options], dtype=np.float64))
+
+        # Сетка всех сочетаний вариантов: строка - дневной рацион
+        grid = np.stack(
+            np.meshgrid(*[np.arange(len(dishes)) for dishes in option_dishes], indexing='ij'),
+            axis=-1
+        ).reshape(-1, len(MEALS))
+        self.dishes = np.column_stack([option_dishes[m][grid[:, m]] for m in range(len(MEALS))])
+        self.portions = np.column_stack([option_portions[m][grid[:, m]] for m in range(len(MEALS))])
+
+        # Калории, белки, жиры, углеводы каждого рациона
+        nutrients = np.array([[f['kcal'], f['protein'], f['fat'], f['carbs']] for f in foods], dtype=np.float64)
+        self.totals = np.einsum('nmk,nm->nk', nutrients[self.dishes], self.portions)
+
+        # Корзина цели (ккал, белок) -> неделя планов
+        self.weeks = {}
+
+    def week(self, kcal, protein):
+        """Недельный набор различных планов под цель"""
+        key = (kcal, protein)
+        plans = self.weeks.get(key)
+        if plans is None:
+            plans = self.weeks[key] = tuple(self.describe(i) for i in self.optimize(kcal, protein))
+        return plans
+
+    def optimize(self, kcal, protein, days=WEEK):
+        """Номера лучших рационов под цель, по возможности не повторяющих блюда"""
+        kcal_error = np.abs(self.totals[:, 0] - kcal) / kcal
+        protein_gap = np.maximum(protein - self.totals[:, 1], 0) / protein
+        score = kcal_error + 2 * protein_gap
+        feasible = (kcal_error <= self.tolerance) & (protein_gap <= self.tolerance)
+
+        # Сначала рационы в допуске, затем остальные - на случай недостижимой цели
+        order = np.argsort(np.where(feasible, score, score + 10), kind='stable')
+        candidates = order[:max(int(feasible.sum()), days)]
+        dishes = self.dishes[candidates]
+
+        # Жадный выбор: следующий план - лучший из тех, что отличаются от уже
+        # выбранных в максимальном числе приемов пищи
+        chosen = []
+        min_diff = np.full(len(candidates), len(MEALS))
+        while len(chosen) < days:
+            for threshold in range(len(MEALS) - 1, 0, -1):
+                allowed = np.flatnonzero(min_diff >= threshold)
+                if len(allowed):
+                    break
+            else:
+                break
+            pick = allowed[0]
+            chosen.append(candidates[pick])
+            min_diff = np.minimum(min_diff, (dishes != dishes[pick]).sum(axis=1))
+
+        return chosen
+
+    def describe(self, index):
+        kcal, protein, fat, carbs = (int(value) for value in self.totals[index].round())
+        meals = {}
+        items = []
+        for meal, dish, portion in zip(MEALS, self.dishes[index], self.portions[index]):
+            food = self.foods[dish]
+            portion = float(portion)
+            name = food['name'] if portion == 1 else f"{food['name']} ×{portion:g}"
+            meals[meal] = f"{name} ({food['kcal'] * portion:.0f} ккал)"
+            items.append((int(dish), portion))
+
+        return {
+            'calories': f'{kcal} ккал',
+            'protein': protein,
+            'fat': fat,
+            'carbs': carbs,
+            'meals': meals,
+            'items': items
+        }
+
+    def plan(self, user_id, goals=None, level=None, day=None):
+        """План питания пользователя на день: планы недели чередуются по дням"""
+        plans = self.week(*nutrition_target(goals, level))
+        day = day or date.today()
+        return plans[(day.toordinal() + (user_id or 0)) % len(plans)]
+
+    def week_plans(self, user_id, goals=None, level=None, start=None, days=WEEK):
+        start = start or date.today()
+        return [self.plan(user_id, goals, level, start + timedelta(days=i)) for i in range(days)]
+
+    def batch(self, users, start=None, days=WEEK):
+        """Планы на неделю для множества пользователей: users - тройки (user_id, goals, level)"""
+        return {
+            user_id: self.week_plans(user_id, goals, level, start, days)
+            for user_id, goals, level in users
+        }
+
+    def shopping_list(self, user_id, goals=None, level=None, start=None):
+        """Продукты на неделю: пары (продукт, граммы) по алфавиту"""
+        totals = {}
+        for plan in self.week_plans(user_id, goals, level, start):
+            for dish, portion in plan['items']:
+                for ingredient, grams in self.foods[dish]['ingredients'].items():
+                    totals[ingredient] = totals.get(ingredient, 0) + grams * portion
+        return sorted(totals.items())
+
+
+nutrition_optimizer = NutritionOptimizer(config.FOOD_TABLE, config.MEAL_PORTIONS, config.NUTRITION_TOLERANCE)
+
+
+def benchmark(users=100000):
+    """Подбор под цели и пакетный расчет недели для пользователей"""
+    started = time.perf_counter()
+    optimizer = NutritionOptimizer(config.FOOD_TABLE, config.MEAL_PORTIONS, config.NUTRITION_TOLERANCE)
+    print(f"Сетка {len(optimizer.totals):,} рационов: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    for goals in config.NUTRITION_TARGETS:
+        kcal, protein = nutrition_target(goals, 'intermediate')
+        started = time.perf_counter()
+        plans = optimizer.week(kcal, protein)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{goals}: цель {kcal} ккал / {protein} г белка, {len(plans)} планов за {elapsed:.1f} мс, "
+              f"калории {', '.join(plan['calories'] for plan in plans)}")
+
+    levels = tuple(config.NUTRITION_LEVEL_BONUS)
+    goals = tuple(config.NUTRITION_TARGETS)
+    batch = [(user_id, goals[user_id % len(goals)], levels[user_id % len(levels)]) for user_id in range(users)]
+    started = time.perf_counter()
+    optimizer.batch(batch)
+    print(f"Неделя для {users:,} пользователей: {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == '__main__':
+    benchmark()
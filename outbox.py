@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from collections import deque
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+class RateLimitedSender:
+    """Исходящая очередь массовых рассылок с лимитами Telegram.
+
+    Глобальный лимит держится ниже 30 сообщений/сек, чтобы оставить запас
+    интерактивным ответам, один чат получает не чаще раза в per_chat_interval,
+    а RetryAfter ставит на паузу всю очередь. Ограниченный размер очереди дает
+    обратное давление: send() ждет, пока освободится место. Повтор после
+    RetryAfter места не ждет: задача держит слот отправки, и ожидание при
+    полной очереди остановило бы диспетчер.
+    """
+
+    def __init__(self, rate=None, per_chat_interval=None, max_queue=None, max_in_flight=None, max_retries=3):
+        self.interval = 1 / (rate or config.OUTBOX_RATE)
+        self.per_chat_interval = per_chat_interval or config.OUTBOX_PER_CHAT_INTERVAL
+        self.max_queue = max_queue or config.OUTBOX_MAX_QUEUE
+        self.max_in_flight = max_in_flight or config.OUTBOX_MAX_IN_FLIGHT
+        self.max_retries = max_retries
+
+        self.bot = None
+        self.queue = None
+        self._dispatcher = None
+        self._in_flight = set()
+        self._retries = deque()  # повторы, не поместившиеся в полную очередь
+        self._next_slot = 0
+        self._paused_until = 0
+        self._chat_next = {}
+
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retried = 0
+
+    async def start(self, bot):
+        self.bot = bot
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self, timeout=10):
+        """Досылает очередь (не дольше timeout) и останавливает диспетчер"""
+        if self._dispatcher is None:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Очередь рассылки не успела отправиться, осталось: {self.queue.qsize()}")
+        self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, *self._in_flight, return_exceptions=True)
+        self._dispatcher = None
+
+    async def send(self, chat_id, text, **kwargs):
+        """Ставит сообщение в очередь; ждет, если очередь заполнена"""
+        await self.queue.put((chat_id, text, kwargs, 0))
+
+    async def join(self):
+        await self.queue.join()
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        while True:
+            item = self._retries.popleft() if self._retries else await self.queue.get()
+            chat_id = item[0]
+
+            now = loop.time()
+            start_at = max(self._next_slot, self._paused_until, self._chat_next.get(chat_id, 0))
+            if start_at > now:
+                await asyncio.sleep(start_at - now)
+                now = loop.time()
+
+            self._next_slot = max(now, self._next_slot) + self.interval
+            self._chat_next[chat_id] = now + self.per_chat_interval
+            if len(self._chat_next) > 10000:
+                self._chat_next = {key: at for key, at in self._chat_next.items() if at > now}
+
+            await semaphore.acquire()
+            task = asyncio.create_task(self._deliver(item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def _deliver(self, item):
+        chat_id, text, kwargs, attempt = item
+        deferred = False
+        try:
+            await self.bot.send_message(chat_id, text, **kwargs)
+            self.sent += 1
+        except RetryAfter as e:
+            # Флуд-контроль Telegram: пауза для всей очереди и повтор
+            loop = asyncio.get_running_loop()
+            self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+            if attempt < self.max_retries:
+                self.retried += 1
+                deferred = self._retry((chat_id, text, kwargs, attempt + 1))
+            else:
+                self.failed += 1
+        except Forbidden:
+            # Пользователь заблокировал бота
+            self.blocked += 1
+        except TelegramError as e:
+            self.failed += 1
+            logger.warning(f"Не удалось отправить сообщение {chat_id}: {e}")
+        finally:
+            # Отложенный повтор остается незавершенной задачей очереди до своей отправки
+            if not deferred:
+                self.queue.task_done()
+
+    def _retry(self, item):
+        """Ставит повтор без ожидания; True, если он ушел в _retries мимо очереди"""
+        try:
+            self.queue.put_nowait(item)
+            return False
+        except asyncio.QueueFull:
+            # Очередь не пуста - диспетчер не ждет в get() и заберет повтор следующим
+            self._retries.append(item)
+            return True
+
+    def stats(self):
+        return {
+            'queued': (self.queue.qsize() if self.queue else 0) + len(self._retries),
+            'sent': self.sent,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'retried': self.retried
+        }
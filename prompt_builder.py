@@ -0,0 +1,220 @@
+import json
+import re
+import time
+from datetime import datetime, timedelta
+
+import config
+from database import db
+from intents import intent_matcher
+
+SYSTEM_PROMPT = (
+    "Ты - профессиональный AI-фитнес тренер и нутрициолог. Ты помогаешь с:\n"
+    "- Персональными тренировками\n"
+    "- Планами питания\n"
+    "- Мотивацией и поддержкой\n"
+    "- Ответами на спортивные вопросы\n\n"
+    "Будь дружелюбным, профессиональным и мотивирующим. Давай конкретные советы."
+)
+
+GOAL_NAMES = {
+    'weight_loss': 'похудение',
+    'muscle_gain': 'набор мышечной массы',
+    'maintenance': 'поддержание формы'
+}
+LEVEL_NAMES = {
+    'beginner': 'новичок',
+    'intermediate': 'средний',
+    'advanced': 'продвинутый'
+}
+
+# Оценка без токенизатора: кириллица у моделей семейства Mistral - около 3 символов на токен
+CHARS_PER_TOKEN = 3
+
+_SENTENCE = re.compile(r'(?<=[.!?…])\s+|\n+')
+_FIRST_PERSON = re.compile(r'\b(я|мне|меня|мой|моя|мои)\b', re.IGNORECASE)
+_DIGIT = re.compile(r'\d')
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def clip(text, tokens):
+    """Обрезает текст до примерно tokens токенов по границе слова"""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(' ', 1)[0] + '…'
+
+
+def key_sentence(text, limit=160):
+    """Самое содержательное предложение реплики: числа, факты о себе, темы интентов"""
+    best = None
+    best_score = -1
+    for sentence in _SENTENCE.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        score = (
+            2 * bool(_DIGIT.search(sentence))
+            + 2 * bool(_FIRST_PERSON.search(sentence))
+            + len(intent_matcher.match(sentence))
+        )
+        # При равенстве - более раннее предложение
+        if score > best_score:
+            best, best_score = sentence, score
+    if best is None:
+        return ''
+    return best if len(best) <= limit else best[:limit].rsplit(' ', 1)[0] + '…'
+
+
+class PromptBuilder:
+    """Сообщения для модели в пределах бюджета токенов.
+
+    Последние реплики диалога идут дословно (user/assistant), более старые
+    сворачиваются в краткое содержание в системном сообщении. Краткое
+    содержание извлекающее: из каждой уходящей реплики берется одно ключевое
+    предложение. Оно хранится в users и обновляется инкрементально - каждая
+    реплика сворачивается один раз, когда выходит из окна последних.
+    Сводка и реплики личные: промпт с ними не годится для общего кэша
+    (см. is_shareable).
+    """
+
+    def __init__(self, budget=config.AI_PROMPT_TOKEN_BUDGET, recent_turns=config.AI_PROMPT_RECENT_TURNS,
+                 turn_tokens=config.AI_PROMPT_TURN_TOKENS, summary_tokens=config.AI_SUMMARY_TOKENS):
+        self.budget = budget
+        self.recent_turns = recent_turns
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = summary_tokens
+
+    def system_prompt(self, summary=None, goal=None, level=None):
+        parts = [SYSTEM_PROMPT]
+        if goal in GOAL_NAMES or level in LEVEL_NAMES:
+            profile = []
+            if goal in GOAL_NAMES:
+                profile.append(f"цель - {GOAL_NAMES[goal]}")
+            if level in LEVEL_NAMES:
+                profile.append(f"уровень - {LEVEL_NAMES[level]}")
+            parts.append(f"Пользователь: {', '.join(profile)}.")
+        if summary:
+            parts.append(f"Ранее в диалоге:\n{summary}")
+        return '\n\n'.join(parts)
+
+    def is_shareable(self, history, summary=None):
+        """Промпт без реплик и сводки конкретного пользователя: ответ на него можно
+        отдавать другим (кэш, склейка), личные данные из диалога в него не попадают"""
+        return not summary and not (self.recent_turns and history)
+
+    def build_messages(self, user_message, history, summary=None, goal=None, level=None):
+        """system + последние реплики, сколько влезает в бюджет, + вопрос пользователя"""
+        system = self.system_prompt(summary, goal, level)
+        user_message = clip(user_message, self.budget // 2)
+        budget = self.budget - estimate_tokens(system) - estimate_tokens(user_message)
+
+        # Реплики добавляются от новых к старым, пока хватает бюджета
+        turns = []
+        for turn in reversed(history[-self.recent_turns:] if self.recent_turns else []):
+            question = clip(turn['user_message'] or '', self.turn_tokens)
+            answer = clip(turn['bot_response'] or '', self.turn_tokens)
+            cost = estimate_tokens(question) + estimate_tokens(answer)
+            if cost > budget:
+                break
+            budget -= cost
+            turns.append({"role": "assistant", "content": answer})
+            turns.append({"role": "user", "content": question})
+        turns.reverse()
+
+        return [
+            {"role": "system", "content": system},
+            *turns,
+            {"role": "user", "content": user_message}
+        ]
+
+    def fold(self, history, summary=None, until=None):
+        """Сворачивает реплики старше окна последних, еще не вошедшие в краткое содержание.
+
+        Возвращает (summary, until) или None, если сворачивать нечего.
+        """
+        older = history[:-self.recent_turns] if self.recent_turns else history
+        new_turns = [turn for turn in older if until is None or turn['timestamp'] > until]
+        if not new_turns:
+            return None
+
+        lines = summary.split('\n') if summary else []
+        for turn in new_turns:
+            question = key_sentence(turn['user_message'] or '')
+            answer = key_sentence(turn['bot_response'] or '')
+            if question:
+                lines.append(f"Пользователь: {question}")
+            if answer:
+                lines.append(f"Тренер: {answer}")
+
+        # Сверх лимита уходят сначала старые ответы тренера: сказанное
+        # пользователем о себе (цели, травмы, ограничения) нужнее дольше
+        while lines and estimate_tokens('\n'.join(lines)) > self.summary_tokens:
+            for i, line in enumerate(lines):
+                if line.startswith('Тренер:'):
+                    del lines[i]
+                    break
+            else:
+                del lines[0]
+
+        return '\n'.join(lines), new_turns[-1]['timestamp']
+
+    async def update_summary(self, user_id, history, profile):
+        """Досворачивает ушедшие из окна реплики и сохраняет; возвращает краткое содержание"""
+        if profile is None:
+            return None
+        folded = self.fold(history, profile.conversation_summary, profile.summary_until)
+        if folded is None:
+            return profile.conversation_summary
+        summary, until = folded
+        await db.update_conversation_summary(user_id, summary, until)
+        return summary
+
+
+prompt_builder = PromptBuilder()
+
+
+def benchmark(turns=10, runs=10000):
+    """Размер промпта для длинного диалога: история целиком против бюджета со сводкой"""
+    start = datetime.now() - timedelta(hours=1)
+    history = [
+        {
+            'timestamp': (start + timedelta(minutes=i)).isoformat(),
+            'user_message': f"Мне 3{i} лет, вешу 8{i} кг. Как мне лучше тренироваться, если болит колено?",
+            'bot_response': ("Начните с разминки 10 минут. " * 20) + f"Ваша норма - {1800 + i * 10} ккал."
+        }
+        for i in range(turns)
+    ]
+    question = "Что есть после тренировки?"
+
+    naive = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *({"role": role, "content": turn[key]} for turn in history
+          for role, key in (("user", 'user_message'), ("assistant", 'bot_response'))),
+        {"role": "user", "content": question}
+    ]
+    summary, _ = prompt_builder.fold(history)
+    messages = prompt_builder.build_messages(question, history, summary, 'weight_loss', 'beginner')
+
+    def size(items):
+        return sum(estimate_tokens(item['content']) for item in items), len(json.dumps(items, ensure_ascii=False))
+
+    print(f"Вся история: ~{size(naive)[0]} токенов, {size(naive)[1]} символов JSON")
+    print(f"С бюджетом:  ~{size(messages)[0]} токенов, {size(messages)[1]} символов JSON, "
+          f"сводка {len(summary.splitlines())} строк")
+
+    started = time.perf_counter()
+    for _ in range(runs):
+        prompt_builder.build_messages(question, history, summary, 'weight_loss', 'beginner')
+    print(f"build_messages: {(time.perf_counter() - started) / runs * 1e6:.1f} мкс")
+
+    started = time.perf_counter()
+    for _ in range(runs // 10):
+        prompt_builder.fold(history[-prompt_builder.recent_turns - 1:], summary, history[-prompt_builder.recent_turns - 2]['timestamp'])
+    print(f"fold одной реплики: {(time.perf_counter() - started) / (runs // 10) * 1e6:.1f} мкс")
+
+
+if __name__ == '__main__':
+    benchmark()
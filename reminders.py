@@ -0,0 +1,54 @@
+import html
+import logging
+from datetime import datetime
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+REMINDER_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💪 Получить тренировку", callback_data='quick_workout')]
+])
+
+class ReminderDispatcher:
+    """Напоминания о тренировке в выбранное пользователем время (users.preferred_time).
+
+    stop() прерывает рассылку между отправками: иначе остановка бота ждала бы,
+    пока весь часовой интервал встанет в очередь со скоростью отправки.
+    """
+
+    def __init__(self, db, sender):
+        self.db = db
+        self.sender = sender
+        self.stopping = False
+
+    def stop(self):
+        self.stopping = True
+
+    @staticmethod
+    def time_bucket(now):
+        """Часовое окно [HH:00, HH+1:00) в формате preferred_time"""
+        return f"{now.hour:02d}:00", f"{now.hour + 1:02d}:00"
+
+    async def dispatch(self, now=None):
+        """Ставит в очередь отправки напоминания всем, у кого время в текущем часе"""
+        now = now or datetime.now()
+        time_from, time_to = self.time_bucket(now)
+
+        queued = 0
+        async for batch in self.db.iter_reminder_recipients(time_from, time_to, now.date()):
+            if self.stopping:
+                break
+            for user_id, first_name in batch:
+                if self.stopping:
+                    break
+                text = (
+                    f"🔔 <b>{html.escape(first_name or 'Привет')}, время тренировки!</b>\n\n"
+                    "Твоя персональная AI-тренировка уже готова 💪"
+                )
+                await self.sender.send(user_id, text, reply_markup=REMINDER_KEYBOARD, parse_mode='HTML')
+                queued += 1
+
+        logger.info(f"🔔 Напоминаний в очереди ({time_from}-{time_to}): {queued}"
+                    + (", прервано остановкой" if self.stopping else ''))
+        return queued
@@ -0,0 +1,358 @@
+import html
+import time
+from collections import namedtuple, OrderedDict
+from datetime import date
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from ai_engine import ai_engine
+from nutrition import nutrition_optimizer
+
+# Экран бота: HTML-текст и клавиатура
+Screen = namedtuple('Screen', ['text', 'reply_markup'])
+
+
+def keyboard(*rows):
+    """Клавиатура из строк кнопок вида (текст, callback_data)"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(text, callback_data=data) for text, data in row]
+        for row in rows
+    ])
+
+
+# Клавиатуры создаются один раз: объекты Telegram неизменяемы и безопасно разделяются
+MAIN_KEYBOARD = keyboard(
+    [("🎯 Пройти опрос (2 мин)", 'start_survey')],
+    [("💪 Быстрая тренировка", 'quick_workout')],
+    [("🥗 План питания", 'nutrition_plan')],
+    [("💬 Задать вопрос AI", 'ai_chat')],
+    [("🔗 Подключить Яндекс Алису", 'connect_alice')],
+    [("💎 Premium доступ", 'premium_offer')]
+)
+FOLLOWUP_KEYBOARD = keyboard(
+    [("🎯 Начать опрос", 'start_survey')],
+    [("💬 Спросить AI", 'ai_chat')]
+)
+WORKOUT_KEYBOARD = keyboard(
+    [("✅ Выполнил тренировку", 'workout_done')],
+    [("🔄 Новая тренировка", 'quick_workout')],
+    [("🥗 План питания", 'nutrition_plan')]
+)
+WORKOUT_DONE_KEYBOARD = keyboard(
+    [("🔄 Новая тренировка", 'quick_workout')],
+    [("🥗 План питания", 'nutrition_plan')]
+)
+NUTRITION_KEYBOARD = keyboard(
+    [("💪 Тренировка", 'quick_workout')],
+    [("🛒 Список покупок", 'shopping_list')],
+    [("💬 Задать вопрос", 'ai_chat')]
+)
+SALE_KEYBOARD = keyboard(
+    [("💎 Узнать о Premium", 'premium_offer')],
+    [("💪 Продолжить тренировки", 'quick_workout')]
+)
+ALICE_KEYBOARD = keyboard(
+    [("💪 Получить тренировку", 'quick_workout')],
+    [("🏠 В главное меню", 'main_menu')]
+)
+PREMIUM_KEYBOARD = keyboard(
+    [("💳 Оформить Premium", 'buy_premium')],
+    [("💪 Продолжить trial", 'quick_workout')],
+    [("💬 Консультация", 'ai_chat')]
+)
+SHOPPING_LIST_KEYBOARD = keyboard(
+    [("🥗 План питания", 'nutrition_plan')],
+    [("💪 Тренировка", 'quick_workout')]
+)
+QUICK_WORKOUT_KEYBOARD = keyboard([("💪 Получить тренировку", 'quick_workout')])
+QUICK_NUTRITION_KEYBOARD = keyboard([("🥗 Получить питание", 'nutrition_plan')])
+
+# Шаблоны экранов с параметрами (поля str.format)
+WELCOME_TEMPLATE = """
+🤖 <b>Добро пожаловать в AI-FITNESS PRO, {first_name}!</b>
+
+Я твой персональный <b>AI-тренер, нутрициолог и мотивационный друг</b>!
+
+🎯 <b>Что я умею:</b>
+• 🏋️ Создавать персональные тренировки
+• 🥗 Составлять планы питания
+• 📊 Анализировать прогресс
+• 💬 Отвечать на любые вопросы
+• 🔔 Напоминать о тренировках
+• 🎯 Мотивировать 24/7
+
+🚀 <b>Начни с бесплатного 7-дневного trial!</b>
+
+Выбери действие:
+"""
+
+WORKOUT_TEMPLATE = """
+🏋️ <b>ТВОЯ AI-ТРЕНИРОВКА</b>
+
+📅 <b>Дата:</b> {date}
+🎯 <b>Тип:</b> {type}
+⏱ <b>Время:</b> {duration}
+🔥 <b>Калории:</b> {calories}
+
+<b>Упражнения:</b>
+
+{exercises}
+
+💡 <b>Совет:</b> Начинай с разминки 5-10 минут!"""
+
+SHOPPING_LIST_TEMPLATE = """
+🛒 <b>СПИСОК ПОКУПОК НА НЕДЕЛЮ</b>
+
+{items}
+
+💡 <b>Совет:</b> Готовь крупы и мясо сразу на 2-3 дня!
+"""
+
+NUTRITION_TEMPLATE = """
+🥗 <b>ТВОЙ AI-ПЛАН ПИТАНИЯ</b>
+
+🔥 <b>Калории:</b> {calories}
+🥩 <b>Б/Ж/У:</b> {protein}/{fat}/{carbs} г
+
+<b>План на день:</b>
+• 🍳 <b>Завтрак:</b> {breakfast}
+• 🍲 <b>Обед:</b> {lunch}
+• 🍽️ <b>Ужин:</b> {dinner}
+• 🍎 <b>Перекусы:</b> {snacks}
+
+💡 <b>Совет:</b> Пей 2-3 литра воды в день!
+"""
+
+PROGRESS_TEMPLATE = """
+📊 <b>ТВОЙ ПРОГРЕСС</b>
+
+💪 <b>Тренировок выполнено:</b> {workout_count}
+🎯 <b>Цель:</b> {goals}
+⚡ <b>Уровень:</b> {fitness_level}
+
+🚀 <b>Совет:</b> Продолжай в том же духе!
+"""
+
+# Статические экраны отрисовываются один раз при импорте
+FOLLOWUP_SCREEN = Screen("""
+💡 <b>Не знаешь с чего начать?</b>
+
+Рекомендую:
+1. Пройти быстрый опрос (2 минуты)
+2. Получить персональную программу
+3. Начать первую тренировку!
+
+Или просто спроси меня о чем угодно! 💬
+""", FOLLOWUP_KEYBOARD)
+
+SURVEY_SCREEN = Screen("""
+🎯 <b>ДАВАЙ ПОЗНАКОМИМСЯ!</b>
+
+Ответь на 3 быстрых вопроса для персонализации:
+
+1. <b>Какая твоя основная цель?</b>
+   • Похудение
+   • Набор мышечной массы
+   • Поддержание формы
+   • Улучшение здоровья
+
+Напиши свой ответ:
+""", None)
+
+AI_CHAT_SCREEN = Screen("""
+💬 <b>AI-ЧАТ АКТИВИРОВАН</b>
+
+Задай мне любой вопрос о:
+• 💪 Тренировках и упражнениях
+• 🥗 Питании и диетах
+• 🏃 Беге и кардио
+• 🧘 Йоге и растяжке
+• 🎯 Поставке целей
+• 🔥 Мотивации
+
+Я профессиональный AI-тренер и помогу с любым вопросом!
+
+<b>Пиши свой вопрос:</b>
+""", None)
+
+ALICE_SCREEN = Screen("""
+🎧 <b>ПОДКЛЮЧИ ЯНДЕКС АЛИСУ!</b>
+
+Теперь я доступен в твоей Яндекс Станции! 🏠
+
+<b>Что умею через Алису:</b>
+• 🎯 Голосовые тренировки
+• 🥗 Советы по питанию
+• 📊 Прогресс голосом
+• 💪 Мотивация в реальном времени
+
+<b>Как подключить:</b>
+1. Скажи: <i>"Алиса, запусти навык Фитнес Тренер"</i>
+2. Или найди в каталоге: <i>"AI Fitness Coach"</i>
+
+<b>Буду твоим голосовым тренером дома! 🏋️</b>
+""", ALICE_KEYBOARD)
+
+PREMIUM_SCREEN = Screen("""
+💎 <b>PREMIUM ДОСТУП</b>
+
+<b>Что получишь:</b>
+• 🏋️ <b>Ежедневные AI-тренировки</b> - уникальные каждый день
+• 🥗 <b>Персональное питание</b> - с учетом твоих предпочтений
+• 📊 <b>AI-анализ прогресса</b> - фото, замеры, метрики
+• 💬 <b>Приоритетная поддержка</b> - ответы за 5 минут
+• 🎯 <b>Корректировка программ</b> - на основе твоих результатов
+• 🔔 <b>Умные напоминания</b> - в лучшее для тебя время
+
+<b>Всего 290/мес</b> - меньше 10р в день!
+
+🚀 <b>Гарантия результата или верну деньги!</b>
+""", PREMIUM_KEYBOARD)
+
+WORKOUT_DONE_SCREEN = Screen(
+    "✅ <b>Тренировка засчитана!</b>\n\nТак держать - каждая тренировка приближает к цели! 🔥",
+    WORKOUT_DONE_KEYBOARD
+)
+QUICK_WORKOUT_SCREEN = Screen("Нажми для персональной AI-тренировки!", QUICK_WORKOUT_KEYBOARD)
+QUICK_NUTRITION_SCREEN = Screen("Нажми для AI-плана питания!", QUICK_NUTRITION_KEYBOARD)
+NOT_REGISTERED_TEXT = "Сначала запусти /start для регистрации"
+
+
+class ScreenCache:
+    """LRU отрисованных экранов по ключу входных данных.
+
+    Экраны с датой (тренировка, питание) действительны до конца дня,
+    поэтому при смене даты кэш сбрасывается целиком. Ключ включает user_id:
+    план дня персональный (упражнения выбираются по user_id и дате, рацион
+    чередуется со сдвигом на user_id), одинаковые goal и level его не задают.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.screens = OrderedDict()
+        self.day = date.today()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        today = date.today()
+        if today != self.day:
+            self.screens.clear()
+            self.day = today
+
+        screen = self.screens.get(key)
+        if screen is not None:
+            self.screens.move_to_end(key)
+            self.hits += 1
+            return screen
+
+        self.misses += 1
+        screen = self.screens[key] = build()
+        if len(self.screens) > self.maxsize:
+            self.screens.popitem(last=False)
+        return screen
+
+
+screen_cache = ScreenCache()
+
+
+def welcome_screen(first_name):
+    return Screen(WELCOME_TEMPLATE.format(first_name=html.escape(first_name or '')), MAIN_KEYBOARD)
+
+
+def workout_screen(user_id, goals, fitness_level):
+    """Экран тренировки дня пользователя"""
+    def build():
+        workout = ai_engine.generate_workout_plan({
+            'user_id': user_id,
+            'fitness_level': fitness_level,
+            'goals': goals
+        })
+        exercises = '\n'.join(f"{i}. {exercise}" for i, exercise in enumerate(workout['exercises'], 1))
+        text = WORKOUT_TEMPLATE.format(
+            date=workout['date'],
+            type=workout['type'],
+            duration=workout['duration'],
+            calories=workout['calories'],
+            exercises=exercises
+        )
+        return Screen(text, WORKOUT_KEYBOARD)
+
+    return screen_cache.get(('workout', user_id, goals, fitness_level), build)
+
+
+def nutrition_screen(user_id, goals, fitness_level):
+    """Экран плана питания пользователя на сегодня"""
+    def build():
+        nutrition = ai_engine.generate_nutrition_plan({
+            'user_id': user_id,
+            'fitness_level': fitness_level,
+            'goals': goals
+        })
+        text = NUTRITION_TEMPLATE.format(
+            calories=nutrition['calories'],
+            protein=nutrition['protein'],
+            fat=nutrition['fat'],
+            carbs=nutrition['carbs'],
+            **nutrition['meals']
+        )
+        return Screen(text, NUTRITION_KEYBOARD)
+
+    return screen_cache.get(('nutrition', user_id, goals, fitness_level), build)
+
+
+def shopping_list_screen(user_id, goals, fitness_level):
+    """Экран списка покупок на неделю вперед"""
+    def build():
+        items = '\n'.join(
+            f"• {html.escape(name)} - {format_weight(grams)}"
+            for name, grams in nutrition_optimizer.shopping_list(user_id, goals, fitness_level)
+        )
+        return Screen(SHOPPING_LIST_TEMPLATE.format(items=items), SHOPPING_LIST_KEYBOARD)
+
+    return screen_cache.get(('shopping_list', user_id, goals, fitness_level), build)
+
+
+def format_weight(grams):
+    if grams >= 1000:
+        return f"{grams / 1000:.1f} кг"
+    # Мелкие количества округляем до 10 г
+    return f"{round(grams, -1):.0f} г"
+
+
+def progress_text(profile):
+    return PROGRESS_TEMPLATE.format(
+        workout_count=profile.workout_count or 0,
+        goals=profile.goals or 'Не указана',
+        fitness_level=profile.fitness_level or 'Начинающий'
+    )
+
+
+def benchmark(renders=20000):
+    """Экранов в секунду: сборка как раньше (f-строки и новые кнопки) и через кэш"""
+    goals = ['weight_loss', 'muscle_gain']
+
+    started = time.perf_counter()
+    for i in range(renders):
+        workout = ai_engine.generate_workout_plan({'user_id': i % 100, 'fitness_level': 'beginner', 'goals': goals[i % 2]})
+        text = f"<b>Дата:</b> {workout['date']}\n<b>Тип:</b> {workout['type']}\n"
+        for n, exercise in enumerate(workout['exercises'], 1):
+            text += f"\n{n}. {exercise}"
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Выполнил тренировку", callback_data='workout_done')],
+            [InlineKeyboardButton("🔄 Новая тренировка", callback_data='quick_workout')],
+            [InlineKeyboardButton("🥗 План питания", callback_data='nutrition_plan')]
+        ])
+    uncached = renders / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for i in range(renders):
+        workout_screen(i % 100, goals[i % 2], 'beginner')
+    cached = renders / (time.perf_counter() - started)
+
+    print(f"Без кэша: {uncached:,.0f} экранов/сек")
+    print(f"ScreenCache: {cached:,.0f} экранов/сек")
+
+
+if __name__ == '__main__':
+    benchmark()
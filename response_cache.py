@@ -0,0 +1,99 @@
+import re
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+class ResponseCache:
+    """Кэш AI-ответов: LRU в памяти процесса + таблица в SQLite, переживающая рестарт"""
+
+    def __init__(self, db, max_size=None, ttl=None, db_ttl=None, db_max_rows=None):
+        self.db = db
+        self.max_size = max_size or config.AI_CACHE_SIZE
+        self.ttl = ttl or config.AI_CACHE_TTL
+        self.db_ttl = db_ttl or config.AI_CACHE_DB_TTL
+        self.db_max_rows = db_max_rows or config.AI_CACHE_DB_MAX_ROWS
+
+        self.memory = OrderedDict()  # key -> (expires_at, response)
+        self.puts = 0
+
+        # Счетчики попаданий
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text):
+        """Нормализует вопрос: регистр, ё, пунктуация, лишние пробелы"""
+        text = text.lower().replace('ё', 'е')
+        text = _PUNCTUATION.sub(' ', text)
+        return _SPACES.sub(' ', text).strip()
+
+    def make_key(self, question, goal, level):
+        # v2: ответы, закэшированные до проверки is_shareable, могли быть личными - их ключи не совпадут
+        raw = f"v2|{goal or ''}|{level or ''}|{self.normalize(question)}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    async def get(self, key):
+        now = time.time()
+
+        item = self.memory.get(key)
+        if item:
+            expires_at, response = item
+            if expires_at > now:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return response
+            del self.memory[key]
+
+        row = await self.db.get_cached_response(key, now)
+        if row:
+            response, expires_at = row
+            self._remember(key, response, min(expires_at, now + self.ttl))
+            self.db_hits += 1
+            return response
+
+        self.misses += 1
+        return None
+
+    async def put(self, key, response):
+        now = time.time()
+        self._remember(key, response, now + self.ttl)
+        await self.db.put_cached_response(key, response, now + self.db_ttl)
+
+        # Периодически чистим просроченное и ограничиваем размер таблицы
+        self.puts += 1
+        if self.puts % 100 == 0:
+            await self.db.prune_response_cache(now, self.db_max_rows)
+
+    def _remember(self, key, response, expires_at):
+        self.memory[key] = (expires_at, response)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            'size': len(self.memory),
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'hit_rate': hits / total if total else 0.0
+        }
+
+    def status_text(self):
+        """Попадания кэша для /stats (HTML)"""
+        stats = self.stats()
+        return (
+            f"<b>Кэш AI</b>: {stats['size']}/{self.max_size} в памяти, попаданий {stats['hit_rate']:.0%} "
+            f"(память {stats['memory_hits']}, БД {stats['db_hits']}, промахов {stats['misses']})"
+        )
@@ -0,0 +1,104 @@
+import time
+import asyncio
+import logging
+
+from telegram.ext import JobQueue
+
+logger = logging.getLogger(__name__)
+
+
+class GracefulJobQueue(JobQueue):
+    """JobQueue, который перед ожиданием работающих задач просит их завершиться.
+
+    Application.stop() ждет все запущенные задачи (stop(wait=True)), а
+    post_stop вызывается только после этого. Долгие задачи (рассылки с
+    обратным давлением очереди) без сигнала держали бы остановку бота часами.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.on_stop = []
+
+    async def stop(self, wait=True):
+        for callback in self.on_stop:
+            callback()
+        await super().stop(wait)
+
+class DelayedMessageQueue:
+    """Отложенные сообщения, переживающие рестарт.
+
+    Очередь хранится в SQLite (scheduled_messages, индекс по due_at работает как
+    куча с минимумом), повтор для того же пользователя и типа игнорируется.
+    Один воркер спит до ближайшего due_at и разбирает созревшие записи пачками.
+
+    Доставка - не больше одного раза: записи пачки удаляются, как только их
+    обработчики отработали, а обработчик лишь ставит сообщение в очередь
+    RateLimitedSender в памяти. Рестарт до отправки, ошибка обработчика или
+    отказ Telegram теряют сообщение, повтора не будет.
+    """
+
+    def __init__(self, db, batch_size=100, max_sleep=60):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_sleep = max_sleep
+        self.handlers = {}  # тип сообщения -> async handler(user_id, payload)
+
+        self._worker = None
+        self._wakeup = asyncio.Event()
+        self._next_due = None
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    async def schedule(self, user_id, kind, delay, payload=None):
+        """Отправит сообщение kind через delay секунд; дубликаты игнорируются"""
+        due_at = time.time() + delay
+        added = await self.db.schedule_message(user_id, kind, due_at, payload)
+        if added and (self._next_due is None or due_at < self._next_due):
+            self._wakeup.set()
+        return added
+
+    async def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.process_due() == self.batch_size:
+                    continue
+                self._next_due = await self.db.get_next_due_at()
+            except Exception as e:
+                logger.error(f"Ошибка очереди отложенных сообщений: {e}")
+                self._next_due = None
+
+            timeout = self.max_sleep
+            if self._next_due is not None:
+                timeout = min(timeout, max(0, self._next_due - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process_due(self, now=None):
+        """Обрабатывает одну пачку созревших сообщений, возвращает ее размер"""
+        batch = await self.db.get_due_messages(now or time.time(), self.batch_size)
+        for message_id, user_id, kind, payload in batch:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                logger.warning(f"Нет обработчика для отложенного сообщения {kind}")
+                continue
+            try:
+                await handler(user_id, payload)
+            except Exception as e:
+                logger.warning(f"Не удалось обработать {kind} для {user_id}: {e}")
+
+        if batch:
+            await self.db.delete_scheduled_messages([message_id for message_id, *_ in batch])
+        return len(batch)
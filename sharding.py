@@ -0,0 +1,268 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+import config
+# Ingress импортирует БД до запуска воркеров: миграции выполняются один раз,
+# воркеры открывают уже готовую схему
+from database import db
+from log_pipeline import setup_logging
+from webhook import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов ingress передает воркеру одним сообщением IPC
+BATCH_SIZE = 100
+
+
+def shard_key(data):
+    """user_id апдейта в формате Bot API, а если пользователя нет - id чата.
+
+    Тот же ключ, что у PerUserUpdateProcessor, но без разбора в объекты PTB.
+    """
+    for field, value in data.items():
+        if field == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user:
+            return user.get('id')
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat.get('id')
+    return None
+
+
+class ShardRouter:
+    """Ingress-сторона шардирования: раздает апдейты процессам-воркерам по user_id.
+
+    У каждого воркера своя очередь multiprocessing. Апдейты одного
+    пользователя всегда попадают к одному воркеру и в порядке поступления,
+    а внутри воркера порядок держит PerUserUpdateProcessor. В очередь пишет
+    один фидер на воркера, пачками и из отдельного потока - блокирующий put
+    не останавливает event loop. Упавший воркер перезапускается.
+    """
+
+    def __init__(self, workers, queue_size=config.SHARD_QUEUE_SIZE, setup=None):
+        self.count = workers
+        self.queue_size = queue_size
+        # setup(index) вызывается в воркере до создания бота и может вернуть
+        # подменный Bot (нагрузочные прогоны); должен сериализоваться pickle
+        self.setup = setup
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [self.context.Queue(max(1, queue_size // BATCH_SIZE)) for _ in range(workers)]
+        self.ready = [self.context.Event() for _ in range(workers)]
+        self.reports = self.context.Queue()
+        self.processes = [None] * workers
+        self.pending = []
+        self.feeders = []
+        self.executor = ThreadPoolExecutor(max_workers=workers + 1, thread_name_prefix='shard-feeder')
+        self.round_robin = itertools.count()
+        self.monitor = None
+        self.stopping = False
+
+        self.dispatched = [0] * workers
+        self.restarts = 0
+
+    async def start(self, timeout=60):
+        loop = asyncio.get_running_loop()
+        self.pending = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.count)]
+        for index in range(self.count):
+            self.spawn(index)
+        for index in range(self.count):
+            if not await loop.run_in_executor(self.executor, self.ready[index].wait, timeout):
+                raise RuntimeError(f"Воркер {index} не запустился за {timeout} с")
+
+        self.feeders = [asyncio.create_task(self.feed(index)) for index in range(self.count)]
+        self.monitor = asyncio.create_task(self.watch())
+        logger.info(f"🧩 Воркеров запущено: {self.count}")
+
+    def spawn(self, index):
+        self.ready[index].clear()
+        process = self.context.Process(
+            target=run_worker,
+            args=(index, self.count, self.queues[index], self.ready[index], self.reports, self.setup),
+            name=f'fitfriends-worker-{index}'
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def dispatch(self, data):
+        """Ставит апдейт (dict Bot API) в очередь его воркера; ждет, если очередь полна"""
+        key = shard_key(data)
+        if key is None:
+            index = next(self.round_robin) % self.count
+        else:
+            index = key % self.count
+        await self.pending[index].put(data)
+
+    async def feed(self, index):
+        loop = asyncio.get_running_loop()
+        pending = self.pending[index]
+        while True:
+            batch = []
+            item = await pending.get()
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= BATCH_SIZE or pending.empty():
+                    break
+                item = pending.get_nowait()
+
+            if batch:
+                await loop.run_in_executor(self.executor, self.queues[index].put, batch)
+                self.dispatched[index] += len(batch)
+            if item is None:
+                # Остановка: воркер доработает все, что было в очереди до нее
+                await loop.run_in_executor(self.executor, self.queues[index].put, None)
+                return
+
+    async def watch(self, interval=1.0):
+        while not self.stopping:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self.processes):
+                if not self.stopping and not process.is_alive():
+                    # Апдейты, которые воркер взял из очереди, но не обработал, потеряны
+                    logger.error(f"💥 Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+                    self.restarts += 1
+                    self.spawn(index)
+
+    async def stop(self, timeout=30):
+        """Дорабатывает принятые апдейты и останавливает воркеров; возвращает их отчеты"""
+        loop = asyncio.get_running_loop()
+        self.stopping = True
+        if self.monitor is not None:
+            self.monitor.cancel()
+        for pending in self.pending:
+            await pending.put(None)
+        await asyncio.gather(*self.feeders)
+
+        for index, process in enumerate(self.processes):
+            await loop.run_in_executor(self.executor, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"Воркер {index} не остановился за {timeout} с")
+                process.terminate()
+
+        reports = []
+        for _ in range(self.count):
+            try:
+                reports.append(await loop.run_in_executor(self.executor, self.reports.get, True, 1))
+            except queue.Empty:
+                break
+        self.executor.shutdown(wait=False)
+        return sorted(reports, key=lambda report: report['worker'])
+
+
+def configure_worker(index, count):
+    """Настройки процесса-воркера: доля общих лимитов и свои файлы"""
+    config.WORKER_PROCESSES = count
+    # Ротация одного файла из нескольких процессов небезопасна: у воркера свой лог
+    root, ext = os.path.splitext(config.LOG_FILE)
+    config.LOG_FILE = f"{root}.worker{index}{ext}"
+    # Лимит Telegram общий на бота: каждый воркер рассылает со своей долей скорости
+    config.OUTBOX_RATE = config.OUTBOX_RATE / count
+    if config.METRICS_PORT:
+        config.METRICS_PORT += index
+    db.set_shard(index, count)
+
+
+def next_batch(updates, poll=1.0):
+    """Следующая пачка апдейтов; None - остановка или ingress-процесс завершился"""
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            return updates.get(timeout=poll)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                return None
+
+
+def run_worker(index, count, updates, ready, reports, setup=None):
+    """Точка входа процесса-воркера"""
+    # Остановку присылает ingress через очередь: Ctrl+C или SIGTERM всей группе
+    # процессов (systemd, docker stop) не обрывает обработку - воркер дорабатывает
+    # очередь и сбрасывает write-behind, когда ingress закроет вход
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, signal.SIG_IGN)
+    configure_worker(index, count)
+    setup_logging()
+    bot = setup(index) if setup is not None else None
+
+    # bot импортирует этот модуль, поэтому FitFriends_bot - только в воркере
+    from bot import FitFriends_bot
+
+    fitbot = FitFriends_bot(config.BOT_TOKEN, bot=bot)
+
+    async def receive():
+        return await asyncio.get_running_loop().run_in_executor(None, next_batch, updates)
+
+    processed = asyncio.run(fitbot.run_worker(receive, ready.set))
+    reports.put({'worker': index, 'pid': os.getpid(), 'updates': processed, 'db_reads': db.reads, 'db_writes': db.writes})
+
+
+async def poll_updates(bot, dispatch, timeout=30):
+    """getUpdates в ingress: апдейты уходят воркерам как dict, без обработчиков"""
+    offset = None
+    await bot.delete_webhook()
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=Update.ALL_TYPES)
+            except TelegramError as e:
+                logger.warning(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await dispatch(update.to_dict())
+                offset = update.update_id + 1
+    finally:
+        if offset is not None:
+            # Подтверждаем переданные воркерам апдейты, чтобы после рестарта они не пришли снова
+            await bot.get_updates(offset=offset, timeout=0)
+
+
+async def run_ingress(stop_event=None, workers=None):
+    """Шардированный режим: этот процесс только принимает апдейты и раздает их воркерам"""
+    router = ShardRouter(workers or config.WORKER_PROCESSES)
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    await router.start()
+    bot = Bot(config.BOT_TOKEN)
+    await bot.initialize()
+    try:
+        if config.BOT_MODE == 'webhook':
+            server = WebhookServer(
+                None,
+                config.WEBHOOK_HOST,
+                config.WEBHOOK_PORT,
+                config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET,
+                enqueue_timeout=config.WEBHOOK_ENQUEUE_TIMEOUT,
+                enqueue=router.dispatch
+            )
+            if config.WEBHOOK_URL:
+                await bot.set_webhook(config.WEBHOOK_URL, secret_token=config.WEBHOOK_SECRET,
+                                      allowed_updates=Update.ALL_TYPES)
+            await server.start()
+            await stop_event.wait()
+            await server.stop()
+        else:
+            poller = asyncio.create_task(poll_updates(bot, router.dispatch))
+            await stop_event.wait()
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+    finally:
+        logger.info("🛑 Остановка: воркеры дорабатывают принятые апдейты...")
+        for report in await router.stop():
+            logger.info(f"🧩 Воркер {report['worker']}: апдейтов {report['updates']}")
+        await bot.shutdown()
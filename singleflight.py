@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import metrics
+
+
+class Flight:
+    """Вызов в полете: последнее значение, версия и итог для всех ожидающих"""
+
+    def __init__(self):
+        self.task = None
+        self.waiters = 0
+        self.value = None
+        self.version = 0
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def publish(self, value):
+        self.value = value
+        self.version += 1
+        self.notify()
+
+    def notify(self):
+        # Новое событие на каждое изменение: ожидающие берут текущее до ожидания
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """Одновременные вызовы с одинаковым ключом выполняются один раз.
+
+    Вызов идет в отдельной задаче, не привязанной ни к одному ожидающему:
+    отмена одного ожидающего не задевает остальных, а когда уходит
+    последний, вызов отменяется. Ошибку вызова получают все ожидающие.
+    Завершенный вызов убирается сразу - это не кэш, а склейка дублей в полете.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.flights = {}
+        self.calls = 0
+        self.saved = 0
+
+    async def do(self, key, func):
+        """Результат func() - один вызов на все одновременные do с тем же ключом"""
+        async def single():
+            yield await func()
+
+        result = None
+        async for result in self.stream(key, single):
+            pass
+        return result
+
+    async def stream(self, key, func):
+        """Значения асинхронного генератора func() - общего для одновременных вызовов.
+
+        Каждое значение заменяет предыдущее (например, весь накопленный текст),
+        поэтому медленный ожидающий пропускает промежуточные, но не последнее.
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = Flight()
+            flight.task = asyncio.ensure_future(self._run(key, flight, func))
+            self.calls += 1
+        else:
+            self.saved += 1
+            metrics.singleflight_saved.inc(self.name)
+
+        flight.waiters += 1
+        seen = 0
+        try:
+            while True:
+                changed = flight.changed
+                if flight.version > seen:
+                    seen = flight.version
+                    yield flight.value
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await changed.wait()
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.done:
+                # Результат больше никому не нужен
+                flight.task.cancel()
+                self._forget(key, flight)
+
+    async def _run(self, key, flight, func):
+        try:
+            async for value in func():
+                flight.publish(value)
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.notify()
+            self._forget(key, flight)
+
+    def _forget(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+
+def benchmark(waiters=1000, latency=0.3):
+    """Всплеск одинаковых запросов: число вызовов и время до ответа всем"""
+    async def scenario():
+        flights = SingleFlight('benchmark')
+        upstream = 0
+
+        async def request():
+            nonlocal upstream
+            upstream += 1
+            await asyncio.sleep(latency)
+            return 'ответ'
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(flights.do('вопрос', request) for _ in range(waiters)))
+        elapsed = time.perf_counter() - started
+        assert results == ['ответ'] * waiters
+        print(f"{waiters} одинаковых запросов: {upstream} вызов(ов), сэкономлено {flights.saved}, "
+              f"{elapsed * 1000:.0f} мс на всех")
+
+        # Отмена части ожидающих не отменяет вызов для остальных
+        tasks = [asyncio.ensure_future(flights.do('вопрос', request)) for _ in range(10)]
+        await asyncio.sleep(latency / 3)
+        for task in tasks[:5]:
+            task.cancel()
+        done = await asyncio.gather(*tasks, return_exceptions=True)
+        print(f"Отменено 5 из 10: {sum(isinstance(item, asyncio.CancelledError) for item in done)} отмен, "
+              f"{done.count('ответ')} ответов, вызовов всего {upstream}")
+
+    asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database.db создает fitness_pro.db в текущем каталоге при импорте - тесты пишут во временный
+_workdir = tempfile.TemporaryDirectory(prefix='fitfriends-tests-')
+os.chdir(_workdir.name)
+
+
+@pytest.fixture
+def far_timezone():
+    """Пояс, в котором местная дата сейчас отличается от даты UTC"""
+    saved = os.environ.get('TZ')
+    os.environ['TZ'] = 'Etc/GMT+12' if datetime.utcnow().hour < 12 else 'Etc/GMT-12'
+    time.tzset()
+    assert datetime.now().date() != datetime.utcnow().date()
+    yield
+    if saved is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = saved
+    time.tzset()
@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from ai_engine import AIFitnessEngine
+
+
+def make_engine(replies):
+    """Движок, у которого модель отвечает по очереди из replies и запоминает промпты"""
+    engine = AIFitnessEngine()
+    engine.prompts = []
+
+    async def request_ai(messages):
+        engine.prompts.append(messages)
+        await asyncio.sleep(0.01)
+        return replies.pop(0)
+
+    engine.request_ai = request_ai
+    return engine
+
+
+def turn(text, minutes_ago):
+    timestamp = (datetime.utcnow() - timedelta(minutes=minutes_ago)).isoformat()
+    return {'timestamp': timestamp, 'user_message': text, 'bot_response': 'ок'}
+
+
+def test_personal_answer_is_not_served_from_cache_to_another_user():
+    engine = make_engine(['Ответ для А с учетом диабета', 'Общий ответ'])
+
+    async def scenario():
+        personal = await engine.generate_ai_response(
+            'Как похудеть?', [turn('У меня диабет', 1)], 'weight_loss', 'beginner', summary='Пользователь: у меня диабет'
+        )
+        shared = await engine.generate_ai_response('как похудеть', [], 'weight_loss', 'beginner')
+        return personal, shared
+
+    personal, shared = asyncio.run(scenario())
+    assert personal == 'Ответ для А с учетом диабета'
+    assert 'диабет' in engine.prompts[0][0]['content']
+    assert shared == 'Общий ответ'
+    assert 'диабет' not in str(engine.prompts[1])
+
+
+def test_dialog_continuation_is_neither_cached_nor_read_from_cache():
+    engine = make_engine(['Общий ответ про присед', 'Ответ с историей', 'Ответ с историей 2'])
+
+    async def scenario():
+        await engine.generate_ai_response('Как правильно приседать?', [], 'maintenance', 'advanced')
+        with_history = await engine.generate_ai_response(
+            'как правильно приседать', [turn('Болит колено', 2)], 'maintenance', 'advanced'
+        )
+        again = await engine.generate_ai_response(
+            'как правильно приседать', [turn('Болит спина', 2)], 'maintenance', 'advanced'
+        )
+        shared = await engine.generate_ai_response('Как правильно приседать', [], 'maintenance', 'advanced')
+        return with_history, again, shared
+
+    with_history, again, shared = asyncio.run(scenario())
+    assert (with_history, again) == ('Ответ с историей', 'Ответ с историей 2')
+    assert shared == 'Общий ответ про присед'
+    assert len(engine.prompts) == 3
+
+
+def test_standalone_question_after_earlier_dialog_hits_cache():
+    engine = make_engine(['Ответ про белок', 'Ответ про сон'])
+    history = [turn(f'Вопрос {i}', 60 * 24 - i) for i in range(10)]
+
+    async def scenario():
+        first = await engine.generate_ai_response('Сколько белка в день?', history, 'muscle_gain', 'beginner',
+                                                  summary='Пользователь: вешу 80 кг')
+        sleep = await engine.generate_ai_response('Сколько нужно спать?', history + [turn('Сколько белка в день?', 30)],
+                                                  'muscle_gain', 'beginner', summary='Пользователь: вешу 80 кг')
+        second = await engine.generate_ai_response('сколько белка в день', history + [turn('Сколько нужно спать?', 20)],
+                                                   'muscle_gain', 'beginner', summary='Пользователь: вешу 80 кг')
+        return first, sleep, second
+
+    first, sleep, second = asyncio.run(scenario())
+    assert (first, sleep, second) == ('Ответ про белок', 'Ответ про сон', 'Ответ про белок')
+    assert len(engine.prompts) == 2
+    # Самостоятельный вопрос уходит модели без чужих и своих реплик
+    assert [message['role'] for message in engine.prompts[0]] == ['system', 'user']
+    assert '80 кг' not in engine.prompts[0][0]['content']
+
+
+def test_concurrent_requests_with_different_context_are_not_coalesced():
+    engine = make_engine(['Ответ А', 'Ответ Б', 'Общий ответ'])
+
+    async def scenario():
+        return await asyncio.gather(
+            engine.generate_ai_response('Что съесть?', [turn('Я веган', 1)], 'muscle_gain', 'beginner'),
+            engine.generate_ai_response('что съесть', [turn('Я ем мясо', 1)], 'muscle_gain', 'beginner',
+                                        summary='Пользователь: аллергия'),
+            engine.generate_ai_response('Что съесть', [], 'muscle_gain', 'beginner'),
+            engine.generate_ai_response('что съесть?', [turn('Привет', 60)], 'muscle_gain', 'beginner')
+        )
+
+    answers = asyncio.run(scenario())
+    assert answers == ['Ответ А', 'Ответ Б', 'Общий ответ', 'Общий ответ']
+    assert len(engine.prompts) == 3
+
+
+def test_cache_hit_rate_is_reported_in_stats():
+    engine = make_engine(['Ответ про растяжку'])
+
+    async def scenario():
+        for _ in range(4):
+            await engine.generate_ai_response('Нужна ли растяжка после бега?', [], 'maintenance', 'beginner')
+
+    asyncio.run(scenario())
+    assert engine.cache.stats()['hit_rate'] == 0.75
+    assert 'попаданий 75% (память 3, БД 0, промахов 1)' in engine.cache.status_text()
+
+
+class BrokenStream:
+    """Ответ с принятыми заголовками, поток которого обрывается после первых слов"""
+
+    def __init__(self):
+        self.content = self.lines()
+
+    async def lines(self):
+        yield 'data: {"choices": [{"delta": {"content": "Начни с разминки"}}]}\n'.encode()
+        raise ConnectionResetError('stream reset')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def test_broken_stream_is_recorded_once_and_not_saved(monkeypatch):
+    import config
+    from ai_engine import CircuitBreaker, ModelRouter, Provider
+
+    monkeypatch.setattr(config, 'AI_STREAMING', True)
+    engine = AIFitnessEngine()
+    provider = Provider('primary', 'http://stub', 'model', 'key', CircuitBreaker(window=10, min_requests=1, cooldown=60))
+    engine.router = ModelRouter([provider])
+
+    async def start():
+        pass
+
+    async def connect(provider, messages):
+        return BrokenStream()
+
+    engine.start = start
+    engine.connect = connect
+
+    async def scenario():
+        texts = [text async for text in engine.stream_ai_response('Как начать бегать?', [])]
+        cached = await engine.cache.get(engine.cache.make_key('Как начать бегать?', None, None))
+        return texts, cached
+
+    texts, cached = asyncio.run(scenario())
+    # Последний текст - резервный ответ: оборванный не сохранится в диалог и не кэшируется
+    assert texts[-1] == engine.get_fallback_response('Как начать бегать?', None)
+    assert cached is None
+    assert list(provider.breaker.results) == [(False, provider.breaker.results[0][1])]
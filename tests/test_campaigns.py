@@ -0,0 +1,134 @@
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from campaigns import CampaignEngine
+from database import Database
+from fakes import FakeBot
+from outbox import RateLimitedSender
+
+NOW = datetime(2026, 3, 10, 12, 0)
+MESSAGES = {'day1': 'Как первые впечатления?', 'day3': 'Расширенная программа?', 'day7': 'Trial заканчивается!'}
+
+
+def add_trial_users(path, count, registered_hours_ago=36, first_id=1):
+    registered = NOW.astimezone(timezone.utc) - timedelta(hours=registered_hours_ago)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (user_id, subscription_type, subscription_end, registration_date) VALUES (?, 'trial', ?, ?)",
+        ((user_id, (NOW.date() + timedelta(days=5)).isoformat(), registered.strftime('%Y-%m-%d %H:%M:%S'))
+         for user_id in range(first_id, first_id + count))
+    )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'campaigns.db'))
+    yield database
+    database.close()
+
+
+def test_cohort_is_sent_once_across_restarts(db):
+    add_trial_users(db.db_path, 120)
+    # Вне когорты day1: зарегистрировались сегодня и неделю назад
+    add_trial_users(db.db_path, 10, registered_hours_ago=5, first_id=1000)
+    add_trial_users(db.db_path, 10, registered_hours_ago=24 * 7, first_id=2000)
+
+    async def scenario():
+        bot = FakeBot()
+        sender = RateLimitedSender(rate=10000, per_chat_interval=0.001)
+        await sender.start(bot)
+        first = await CampaignEngine(db, sender, MESSAGES, batch_size=50).run(NOW)
+        # Новый экземпляр - как после рестарта процесса
+        second = await CampaignEngine(db, sender, MESSAGES, batch_size=50).run(NOW)
+        night = await CampaignEngine(db, sender, MESSAGES).run(NOW.replace(hour=3))
+        await sender.stop()
+        return bot, first, second, night
+
+    bot, first, second, night = asyncio.run(scenario())
+    assert first == {'day1': 120, 'day3': 0, 'day7': 0}
+    assert second == {'day1': 0, 'day3': 0, 'day7': 0}
+    assert night == {}
+    chats = sorted(int(params['chat_id']) for params in bot.transport.sent())
+    assert chats == list(range(1, 121))
+
+
+def test_stop_interrupts_pass_and_returns_unsent_claims(db):
+    add_trial_users(db.db_path, 300)
+
+    async def scenario():
+        bot = FakeBot()
+        sender = RateLimitedSender(rate=200, per_chat_interval=0.001, max_queue=10)
+        await sender.start(bot)
+        engine = CampaignEngine(db, sender, MESSAGES, batch_size=100)
+        task = asyncio.ensure_future(engine.run(NOW))
+        await asyncio.sleep(0.2)
+        started = time.perf_counter()
+        engine.stop()
+        interrupted = await task
+        stop_seconds = time.perf_counter() - started
+        await sender.stop()
+
+        sender = RateLimitedSender(rate=10000, per_chat_interval=0.001)
+        await sender.start(bot)
+        resumed = await CampaignEngine(db, sender, MESSAGES, batch_size=100).run(NOW)
+        await sender.stop()
+        return interrupted, stop_seconds, resumed
+
+    interrupted, stop_seconds, resumed = asyncio.run(scenario())
+    assert stop_seconds < 0.5
+    assert 0 < interrupted['day1'] < 300
+    # Забранные, но не поставленные в очередь пользователи достаются следующему проходу
+    assert interrupted['day1'] + resumed['day1'] == 300
+
+
+def test_application_stop_does_not_wait_for_whole_cohort():
+    from bot import FitFriends_bot
+    from database import db as shared_db
+
+    add_trial_users(shared_db.db_path, 3000, first_id=500000)
+
+    async def scenario():
+        fitbot = FitFriends_bot('123456:TEST', bot=FakeBot())
+        fitbot.campaigns.hours = (0, 24)
+        real_run = fitbot.campaigns.run
+        fitbot.campaigns.run = lambda: real_run(NOW)
+        application = fitbot.application
+        await application.initialize()
+        await fitbot.outbox.start(application.bot)
+        await application.start()
+        application.job_queue.run_once(fitbot.send_campaigns, 0)
+        await asyncio.sleep(0.5)
+        assert fitbot.campaigns.running
+
+        started = time.perf_counter()
+        await asyncio.wait_for(application.stop(), 10)
+        stop_seconds = time.perf_counter() - started
+        await fitbot.outbox.stop(timeout=0.1)
+        await application.shutdown()
+        return stop_seconds, fitbot.campaigns.running
+
+    stop_seconds, running = asyncio.run(scenario())
+    assert stop_seconds < 2
+    assert not running
+
+
+def test_cohort_window_and_campaign_log_use_utc(db, far_timezone):
+    today = datetime.utcnow().date()
+    start, end = CampaignEngine.window('subscription_end', 0, datetime.now())
+    assert (start, end) == (today.isoformat(), (today + timedelta(days=1)).isoformat())
+
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("INSERT INTO users (user_id, subscription_type, subscription_end) VALUES (1, 'trial', ?)",
+                 (today.isoformat(),))
+    conn.commit()
+    claimed, _ = asyncio.run(db.claim_campaign_batch('day7', 'subscription_end', (start, -2 ** 63), end))
+    sent_at, = conn.execute("SELECT sent_at FROM campaign_log WHERE campaign = 'day7'").fetchone()
+    conn.close()
+    assert claimed == [1]
+    assert abs(datetime.strptime(sent_at, '%Y-%m-%d %H:%M:%S') - datetime.utcnow()) < timedelta(minutes=1)
@@ -0,0 +1,29 @@
+import pytest
+
+from intents import intent_matcher
+
+
+@pytest.mark.parametrize('text, group, phrase', [
+    ('Привет!', 'fallback', 'привет'),
+    ('приветик', 'fallback', 'привет'),
+    ('Помоги с питанием', 'fallback', 'питание'),
+    ('нужен план питания', 'fallback', 'питание'),
+    ('не хватает мотивации', 'fallback', 'мотивация'),
+    ('Как похудеть к лету?', 'fallback', 'как похудеть'),
+    ('как похудею без диет', 'fallback', 'как похудеть'),
+    ('Что-то скучновато стало', 'sale', 'скучно'),
+    ('у меня плато', 'sale', 'плато'),
+    ('Хочу результаты быстрее', 'sale', 'хочу результат'),
+    ('Ничего не получается', 'sale', 'не получается'),
+])
+def test_phrase_matches_inflected_and_derived_words(text, group, phrase):
+    assert phrase in intent_matcher.match(text).get(group, [])
+
+
+@pytest.mark.parametrize('text', [
+    'Оплатил платеж картой',
+    'Хочу, а результата нет',
+    'Сколько белка в твороге?',
+])
+def test_unrelated_words_do_not_match(text):
+    assert intent_matcher.match(text) == {}
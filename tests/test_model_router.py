@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from ai_engine import CircuitBreaker, ModelRouter, Provider, ProviderError
+
+
+def make_router(min_requests=3, hedge_delay=0.05):
+    providers = [
+        Provider(name, 'http://stub', 'model', 'key', CircuitBreaker(window=10, min_requests=min_requests, cooldown=60))
+        for name in ('primary', 'fallback')
+    ]
+    return ModelRouter(providers, hedge_delay=hedge_delay, hedge_min_delay=hedge_delay)
+
+
+def test_hanging_providers_trip_their_breakers():
+    router = make_router()
+
+    async def hang(provider):
+        await asyncio.sleep(5)
+
+    async def scenario():
+        durations = []
+        for _ in range(6):
+            started = time.perf_counter()
+            try:
+                await router.race(hang, timeout=0.2)
+            except ProviderError as e:
+                durations.append((e.outcome, time.perf_counter() - started))
+            # Отмененные по сроку попытки записывают результат при следующем проходе цикла
+            await asyncio.sleep(0)
+        return durations
+
+    durations = asyncio.run(scenario())
+    assert [outcome for outcome, _ in durations[:3]] == ['timeout'] * 3
+    # После трех зависаний оба предохранителя разомкнуты - ответ без ожидания срока
+    assert [outcome for outcome, _ in durations[3:]] == ['circuit_open'] * 3
+    assert all(elapsed < 0.05 for _, elapsed in durations[3:])
+    for provider in router.providers:
+        assert provider.breaker.state == 'open'
+        assert provider.breaker.errors() == 3
+
+
+def test_lost_hedge_is_not_a_failure():
+    router = make_router(min_requests=1)
+
+    async def primary_slow(provider):
+        await asyncio.sleep(1 if provider.name == 'primary' else 0.01)
+        return provider.name
+
+    async def scenario():
+        result = await router.race(primary_slow, timeout=2)
+        await asyncio.sleep(0)
+        return result
+
+    provider, result = asyncio.run(scenario())
+    assert result == 'fallback'
+    primary, fallback = router.providers
+    assert primary.breaker.state == 'closed' and not primary.breaker.results
+    assert list(fallback.breaker.results)[0][0] is True
+
+
+def test_caller_cancellation_is_not_a_failure():
+    router = make_router(min_requests=1)
+
+    async def hang(provider):
+        await asyncio.sleep(5)
+
+    async def scenario():
+        task = asyncio.ensure_future(router.race(hang, timeout=2))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    for provider in router.providers:
+        assert provider.breaker.state == 'closed' and not provider.breaker.results
@@ -0,0 +1,39 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from outbox import RateLimitedSender
+
+
+class FloodedBot:
+    """Bot, который первые flood вызовов отвечает 429"""
+
+    def __init__(self, flood):
+        self.flood = flood
+        self.calls = 0
+        self.delivered = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        flooded = self.calls <= self.flood
+        await asyncio.sleep(0.01)
+        if flooded:
+            raise RetryAfter(0.05)
+        self.delivered.append(chat_id)
+
+
+def test_retry_after_with_full_queue_does_not_deadlock():
+    bot = FloodedBot(flood=6)
+    sender = RateLimitedSender(rate=1000, per_chat_interval=0.001, max_queue=5, max_in_flight=3)
+
+    async def scenario():
+        await sender.start(bot)
+        # Очередь полна, пока все отправки в работе получают 429
+        for chat_id in range(20):
+            await asyncio.wait_for(sender.send(chat_id, 'текст'), 5)
+        await asyncio.wait_for(sender.join(), 5)
+        await sender.stop()
+
+    asyncio.run(scenario())
+    assert sorted(bot.delivered) == list(range(20))
+    assert sender.stats() == {'queued': 0, 'sent': 20, 'failed': 0, 'blocked': 0, 'retried': 6}
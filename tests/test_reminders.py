@@ -0,0 +1,63 @@
+import asyncio
+import sqlite3
+import time
+from datetime import datetime
+
+from database import Database
+from fakes import FakeBot
+from outbox import RateLimitedSender
+from reminders import ReminderDispatcher
+
+NOW = datetime(2026, 3, 10, 18, 0)
+
+
+def add_users(path, count):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (user_id, first_name, preferred_time, subscription_type, subscription_end) "
+        "VALUES (?, 'Аня', '18:30', 'trial', '2026-03-15')",
+        ((user_id,) for user_id in range(1, count + 1))
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_dispatch_queues_whole_hour_bucket(tmp_path):
+    db = Database(str(tmp_path / 'reminders.db'))
+    add_users(db.db_path, 250)
+
+    async def scenario():
+        bot = FakeBot()
+        sender = RateLimitedSender(rate=10000, per_chat_interval=0.001)
+        await sender.start(bot)
+        queued = await ReminderDispatcher(db, sender).dispatch(NOW)
+        await sender.stop()
+        return queued, bot
+
+    queued, bot = asyncio.run(scenario())
+    db.close()
+    assert queued == 250
+    assert len(bot.transport.sent()) == 250
+
+
+def test_stop_interrupts_dispatch_blocked_on_outbox(tmp_path):
+    db = Database(str(tmp_path / 'reminders.db'))
+    add_users(db.db_path, 2000)
+
+    async def scenario():
+        sender = RateLimitedSender(rate=50, per_chat_interval=0.001, max_queue=10)
+        await sender.start(FakeBot())
+        dispatcher = ReminderDispatcher(db, sender)
+        task = asyncio.ensure_future(dispatcher.dispatch(NOW))
+        await asyncio.sleep(0.3)
+        started = time.perf_counter()
+        dispatcher.stop()
+        queued = await asyncio.wait_for(task, 5)
+        stop_seconds = time.perf_counter() - started
+        await sender.stop(timeout=0.1)
+        return queued, stop_seconds
+
+    queued, stop_seconds = asyncio.run(scenario())
+    db.close()
+    assert 0 < queued < 2000
+    assert stop_seconds < 0.5
@@ -0,0 +1,37 @@
+import asyncio
+import os
+import signal
+import sqlite3
+
+from database import db
+from loadtest import SyntheticUsers, WorkerSetup
+from sharding import ShardRouter
+
+
+def test_sigterm_to_all_processes_drains_workers():
+    users = SyntheticUsers(0, {})
+    user_ids = range(800000, 800200)
+
+    async def scenario():
+        router = ShardRouter(2, setup=WorkerSetup([], 0.005))
+        await router.start()
+        for user_id in user_ids:
+            await router.dispatch(users.message(user_id, '/start'))
+        # Как systemd или docker stop: SIGTERM всем процессам, остановку ведет ingress
+        for process in router.processes:
+            os.kill(process.pid, signal.SIGTERM)
+        await asyncio.sleep(0.5)
+        alive = [process.is_alive() for process in router.processes]
+        reports = await router.stop()
+        return alive, reports, router.restarts
+
+    alive, reports, restarts = asyncio.run(scenario())
+    assert alive == [True, True] and restarts == 0
+    assert sum(report['updates'] for report in reports) == len(user_ids)
+
+    # Воркеры записали все регистрации до выхода
+    conn = sqlite3.connect(db.db_path)
+    registered = conn.execute('SELECT COUNT(*) FROM users WHERE user_id BETWEEN ? AND ?',
+                              (user_ids[0], user_ids[-1])).fetchone()[0]
+    conn.close()
+    assert registered == len(user_ids)
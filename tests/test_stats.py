@@ -0,0 +1,89 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+from database import Database
+
+
+def test_all_day_counters_use_utc(tmp_path, far_timezone):
+    db = Database(str(tmp_path / 'stats.db'))
+
+    async def scenario():
+        await db.add_user(1, 'anna', 'Аня', None)
+        await db.update_conversation(1, 'Привет', 'Здравствуй!')
+        await db.record_lead_event(1, 'premium_offer')
+        await db.flush()
+        return await db.get_stats_counters('2000-01-01', '2100-01-01')
+
+    counters = asyncio.run(scenario())
+    db.close()
+    today = datetime.utcnow().date().isoformat()
+    for name in ('registrations', 'messages', 'event:premium_offer', 'active_users'):
+        assert counters.get((today, name)) == 1, name
+
+
+def test_migration_moves_local_conversation_times_to_utc(tmp_path, far_timezone):
+    path = str(tmp_path / 'stats.db')
+    Database(path).close()
+
+    # База до перехода на UTC: реплика с местным временем и счетчики по местной дате
+    local = datetime.now().replace(microsecond=123456)
+    conn = sqlite3.connect(path)
+    conn.execute('INSERT INTO conversation_messages (user_id, ts, user_message, bot_response) VALUES (1, ?, ?, ?)',
+                 (local.isoformat(), 'Привет', 'Здравствуй!'))
+    conn.execute('PRAGMA user_version = 5')
+    conn.commit()
+    conn.close()
+
+    Database(path).close()
+    utc = local + (datetime.utcnow() - datetime.now())
+    conn = sqlite3.connect(path)
+    ts, = conn.execute('SELECT ts FROM conversation_messages').fetchone()
+    counters = dict(conn.execute("SELECT day || ' ' || name, value FROM stats_counters WHERE day != ''").fetchall())
+    conn.close()
+    assert abs(datetime.fromisoformat(ts) - utc) < timedelta(seconds=1)
+    assert ts.endswith('.123456')
+    assert counters == {f"{utc.date()} messages": 1, f"{utc.date()} active_users": 1}
+
+
+def test_old_lead_events_are_pruned(tmp_path):
+    db = Database(str(tmp_path / 'stats.db'))
+    conn = sqlite3.connect(db.db_path)
+    conn.executemany('INSERT INTO lead_events (user_id, event, created_at) VALUES (?, ?, ?)',
+                     [(1, 'quick_workout', f'2026-0{month}-01 12:00:00') for month in range(1, 7)])
+    conn.commit()
+
+    asyncio.run(db.prune_lead_events('2026-04-01 00:00:00'))
+    assert conn.execute('SELECT created_at FROM lead_events').fetchall() == [
+        ('2026-04-01 12:00:00',), ('2026-05-01 12:00:00',), ('2026-06-01 12:00:00',)
+    ]
+    asyncio.run(db.prune_lead_events('2027-01-01 00:00:00'))
+    assert conn.execute('SELECT COUNT(*) FROM lead_events').fetchone() == (0,)
+    conn.close()
+    db.close()
+
+
+def test_unknown_callback_data_is_not_recorded():
+    from telegram import Update
+
+    from bot import FitFriends_bot
+    from database import db as shared_db
+    from fakes import FakeBot
+    from loadtest import SyntheticUsers
+
+    users = SyntheticUsers(0, {})
+
+    async def scenario():
+        fitbot = FitFriends_bot('123456:TEST', bot=FakeBot())
+        application = fitbot.application
+        await application.initialize()
+        for data in ('x' * 64, 'premium_offer', 'start_survey'):
+            await application.process_update(Update.de_json(users.callback(710000, data), application.bot))
+        await shared_db.flush()
+        await application.shutdown()
+
+    asyncio.run(scenario())
+    conn = sqlite3.connect(shared_db.db_path)
+    events = conn.execute('SELECT event FROM lead_events WHERE user_id = 710000 ORDER BY id').fetchall()
+    conn.close()
+    assert events == [('premium_offer',), ('start_survey',)]
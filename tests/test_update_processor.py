@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+from telegram import Update
+
+from fakes import FakeBot
+from loadtest import SyntheticUsers
+
+AI_DELAY = 1.0
+
+
+def test_callbacks_are_not_blocked_by_slow_ai_of_other_users(monkeypatch):
+    from ai_engine import ai_engine
+    from bot import FitFriends_bot
+
+    async def slow_stream(user_message, *args, **kwargs):
+        await asyncio.sleep(AI_DELAY)
+        yield f"Ответ на: {user_message}"
+
+    monkeypatch.setattr(ai_engine, 'stream_ai_response', slow_stream)
+
+    async def scenario():
+        fitbot = FitFriends_bot('123456:TEST', bot=FakeBot())
+        application = fitbot.application
+        processor = application.update_processor
+        process = processor.do_process_update
+        finished = []  # (user_id, вид апдейта, с момента постановки в очередь)
+        enqueued = {}
+        done = asyncio.Event()
+
+        async def timed_process(update, coroutine):
+            await process(update, coroutine)
+            kind = 'callback' if update.callback_query else 'chat'
+            finished.append((update.effective_user.id, kind, time.perf_counter() - enqueued[update.update_id]))
+            if len(finished) == len(enqueued):
+                done.set()
+
+        processor.do_process_update = timed_process
+        await application.initialize()
+        await application.start()
+
+        users = SyntheticUsers(0, {})
+        updates = []
+        # Вопросы AI-чату от 20 пользователей, потом кнопки других 20
+        for user_id in range(700000, 700020):
+            updates.append(users.message(user_id, f'Как тренироваться, вопрос {user_id}?'))
+        for user_id in range(700100, 700120):
+            updates.append(users.callback(user_id, 'quick_workout'))
+        # Один пользователь: вопрос, сразу за ним кнопка - кнопка ждет ответа на вопрос
+        updates.append(users.message(700200, 'Что съесть перед тренировкой?'))
+        updates.append(users.callback(700200, 'nutrition_plan'))
+
+        for data in updates:
+            update = Update.de_json(data, application.bot)
+            enqueued[update.update_id] = time.perf_counter()
+            await application.update_queue.put(update)
+
+        await asyncio.wait_for(done.wait(), 10)
+        await application.stop()
+        await application.shutdown()
+        return finished
+
+    finished = asyncio.run(scenario())
+    callbacks = [latency for user_id, kind, latency in finished if kind == 'callback' and user_id != 700200]
+    chats = [latency for user_id, kind, latency in finished if kind == 'chat']
+    assert len(callbacks) == 20 and len(chats) == 21
+    assert max(callbacks) < AI_DELAY / 4
+    assert min(chats) >= AI_DELAY
+
+    own = [(kind, latency) for user_id, kind, latency in finished if user_id == 700200]
+    assert [kind for kind, _ in own] == ['chat', 'callback']
+    assert own[1][1] >= AI_DELAY
@@ -0,0 +1,109 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from telegram.ext import Application
+
+from fakes import FakeBot
+from loadtest import SyntheticUsers
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'webhook-secret'
+
+
+def run_with_client(scenario, queue_size=10):
+    async def main():
+        application = Application.builder().bot(FakeBot()).update_queue(asyncio.Queue(maxsize=queue_size)).build()
+        server = WebhookServer(application, '127.0.0.1', 0, '/telegram', secret_token=SECRET, enqueue_timeout=0.1)
+        async with TestClient(TestServer(server.make_app())) as client:
+            return await scenario(client, server, application.update_queue)
+
+    return asyncio.run(main())
+
+
+def test_recorded_updates_are_queued():
+    users = SyntheticUsers(0, {})
+    recorded = [users.message(100001, '/start'), users.callback(100001, 'quick_workout'),
+                users.message(100002, 'Как похудеть к лету?')]
+
+    async def scenario(client, server, queue):
+        statuses = []
+        for data in recorded:
+            response = await client.post('/telegram', json=data, headers={SECRET_HEADER: SECRET})
+            statuses.append(response.status)
+        updates = [queue.get_nowait() for _ in range(queue.qsize())]
+        return statuses, updates, server.accepted
+
+    statuses, updates, accepted = run_with_client(scenario)
+    assert statuses == [200, 200, 200] and accepted == 3
+    assert [update.update_id for update in updates] == [data['update_id'] for data in recorded]
+    assert updates[1].callback_query.data == 'quick_workout'
+    assert updates[2].message.text == 'Как похудеть к лету?'
+
+
+def test_wrong_secret_and_bad_payload_are_rejected():
+    data = SyntheticUsers(0, {}).message(100001, '/start')
+
+    async def scenario(client, server, queue):
+        statuses = [
+            (await client.post('/telegram', json=data)).status,
+            (await client.post('/telegram', json=data, headers={SECRET_HEADER: 'guess'})).status,
+            (await client.post('/telegram', data=b'not json', headers={SECRET_HEADER: SECRET})).status,
+            (await client.post('/telegram', json=[data], headers={SECRET_HEADER: SECRET})).status,
+        ]
+        return statuses, queue.qsize(), server.accepted
+
+    assert run_with_client(scenario) == ([403, 403, 400, 400], 0, 0)
+
+
+def test_full_queue_answers_503():
+    users = SyntheticUsers(0, {})
+
+    async def scenario(client, server, queue):
+        first = await client.post('/telegram', json=users.message(100001, '/start'), headers={SECRET_HEADER: SECRET})
+        second = await client.post('/telegram', json=users.message(100002, '/start'), headers={SECRET_HEADER: SECRET})
+        # Очередь освободилась - повторная доставка Telegram проходит
+        queue.get_nowait()
+        retry = await client.post('/telegram', json=users.message(100002, '/start'), headers={SECRET_HEADER: SECRET})
+        return first.status, second.status, retry.status, server.rejected, queue.qsize()
+
+    assert run_with_client(scenario, queue_size=1) == (200, 503, 200, 1, 1)
+
+
+def test_started_bot_answers_503_while_updates_are_in_work(monkeypatch):
+    import config
+    from ai_engine import ai_engine
+    from bot import FitFriends_bot
+
+    async def slow_stream(user_message, *args, **kwargs):
+        await asyncio.sleep(1)
+        yield 'Ответ'
+
+    monkeypatch.setattr(ai_engine, 'stream_ai_response', slow_stream)
+    monkeypatch.setattr(config, 'UPDATE_QUEUE_SIZE', 10)
+    users = SyntheticUsers(0, {})
+
+    async def main():
+        fitbot = FitFriends_bot('123456:TEST', bot=FakeBot())
+        application = fitbot.application
+        await application.initialize()
+        await application.start()
+        server = WebhookServer(application, '127.0.0.1', 0, '/telegram', secret_token=SECRET, enqueue_timeout=0.2)
+        try:
+            async with TestClient(TestServer(server.make_app())) as client:
+                responses = await asyncio.gather(*(
+                    client.post('/telegram', json=users.message(user_id, 'Как похудеть?'),
+                                headers={SECRET_HEADER: SECRET})
+                    for user_id in range(900000, 900030)
+                ))
+                statuses = sorted(response.status for response in responses)
+                tasks = sum('process_concurrent_update' in task.get_name() for task in asyncio.all_tasks())
+        finally:
+            await application.stop()
+            await application.shutdown()
+        return statuses, tasks, application.update_queue.qsize()
+
+    statuses, tasks, left = asyncio.run(main())
+    # Обработка занимает секунду: принято ровно столько, сколько помещается в работу
+    assert statuses == [200] * 10 + [503] * 20
+    assert tasks == 10 and left == 0
+
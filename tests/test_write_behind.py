@@ -0,0 +1,83 @@
+import asyncio
+import sqlite3
+
+from database import Database
+
+
+def test_failing_row_is_dropped_and_rest_of_batch_is_saved(tmp_path):
+    db = Database(str(tmp_path / 'write_behind.db'))
+
+    async def scenario():
+        await db.add_user(1, 'anna', 'Аня', None)
+        # NULL в lead_events.event нарушает NOT NULL - раньше такая пачка повторялась вечно
+        await db.record_lead_event(1, None)
+        await db.record_lead_event(1, 'premium_offer')
+        await db.update_conversation(1, 'Привет', 'Здравствуй!')
+        await db.update_lead_stage(1, 'engaged')
+        saved = await db.flush()
+        return saved, len(db._pending), await db.flush()
+
+    saved, pending, second = asyncio.run(scenario())
+    db.close()
+    assert saved == 5 and pending == 0 and second == 0
+
+    conn = sqlite3.connect(db.db_path)
+    assert conn.execute('SELECT event FROM lead_events').fetchall() == [('premium_offer',)]
+    assert conn.execute('SELECT user_message FROM conversation_messages').fetchall() == [('Привет',)]
+    assert conn.execute('SELECT stage FROM leads WHERE user_id = 1').fetchone() == ('engaged',)
+    conn.close()
+
+
+def test_failed_flush_is_retried_with_backoff(tmp_path):
+    db = Database(str(tmp_path / 'write_behind.db'))
+    db.flush_threshold = 1
+    db.flush_interval = 0.05
+    calls = []
+    apply_batch = db._apply_batch
+
+    def flaky(cur, batch):
+        calls.append(len(batch))
+        if len(calls) <= 2:
+            raise sqlite3.OperationalError('database is locked')
+        apply_batch(cur, batch)
+
+    db._apply_batch = flaky
+
+    async def scenario():
+        await db.add_user(1, 'anna', 'Аня', None)
+        for i in range(20):
+            await db.update_conversation(1, f'вопрос {i}', 'ответ')
+            await asyncio.sleep(0.005)
+        # Две ошибки: пауза 0.1 и 0.2 с, а не повтор на каждую из 20 мутаций
+        attempts = len(calls)
+        await asyncio.sleep(0.5)
+        return attempts
+
+    attempts = asyncio.run(scenario())
+    db.close()
+    assert attempts <= 2
+    assert len(calls) == 3
+    conn = sqlite3.connect(db.db_path)
+    assert conn.execute('SELECT COUNT(*) FROM conversation_messages').fetchone() == (20,)
+    conn.close()
+
+
+def test_timed_flush_works_in_a_new_event_loop(tmp_path):
+    db = Database(str(tmp_path / 'write_behind.db'))
+    db.flush_interval = 0.05
+
+    async def write(text, wait):
+        await db.update_conversation(1, text, 'ответ')
+        await asyncio.sleep(wait)
+        return len(db._pending)
+
+    # Первый цикл закрывается, пока таймер сброса еще не сработал
+    assert asyncio.run(write('первый', 0)) == 1
+    # Во втором цикле сброс по таймеру забирает и остаток первого
+    assert asyncio.run(write('второй', 0.3)) == 0
+    db.close()
+    conn = sqlite3.connect(db.db_path)
+    assert conn.execute('SELECT user_message FROM conversation_messages ORDER BY id').fetchall() == [
+        ('первый',), ('второй',)
+    ]
+    conn.close()
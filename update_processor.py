@@ -0,0 +1,126 @@
+import asyncio
+from collections import deque
+
+from telegram.ext import BaseUpdateProcessor
+
+
+class UpdateQueue(asyncio.Queue):
+    """update_queue приложения, ограниченная апдейтами в очереди и в обработке.
+
+    С concurrent_updates Application забирает апдейт из очереди сразу и
+    запускает для него задачу, так что обычный maxsize никогда не
+    заполняется. Здесь место освобождает task_done(), который Application
+    вызывает после обработки: put() ждет (polling перестает забирать
+    getUpdates, webhook отвечает 503), пока в работе limit апдейтов.
+    """
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.admitted = 0  # апдейтов в очереди и в обработке
+        self._waiting = deque()  # put(), ждущие места
+
+    def full(self):
+        return self.admitted >= self.limit
+
+    async def put(self, item):
+        while self.full():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiting.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Освободившееся место достается следующему ожидающему
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+        self.put_nowait(item)
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        self.admitted += 1
+
+    def task_done(self):
+        super().task_done()
+        self.admitted -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiting:
+            waiter = self._waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов разных пользователей со строгим порядком
+    внутри одного пользователя.
+
+    Апдейты одного пользователя ждут друг друга на его блокировке (asyncio.Lock
+    отпускает ожидающих по очереди), а число одновременно работающих
+    обработчиков ограничено отдельным семафором, который берется уже после
+    блокировки - очередь одного пользователя не занимает слоты остальных.
+    Медленные апдейты (is_slow, например вопросы AI-чату) занимают не больше
+    max_slow_updates слотов: остальные всегда свободны для быстрых кнопок.
+    """
+
+    def __init__(self, max_concurrent_updates, max_pending_updates=None, max_slow_updates=None, is_slow=None):
+        # Семафор базового класса ограничивает апдейты в работе вместе с ожидающими
+        super().__init__(max_pending_updates or max_concurrent_updates * 10)
+        self.workers = max_concurrent_updates
+        self._worker_slots = asyncio.Semaphore(max_concurrent_updates)
+        self.is_slow = is_slow
+        self._slow_slots = asyncio.Semaphore(max_slow_updates) if is_slow and max_slow_updates else None
+        self._locks = {}  # ключ пользователя -> [Lock, число апдейтов в работе]
+        self.active = 0  # апдейтов в работе и в ожидании своей очереди
+
+    @staticmethod
+    def ordering_key(update):
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        return chat.id if chat is not None else None
+
+    def load(self):
+        """Занятость обработки: апдейтов в работе на один слот (больше 1 - есть очередь)"""
+        return self.active / self.workers
+
+    async def do_process_update(self, update, coroutine):
+        self.active += 1
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            self.active -= 1
+
+    async def _process_in_order(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            await self._run(update, coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def _run(self, update, coroutine):
+        if self._slow_slots is not None and self.is_slow(update):
+            async with self._slow_slots, self._worker_slots:
+                await coroutine
+            return
+        async with self._worker_slots:
+            await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
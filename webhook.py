@@ -0,0 +1,79 @@
+import hmac
+import asyncio
+import logging
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class WebhookServer:
+    """Прием апдейтов Telegram на локальном aiohttp-сервере.
+
+    Апдейты кладутся в ограниченную update_queue приложения. Если очередь не
+    освободилась за enqueue_timeout, отвечаем 503 - Telegram повторит доставку
+    позже, так что перегрузка не копится в памяти. В шардированном режиме
+    вместо очереди приложения апдейт (dict) принимает enqueue.
+    """
+
+    def __init__(self, application, host, port, path, secret_token=None, enqueue_timeout=5, enqueue=None):
+        self.application = application
+        self.enqueue = enqueue or self.enqueue_update
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.enqueue_timeout = enqueue_timeout
+        self.runner = None
+
+        self.accepted = 0
+        self.rejected = 0
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def start(self):
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"🌐 Webhook слушает http://{self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Перестает принимать апдейты; уже принятые дорабатывает Application.stop()"""
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request):
+        if self.secret_token:
+            received = request.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(received, self.secret_token):
+                return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            if not isinstance(data, dict):
+                raise ValueError('апдейт должен быть объектом')
+        except Exception as e:
+            logger.warning(f"Некорректный апдейт в webhook: {e}")
+            return web.Response(status=400)
+
+        try:
+            await asyncio.wait_for(self.enqueue(data), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return web.Response(status=503)
+        except Exception as e:
+            logger.warning(f"Некорректный апдейт в webhook: {e}")
+            return web.Response(status=400)
+
+        self.accepted += 1
+        return web.Response()
+
+    async def enqueue_update(self, data):
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)